@@ -0,0 +1,5 @@
+"""
+benchmarks for the REST API hot paths, run from the salestock directory:
+    python -m benchmarks.serializers --products 10000
+every benchmark create its own throwaway test database.
+"""
@@ -0,0 +1,110 @@
+from __future__ import print_function, unicode_literals
+
+import argparse
+import contextlib
+import json
+import os
+import resource
+import sys
+import time
+import traceback
+
+
+def setup_django():
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "salestock.settings")
+    import django
+    django.setup()
+
+
+@contextlib.contextmanager
+def test_database(keepdb=False):
+    """
+    create a test database like manage.py test does, so benchmarks never touch db.sqlite3
+    """
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, keepdb=keepdb)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
+        teardown_test_environment()
+
+
+def timed(func, repeat=1):
+    """
+    call func repeat times, return list of durations in seconds
+    """
+    durations = []
+    for _ in range(repeat):
+        started = time.time()
+        func()
+        durations.append(time.time() - started)
+    return durations
+
+
+def percentile(values, percent):
+    """
+    nearest rank percentile of a non empty list
+    """
+    values = sorted(values)
+    rank = max(int(round(percent / 100.0 * len(values))) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def peak_memory():
+    """
+    peak resident set size of this process so far, in kilobytes
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on linux
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def run_isolated(func):
+    """
+    run func in a forked child and return (its result, its peak memory in kilobytes).
+    a forked child peak start at the memory it shares with the parent, so the
+    peak is the one of func alone, not the high water mark of every previous run.
+    func result must be JSON serializable, writes it make are lost with the child.
+    without fork (windows) func run in this process and the peak is None
+    """
+    if not hasattr(os, 'fork'):
+        return func(), None
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            started = peak_memory()
+            result = func()
+            payload = {'result': result, 'peak': peak_memory() - started}
+        except BaseException:
+            payload = {'error': traceback.format_exc()}
+        with os.fdopen(write_fd, 'wb') as f:
+            f.write(json.dumps(payload).encode('utf-8'))
+        # skip atexit and test database teardown, they belong to the parent
+        os._exit(0)
+
+    os.close(write_fd)
+    with os.fdopen(read_fd, 'rb') as f:
+        data = f.read()
+    os.waitpid(pid, 0)
+    if not data:
+        raise RuntimeError("benchmark child %d died without a result" % pid)
+    payload = json.loads(data.decode('utf-8'))
+    if 'error' in payload:
+        raise RuntimeError("benchmark child failed:\n%s" % payload['error'])
+    return payload['result'], payload['peak']
+
+
+def parser(description):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    return parser
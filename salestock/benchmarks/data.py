@@ -0,0 +1,75 @@
+from __future__ import unicode_literals
+
+import datetime
+import random
+
+from django.db import transaction
+from django.utils import timezone
+
+
+SIZES = ['XS', 'S', 'M', 'L', 'XL', '38', '40', '42']
+COLORS = ['Black', 'White', 'Navy', 'Red', 'Green', 'Grey', 'Mocca', 'Purple',
+          'Black, White', 'Blue, Grey, Red', 'Yellow', 'Orange']
+STYLES = ['Basic', 'Slim', 'Oversized', 'Vintage', 'Casual', 'Formal', 'Sport', 'Striped',
+          'Printed', 'Classic', 'Cropped', 'Relaxed']
+MATERIALS = ['Cotton', 'Linen', 'Denim', 'Leather', 'Wool', 'Silk', 'Jersey', 'Canvas']
+ITEMS = ['Shirt', 'T-Shirt', 'Dress', 'Skirt', 'Jacket', 'Jeans', 'Shorts', 'Sneakers',
+         'Boots', 'Bag', 'Hoodie', 'Cardigan', 'Blouse', 'Chinos', 'Sandals', 'Scarf']
+
+
+# catalog sizes for --preset
+PRESETS = {
+    '10k': 10000,
+    '100k': 100000,
+    '1m': 1000000,
+}
+
+
+def create_catalog(products=10000, categories=20, seed=0, batch_size=5000, search_index=True):
+    """
+    seeded synthetic catalog, same arguments always give the same rows.
+    rows are inserted with bulk_create, color n-grams and search index are built in batches,
+    skip the search index when the benchmark doesn't search, it's the slowest part.
+    category stats and price histograms are rebuilt at the end, like after an import
+    """
+    from django.core.management import call_command
+    from django.utils.six import StringIO
+    from products.models import Category, Product, ProductColorNgram, SearchPosting
+
+    rng = random.Random(seed)
+    now = timezone.now()
+    with transaction.atomic():
+        Category.objects.bulk_create([
+            Category(title="Category %d" % i, slug="category-%d" % i,
+                     description="description of category %d" % i, updated=now)
+            for i in range(categories)
+        ])
+    category_ids = list(Category.objects.order_by('pk').values_list('pk', flat=True))
+
+    for start in range(0, products, batch_size):
+        with transaction.atomic():
+            batch = []
+            for i in range(start, min(start + batch_size, products)):
+                color = rng.choice(COLORS)
+                batch.append(Product(
+                    title="%s %s %s %d" % (rng.choice(STYLES), rng.choice(MATERIALS), rng.choice(ITEMS), i),
+                    slug="product-%d" % i,
+                    category_id=rng.choice(category_ids),
+                    size=rng.choice(SIZES),
+                    color=color,
+                    color_normalized=Product.normalize_color(color),
+                    price=rng.randint(10, 1000) * 1000,
+                    active=rng.random() > 0.05,
+                    created=now - datetime.timedelta(minutes=products - i),
+                    updated=now,
+                ))
+            Product.objects.bulk_create(batch)
+            written = list(Product.objects.get_queryset().filter(
+                slug__in=[p.slug for p in batch]
+            ).only('id', 'color', 'title', 'category'))
+            ProductColorNgram.objects.index_products(written)
+            if search_index:
+                SearchPosting.objects.index_products(written)
+    # bulk_create skip the signals keeping them up to date
+    call_command('rebuild_category_stats', stdout=StringIO())
+    return category_ids
@@ -0,0 +1,87 @@
+"""
+catalog export as ndjson against the columnar format: file size, export time,
+and scan time of an analytics style query (products of a category in a price
+range) reading the file back:
+    python -m benchmarks.export --products 100000
+"""
+from __future__ import division, print_function, unicode_literals
+
+import io
+import json
+import os
+import shutil
+import tempfile
+
+from benchmarks.base import parser, setup_django, test_database, timed
+
+
+def main():
+    arguments = parser(__doc__)
+    arguments.add_argument('--min-price', type=int, default=200000)
+    arguments.add_argument('--max-price', type=int, default=400000)
+    arguments.add_argument('--category', default='category-1')
+    args = arguments.parse_args()
+    setup_django()
+
+    from products import columnar, export
+    from products.models import Category, Product
+    from benchmarks.data import create_catalog
+
+    directory = tempfile.mkdtemp()
+    paths = {name: os.path.join(directory, 'products.%s' % name) for name in ('ndjson', 'columnar')}
+
+    def write_ndjson():
+        with io.open(paths['ndjson'], 'wb') as f:
+            for line in export.iter_export(Product.objects.all(), 'ndjson'):
+                f.write(line.encode('utf-8'))
+
+    def write_columnar():
+        with io.open(paths['columnar'], 'wb') as f:
+            export.write_columnar(export.iter_rows(Product.objects.all()), f,
+                                  dict(Category.objects.values_list('pk', 'slug')))
+
+    def scan_ndjson():
+        category_id = categories[args.category]
+        slugs = []
+        with io.open(paths['ndjson'], 'rb') as f:
+            for line in f:
+                row = json.loads(line.decode('utf-8'))
+                if row['category'] == category_id and args.min_price <= int(row['price']) <= args.max_price:
+                    slugs.append(row['slug'])
+        return slugs
+
+    def scan_columnar():
+        with columnar.ColumnarFile(paths['columnar']) as table:
+            rows = table.filter(min_price=args.min_price, max_price=args.max_price, category=args.category)
+            return [slug for slug, in table.read(rows, ['slug'])]
+
+    try:
+        with test_database():
+            create_catalog(args.products, args.categories, args.seed, search_index=False)
+            categories = dict(Category.objects.values_list('slug', 'pk'))
+            write = {
+                'ndjson': min(timed(write_ndjson, args.repeat)),
+                'columnar': min(timed(write_columnar, args.repeat)),
+            }
+
+        results = {}
+        scan = {
+            'ndjson': min(timed(lambda: results.__setitem__('ndjson', scan_ndjson()), args.repeat)),
+            'columnar': min(timed(lambda: results.__setitem__('columnar', scan_columnar()), args.repeat)),
+        }
+        assert results['ndjson'] == results['columnar'], "scans found different products"
+
+        print("%d products, scan: %s priced %d to %d, %d matches" % (
+            args.products, args.category, args.min_price, args.max_price, len(results['ndjson'])))
+        for name in ('ndjson', 'columnar'):
+            print("%-9s size %10.1f kB  export %8.3f s  scan %8.3f s" % (
+                name, os.path.getsize(paths[name]) / 1024, write[name], scan[name]))
+        print("columnar is %.1fx smaller and scan %.1fx faster" % (
+            os.path.getsize(paths['ndjson']) / os.path.getsize(paths['columnar']),
+            scan['ndjson'] / scan['columnar']))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
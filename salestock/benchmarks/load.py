@@ -0,0 +1,152 @@
+"""
+concurrent connection capacity of a running server, to compare the WSGI and
+evented entry points at equal memory, ex: 4 sync workers against 1 evented
+process with EVENTED_THREADS=8, then check the reported server memory:
+    gunicorn salestock.wsgi --workers 4 --bind 127.0.0.1:8000
+    python -m salestock.evented --bind 127.0.0.1:8001
+    python -m benchmarks.load --url http://127.0.0.1:8000 --slow 200 --pid <server pids>
+    python -m benchmarks.load --url http://127.0.0.1:8001 --slow 200 --pid <server pids>
+
+slow clients request a large listing and read it at --slow-rate bytes/s, holding
+their connection the whole time. meanwhile probe clients request the
+category list in a loop. a server that keeps answering probes while many slow
+connections are open has more connection capacity.
+"""
+from __future__ import division, print_function, unicode_literals
+
+import argparse
+import socket
+import threading
+import time
+
+from django.utils.six.moves.urllib.parse import urlsplit
+
+from benchmarks.base import percentile
+
+
+class Stats(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.errors = 0
+
+    def add(self, latency=None):
+        with self.lock:
+            if latency is None:
+                self.errors += 1
+            else:
+                self.latencies.append(latency)
+
+
+def request(host, port, path, stop, rate=None, timeout=60):
+    """
+    send a GET with Connection: close and read the whole response, at rate
+    bytes per second when given. return the status code, None when stopped
+    """
+    connection = socket.create_connection((host, port), timeout=timeout)
+    try:
+        connection.sendall((
+            'GET %s HTTP/1.1\r\nHost: %s:%d\r\nAccept: application/json\r\nConnection: close\r\n\r\n'
+            % (path, host, port)
+        ).encode('ascii'))
+        head = b''
+        while True:
+            data = connection.recv(4096)
+            if not data:
+                break
+            if stop.is_set():
+                return None
+            head = head or data
+            if rate:
+                time.sleep(len(data) / rate)
+        return int(head.split(b' ', 2)[1])
+    finally:
+        connection.close()
+
+
+def client(stats, stop, host, port, path, rate=None):
+    while not stop.is_set():
+        started = time.time()
+        try:
+            status = request(host, port, path, stop, rate)
+        except (socket.error, ValueError, IndexError):
+            status = 0
+        if stop.is_set():
+            return
+        ok = status == 200
+        stats.add(time.time() - started if ok else None)
+        if not ok:
+            time.sleep(0.1)
+
+
+def get_memory(pids):
+    """
+    resident memory of the server processes in kilobytes, None when unknown
+    """
+    total = 0
+    for pid in pids:
+        try:
+            with open('/proc/%d/status' % pid) as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1])
+        except (IOError, OSError):
+            return None
+    return total
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arguments.add_argument('--url', default='http://127.0.0.1:8000')
+    arguments.add_argument('--slow', type=int, default=100, help="slow client connections")
+    arguments.add_argument('--slow-path', default='/products/?format=fastjson')
+    arguments.add_argument('--slow-rate', type=float, default=16384, help="bytes per second read by slow clients")
+    arguments.add_argument('--probes', type=int, default=4, help="probe client connections")
+    arguments.add_argument('--probe-path', default='/categories/')
+    arguments.add_argument('--duration', type=float, default=30)
+    arguments.add_argument('--pid', type=int, nargs='*', default=[], help="server processes, to report memory")
+    args = arguments.parse_args()
+
+    url = urlsplit(args.url)
+    host, port = url.hostname, url.port or 80
+    slow, probes, stop = Stats(), Stats(), threading.Event()
+    threads = [
+        threading.Thread(target=client, args=(slow, stop, host, port, args.slow_path, args.slow_rate))
+        for _ in range(args.slow)
+    ] + [
+        threading.Thread(target=client, args=(probes, stop, host, port, args.probe_path))
+        for _ in range(args.probes)
+    ]
+    for thread in threads:
+        thread.start()
+
+    peak_memory = None
+    started = time.time()
+    while time.time() - started < args.duration:
+        time.sleep(0.5)
+        memory = get_memory(args.pid) if args.pid else None
+        if memory is not None:
+            peak_memory = max(peak_memory or 0, memory)
+    stop.set()
+    elapsed = time.time() - started
+    for thread in threads:
+        thread.join()
+
+    print("%s, %d slow connections reading %s at %d B/s, %d probes on %s, %.0fs" % (
+        args.url, args.slow, args.slow_path, args.slow_rate, args.probes, args.probe_path, elapsed))
+    for name, stats in [('probe', probes), ('slow', slow)]:
+        with stats.lock:
+            latencies, errors = list(stats.latencies), stats.errors
+        if latencies:
+            print("%-6s %8.1f req/s  p50 %8.1f ms  p95 %8.1f ms  p99 %8.1f ms  errors %d" % (
+                name, len(latencies) / elapsed, percentile(latencies, 50) * 1000,
+                percentile(latencies, 95) * 1000, percentile(latencies, 99) * 1000, errors))
+        else:
+            print("%-6s no completed request, errors %d" % (name, errors))
+    if peak_memory is not None:
+        print("server peak memory %d kB" % peak_memory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+rows per second of product list rendering, JSONRenderer against FastJSONRenderer
+on the same serialized rows, then the whole list (query, serializer, renderer)
+against fastjson rows straight from values_list:
+    python -m benchmarks.renderers --products 10000
+"""
+from __future__ import print_function, unicode_literals
+
+import json
+
+from benchmarks.base import parser, setup_django, test_database, timed
+
+
+def main():
+    args = parser(__doc__).parse_args()
+    setup_django()
+
+    from rest_framework.renderers import JSONRenderer
+    from rest_framework.request import Request
+    from rest_framework.test import APIRequestFactory
+    from products.models import Product
+    from products.renderers import FastJSONRenderer
+    from products.serializers import FlatProductSerializer
+    from products.views import ProductViewSet
+    from benchmarks.data import create_catalog
+
+    with test_database():
+        create_catalog(args.products, args.categories, args.seed, search_index=False)
+        request = Request(APIRequestFactory().get('/products/'))
+        context = {'request': request}
+        queryset = Product.objects.all().for_listing()
+        data = FlatProductSerializer(queryset, many=True, context=context).data
+        count = len(data)
+
+        view = ProductViewSet(request=request, format_kwarg=None, action='list', kwargs={})
+        results = {}
+        for name, run in [
+            ('render: JSONRenderer', lambda: JSONRenderer().render(data)),
+            ('render: FastJSONRenderer', lambda: FastJSONRenderer().render(data)),
+            ('list: serializer + JSONRenderer', lambda: JSONRenderer().render(
+                FlatProductSerializer(queryset.all(), many=True, context=context).data
+            )),
+            ('list: fastjson rows', lambda: FastJSONRenderer().render(view.get_rows(queryset.all()))),
+        ]:
+            best = min(timed(lambda: results.__setitem__(name, run()), args.repeat))
+            print("%-36s %10.0f rows/s" % (name, count / best))
+
+        documents = [json.loads(content.decode('utf-8')) for content in results.values()]
+        assert all(document == documents[0] for document in documents), "renderers output differ"
+
+
+if __name__ == '__main__':
+    main()
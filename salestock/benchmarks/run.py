@@ -0,0 +1,240 @@
+"""
+latency of the REST API hot paths through the whole stack (middleware, url
+routing, views, serializers and renderer) on a seeded catalog:
+    python -m benchmarks.run --preset 100k --output results.json
+    python -m benchmarks.run --preset 100k --baseline benchmarks/baseline.json
+every scenario report p50/p95/p99 latency, requests per second, queries per
+request and peak memory (of the scenario alone, each one run in a forked
+process, so writes of a scenario don't leak in the next one). against a baseline, the run exit with status 1 when a
+scenario is slower than the baseline by more than --tolerance or run more queries.
+"""
+from __future__ import division, print_function, unicode_literals
+
+import io
+import itertools
+import json
+import platform
+import random
+import re
+import sys
+import time
+
+from benchmarks.base import parser, percentile, run_isolated, setup_django, test_database
+
+# compared against the baseline, name -> True when higher is worse
+COMPARED = {
+    'p50_ms': True,
+    'p95_ms': True,
+    'rps': False,
+}
+
+
+def get_scenarios(args):
+    """
+    list of (name, func), func(i) run the i-th request of the scenario and return its status.
+    reads are anonymous, writes are made by a logged in user
+    """
+    from django.contrib.auth.models import User
+    from django.test import Client
+    from rest_framework.request import Request
+    from rest_framework.test import APIRequestFactory
+    from products.management.commands.check_query_plans import SAMPLE_FILTERS
+    from products.models import Category, Product
+    from products.serializers import FlatProductSerializer, ProductSerializer
+
+    rng = random.Random(args.seed)
+    client = Client()
+    slugs = list(Product.objects.all().values_list('slug', flat=True)[:10000])
+    category_ids = list(Category.objects.values_list('pk', flat=True))
+    category_slugs = list(Category.objects.values_list('slug', flat=True))
+
+    def get(path, data=None):
+        return lambda i: client.get(path, data or {}).status_code
+
+    scenarios = [
+        ('product-list', get('/products/', {'page_size': 20})),
+        ('product-list[ordering=-price]', get('/products/', {'page_size': 20, 'ordering': '-price'})),
+    ]
+    for size in range(1, len(SAMPLE_FILTERS) + 1):
+        for combination in itertools.combinations(SAMPLE_FILTERS, size):
+            data = dict(combination, page_size=20)
+            name = 'product-list[%s]' % ','.join(sorted(dict(combination)))
+            scenarios.append((name, get('/products/', data)))
+
+    scenarios += [
+        ('product-detail', lambda i: client.get('/products/%s/' % rng.choice(slugs)).status_code),
+        ('product-category-list', lambda i: client.get(
+            '/products/category/%s/' % rng.choice(category_slugs)
+        ).status_code),
+        ('product-category-list[paginated]', lambda i: client.get(
+            '/products/category/%s/' % rng.choice(category_slugs), {'page_size': 20}
+        ).status_code),
+        ('product-category-list[color,size]', lambda i: client.get(
+            '/products/category/%s/' % rng.choice(category_slugs), {'color': 'black', 'size': 'M'}
+        ).status_code),
+    ]
+
+    # serializer cost alone, on a full page of the listing
+    page = list(Product.objects.all().for_listing()[:100])
+    context = {'request': Request(APIRequestFactory().get('/products/'))}
+    scenarios += [
+        ('serializer[ProductSerializer x100]',
+         lambda i: len(ProductSerializer(page, many=True, context=context).data) and 200),
+        ('serializer[FlatProductSerializer x100]',
+         lambda i: len(FlatProductSerializer(page, many=True, context=context).data) and 200),
+    ]
+
+    writer = Client()
+    writer.force_login(User.objects.create_user('benchmark', 'benchmark@example.com', 'benchmark'))
+
+    created = itertools.count()
+
+    def create(i):
+        return writer.post('/products/', json.dumps({
+            'title': 'Benchmark Product %d' % next(created), 'category': rng.choice(category_ids),
+            'size': 'M', 'color': 'Black', 'price': rng.randint(10, 1000) * 1000,
+        }), content_type='application/json').status_code
+
+    def update(i):
+        return writer.patch('/products/%s/' % rng.choice(slugs), json.dumps({
+            'price': rng.randint(10, 1000) * 1000,
+        }), content_type='application/json').status_code
+
+    scenarios += [
+        ('product-create', create),
+        ('product-update', update),
+    ]
+    return scenarios
+
+
+def run_scenario(func, requests, connection):
+    from django.test.utils import CaptureQueriesContext
+
+    # warm up, first request fill lookup caches and snapshots
+    func(-1)
+    durations, statuses = [], set()
+    started = time.time()
+    for i in range(requests):
+        request_started = time.time()
+        statuses.add(func(i))
+        durations.append(time.time() - request_started)
+    elapsed = time.time() - started
+
+    # queries are counted apart, capturing them slow every query down
+    samples = min(requests, 20)
+    with CaptureQueriesContext(connection) as queries:
+        for i in range(requests, requests + samples):
+            func(i)
+
+    return {
+        'requests': requests,
+        'statuses': sorted(statuses),
+        'p50_ms': round(percentile(durations, 50) * 1000, 3),
+        'p95_ms': round(percentile(durations, 95) * 1000, 3),
+        'p99_ms': round(percentile(durations, 99) * 1000, 3),
+        'rps': round(requests / elapsed, 1),
+        'queries': round(len(queries) / samples, 2),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    return a message for every scenario worse than the baseline
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        for key, higher_is_worse in sorted(COMPARED.items()):
+            if key not in expected:
+                continue
+            if higher_is_worse:
+                worse = result[key] > expected[key] * (1 + tolerance)
+            else:
+                worse = result[key] < expected[key] * (1 - tolerance)
+            if worse:
+                regressions.append('%s %s: %s (baseline %s)' % (name, key, result[key], expected[key]))
+        if result['queries'] > expected.get('queries', result['queries']):
+            regressions.append('%s queries: %s (baseline %s)' % (name, result['queries'], expected['queries']))
+    return regressions
+
+
+def main():
+    arguments = parser(__doc__)
+    arguments.add_argument('--preset', choices=['10k', '100k', '1m'],
+                           help="catalog size, override --products")
+    arguments.add_argument('--requests', type=int, default=200, help="timed requests per scenario")
+    arguments.add_argument('--scenario', default='', help="only run scenarios matching this regex")
+    arguments.add_argument('--output', help="write results to this JSON file")
+    arguments.add_argument('--baseline', help="compare with results of a previous run")
+    arguments.add_argument('--tolerance', type=float, default=0.2,
+                           help="allowed slowdown against the baseline, 0.2 is 20%%")
+    arguments.add_argument('--response-cache', action='store_true',
+                           help="keep the response cache, by default every GET reach the view")
+    args = arguments.parse_args()
+    setup_django()
+
+    import django
+    from django.conf import settings
+    from benchmarks.data import PRESETS, create_catalog
+
+    if args.preset:
+        args.products = PRESETS[args.preset]
+    if not args.response_cache:
+        settings.RESPONSE_CACHE_TIMEOUT = 0
+    settings.ALLOWED_HOSTS = ['testserver']
+
+    with test_database() as connection:
+        started = time.time()
+        create_catalog(args.products, args.categories, args.seed, search_index=False)
+        print("catalog: %d products, %d categories in %.1fs" % (
+            args.products, args.categories, time.time() - started))
+
+        results = {}
+        print("%-44s %9s %9s %9s %9s %8s %10s" % (
+            'scenario', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s', 'queries', 'peak kb'))
+        for name, func in get_scenarios(args):
+            if not re.search(args.scenario, name):
+                continue
+            result, peak = run_isolated(lambda: run_scenario(func, args.requests, connection))
+            result['peak_memory_kb'] = peak
+            results[name] = result
+            print("%-44s %9.2f %9.2f %9.2f %9.1f %8.2f %10s" % (
+                name, result['p50_ms'], result['p95_ms'], result['p99_ms'],
+                result['rps'], result['queries'], peak))
+            if any(status >= 400 for status in result['statuses']):
+                print("  unexpected status %s" % result['statuses'])
+
+    report = {
+        'meta': {
+            'products': args.products,
+            'categories': args.categories,
+            'seed': args.seed,
+            'requests': args.requests,
+            'response_cache': args.response_cache,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+        },
+        'results': results,
+    }
+    if args.output:
+        with io.open(args.output, 'w', encoding='utf-8') as f:
+            f.write('%s\n' % json.dumps(report, indent=2, sort_keys=True))
+
+    if args.baseline:
+        with io.open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline['meta']['products'] != args.products:
+            print("baseline was recorded with %d products" % baseline['meta']['products'])
+        regressions = compare(results, baseline['results'], args.tolerance)
+        for message in regressions:
+            print("REGRESSION %s" % message)
+        if regressions:
+            sys.exit(1)
+        print("no regression against %s" % args.baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""
+queries per second of /products/search/ ranking, plain and combined with
+list filters, on a seeded catalog:
+    python -m benchmarks.search --products 1000000
+"""
+from __future__ import print_function, unicode_literals
+
+import random
+
+from benchmarks.base import parser, setup_django, test_database, timed
+
+
+def main():
+    arguments = parser(__doc__)
+    arguments.add_argument('--queries', type=int, default=200)
+    args = arguments.parse_args()
+    setup_django()
+
+    from products import search
+    from products.models import Product
+    from products.views import ProductFilter
+    from benchmarks.data import ITEMS, MATERIALS, STYLES, create_catalog
+
+    with test_database():
+        duration = timed(lambda: create_catalog(args.products, args.categories, args.seed))[0]
+        print("%-32s %10.0f rows/s (catalog with color and search index)" % ('indexing', args.products / duration))
+
+        rng = random.Random(args.seed)
+        words = [w.lower() for w in STYLES + MATERIALS + ITEMS]
+        queries = [' '.join(rng.sample(words, rng.randint(1, 3))) for _ in range(args.queries)]
+        for name, filters in [
+            ('q', {}),
+            ('q + max_price', {'max_price': '200000'}),
+            ('q + size + color', {'size': 'M', 'color': 'black'}),
+        ]:
+            queryset = ProductFilter(filters, queryset=Product.objects.all()).qs
+
+            def run():
+                for query in queries:
+                    # same work as the endpoint: total count and the first page
+                    ranked = search.rank(query, queryset)
+                    ranked.count()
+                    list(ranked[:20])
+            best = min(timed(run, args.repeat))
+            print("%-32s %10.1f queries/s" % (name, len(queries) / best))
+
+
+if __name__ == '__main__':
+    main()
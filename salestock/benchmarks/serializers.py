@@ -0,0 +1,46 @@
+"""
+rows per second of product list serialization, reverse() per row (before)
+against SlugIdentityField and FlatProductSerializer (after):
+    python -m benchmarks.serializers --products 10000
+"""
+from __future__ import print_function, unicode_literals
+
+from benchmarks.base import parser, setup_django, test_database, timed
+
+
+def main():
+    args = parser(__doc__).parse_args()
+    setup_django()
+
+    from rest_framework import serializers
+    from rest_framework.renderers import JSONRenderer
+    from rest_framework.request import Request
+    from rest_framework.test import APIRequestFactory
+    from products.models import Product
+    from products.serializers import FlatProductSerializer, ProductSerializer
+    from benchmarks.data import create_catalog
+
+    class ReverseProductSerializer(ProductSerializer):
+        detail_url = serializers.HyperlinkedIdentityField(view_name='product-detail', lookup_field='slug')
+
+    with test_database():
+        create_catalog(args.products, args.categories, args.seed)
+        rows = list(Product.objects.all())
+        request = Request(APIRequestFactory().get('/products/'))
+        results = {}
+        for name, serializer_class in [
+            ('before: reverse() per row', ReverseProductSerializer),
+            ('after: ProductSerializer', ProductSerializer),
+            ('after: FlatProductSerializer', FlatProductSerializer),
+        ]:
+            def run():
+                data = serializer_class(rows, many=True, context={'request': request}).data
+                results[name] = JSONRenderer().render(data)
+            best = min(timed(run, args.repeat))
+            print("%-32s %10.0f rows/s" % (name, len(rows) / best))
+
+        assert len(set(results.values())) == 1, "serializers output differ"
+
+
+if __name__ == '__main__':
+    main()
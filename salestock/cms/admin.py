@@ -41,4 +41,14 @@ class ContentManageableAdmin(object):
 
 
 class ContentManageableModelAdmin(ContentManageableAdmin, admin.ModelAdmin):
-    pass
\ No newline at end of file
+
+    def get_queryset(self, request):
+        """
+        creator and last_modified_by are shown on every change form, load them in the same query.
+        changelist skip list_select_related once select_related is set, so it's added here too
+        """
+        queryset = super(ContentManageableModelAdmin, self).get_queryset(request)
+        related = ['creator', 'last_modified_by']
+        if isinstance(self.list_select_related, (list, tuple)):
+            related += list(self.list_select_related)
+        return queryset.select_related(*related)
\ No newline at end of file
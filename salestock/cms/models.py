@@ -15,12 +15,37 @@ class ContentManageable(models.Model):
     creator = models.ForeignKey(User, null=True, blank=True, related_name="%(app_label)s_%(class)s_creator")
     last_modified_by = models.ForeignKey(User, null=True, blank=True, related_name="%(app_label)s_%(class)s_modified")
 
+    """
+    keep the values loaded from database, so save() and signal receivers
+    can tell which fields has changed without another query
+    """
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(ContentManageable, cls).from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def get_loaded_value(self, attname, default=None):
+        return getattr(self, '_loaded_values', {}).get(attname, default)
+
+    def has_changed(self, attname):
+        loaded_values = getattr(self, '_loaded_values', {})
+        if attname not in loaded_values:
+            return True
+        return loaded_values[attname] != getattr(self, attname)
+
     """
     set updated fields with current time
     """
     def save(self, **kwargs):
         self.updated = timezone.now()
-        return super(ContentManageable, self).save(**kwargs)
+        result = super(ContentManageable, self).save(**kwargs)
+        deferred = self.get_deferred_fields()
+        self._loaded_values = {
+            f.attname: getattr(self, f.attname)
+            for f in self._meta.concrete_fields if f.attname not in deferred
+        }
+        return result
 
 
     class Meta:
@@ -0,0 +1,10 @@
+from django.contrib import admin
+from .models import Job
+
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['name', 'key', 'status', 'attempts', 'run_after', 'finished']
+    list_filter = ['status', 'name']
+    readonly_fields = ['created', 'started', 'finished', 'worker']
+
+admin.site.register(Job, JobAdmin)
@@ -0,0 +1,53 @@
+from __future__ import unicode_literals
+
+import multiprocessing
+import os
+import socket
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from jobs.worker import Worker
+
+
+def run_worker(options):
+    Worker(
+        name='%s:%d' % (socket.gethostname(), os.getpid()),
+        batch_size=options['batch_size'],
+        poll_interval=options['poll_interval'],
+    ).run(once=options['once'])
+
+
+class Command(BaseCommand):
+    help = (
+        "Run background job workers, they process the queue filled by "
+        "Job.objects.enqueue() until interrupted"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help="jobs claimed at once, JOBS_BATCH_SIZE by default")
+        parser.add_argument('--poll-interval', type=float, default=None,
+                            help="seconds between polls of an empty queue, JOBS_POLL_INTERVAL by default")
+        parser.add_argument('--once', action='store_true',
+                            help="exit once the queue is empty")
+
+    def handle(self, *args, **options):
+        if options['processes'] <= 1:
+            run_worker(options)
+            return
+        # forked processes must open their own database connections
+        connections.close_all()
+        processes = [
+            multiprocessing.Process(target=run_worker, args=(options,))
+            for _ in range(options['processes'])
+        ]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
+                process.join()
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-18 12:17
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='pending_key',
+            field=models.CharField(blank=True, editable=False, max_length=200, null=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name='job',
+            unique_together=set([('name', 'pending_key')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='job',
+            index_together=set([('status', 'started'), ('status', 'run_after'), ('worker', 'status')]),
+        ),
+    ]
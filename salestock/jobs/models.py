@@ -0,0 +1,138 @@
+from __future__ import unicode_literals
+
+import json
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+from django.utils import six, timezone
+from .tasks import get_task, run_task, task_name
+
+
+def is_eager():
+    """
+    JOBS_EAGER run tasks inside enqueue(), for tests and setups without worker
+    """
+    return getattr(settings, 'JOBS_EAGER', False)
+
+
+class JobManager(models.Manager):
+
+    def enqueue(self, func, payload=None, key=None, delay=0):
+        """
+        queue func(payload) for run_workers. a job with a key is dropped when
+        a queued job of the same task has the same key, so a burst of writes
+        to one row end up as a single run. the unique (name, pending_key)
+        decide, two processes enqueuing the same key at once can't both insert.
+        return the new Job, None when coalesced or run eagerly
+        """
+        name = task_name(func)
+        if is_eager():
+            run_task(name, [payload])
+            return None
+        key = '' if key is None else six.text_type(key)
+        try:
+            with transaction.atomic():
+                return self.create(
+                    name=name,
+                    key=key,
+                    pending_key=key or None,
+                    payload=json.dumps(payload),
+                    max_attempts=func.job_max_attempts,
+                    run_after=timezone.now() + timedelta(seconds=delay),
+                )
+        except IntegrityError:
+            return None
+
+    def claim(self, worker, batch_size):
+        """
+        mark up to batch_size due jobs of a single task as running and return
+        them, the oldest due job pick the task. the UPDATE only takes rows
+        still pending, so concurrent workers never claim the same job
+        """
+        now = timezone.now()
+        due = self.filter(status=self.model.PENDING, run_after__lte=now).order_by('run_after', 'pk')
+        name = due.values_list('name', flat=True).first()
+        if name is None:
+            return []
+        pks = list(due.filter(name=name).values_list('pk', flat=True)[:batch_size])
+        token = '%s:%s' % (worker, uuid.uuid4().hex[:12])
+        # a claimed job no longer absorb new jobs, its run may have started
+        self.filter(pk__in=pks, status=self.model.PENDING).update(
+            status=self.model.RUNNING, worker=token, started=now, attempts=F('attempts') + 1, pending_key=None,
+        )
+        return list(self.filter(worker=token, status=self.model.RUNNING).order_by('pk'))
+
+    def requeue_stale(self, timeout):
+        """
+        jobs running longer than timeout seconds lost their worker, put them
+        back in the queue, or fail them when they're out of attempts
+        """
+        stale = self.filter(status=self.model.RUNNING, started__lt=timezone.now() - timedelta(seconds=timeout))
+        error = "worker didn't finish in %d seconds" % timeout
+        failed = stale.filter(attempts__gte=F('max_attempts')).update(
+            status=self.model.FAILED, finished=timezone.now(), last_error=error,
+        )
+        requeued = stale.update(status=self.model.PENDING, run_after=timezone.now(), last_error=error)
+        return requeued + failed
+
+    def purge(self, age):
+        """
+        delete jobs done more than age seconds ago
+        """
+        before = timezone.now() - timedelta(seconds=age)
+        return self.filter(status=self.model.DONE, finished__lt=before).delete()[0]
+
+
+class Job(models.Model):
+    """
+    a queued call of a @task function, see jobs.tasks and jobs.worker
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    # dotted path of the task function
+    name = models.CharField(max_length=200)
+    # pending jobs of the same task and key are coalesced, blank never coalesce
+    key = models.CharField(max_length=200, blank=True, default='')
+    # key until the job is first claimed, NULL after (NULLs never collide), so
+    # jobs put back in the queue by a retry don't take new jobs in
+    pending_key = models.CharField(max_length=200, null=True, blank=True, editable=False)
+    payload = models.TextField(default='null')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    worker = models.CharField(max_length=100, blank=True, default='')
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    objects = JobManager()
+
+    def __unicode__(self):
+        return '%s(%s) %s' % (self.name, self.key, self.status)
+
+    def get_payload(self):
+        return json.loads(self.payload)
+
+    def get_task(self):
+        return get_task(self.name)
+
+    class Meta:
+        unique_together = [('name', 'pending_key')]
+        index_together = [
+            ('status', 'run_after'),
+            ('status', 'started'),
+            ('worker', 'status'),
+        ]
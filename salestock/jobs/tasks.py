@@ -0,0 +1,45 @@
+"""
+a task is a plain function decorated with @task, jobs refer to it by dotted path:
+
+    @task(batch=True)
+    def refresh_category_stats(payloads):
+        ...
+
+    Job.objects.enqueue(refresh_category_stats, [category.pk], key=category.pk)
+
+a batch task receive the payloads of every job claimed together, so it can do
+the work once for all of them. other tasks are called once per payload.
+"""
+from __future__ import unicode_literals
+
+from django.utils.module_loading import import_string
+
+
+def task(batch=False, max_attempts=5):
+    def decorator(func):
+        func.job_batch = batch
+        func.job_max_attempts = max_attempts
+        return func
+    return decorator
+
+
+def task_name(func):
+    if not hasattr(func, 'job_batch'):
+        raise ValueError("%r is not decorated with @task" % func)
+    return '%s.%s' % (func.__module__, func.__name__)
+
+
+def get_task(name):
+    func = import_string(name)
+    if not hasattr(func, 'job_batch'):
+        raise ValueError("%s is not decorated with @task" % name)
+    return func
+
+
+def run_task(name, payloads):
+    func = get_task(name)
+    if func.job_batch:
+        func(payloads)
+    else:
+        for payload in payloads:
+            func(payload)
@@ -0,0 +1,180 @@
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework import status
+from datetime import timedelta
+import json
+import logging
+import time
+
+from .models import Job
+from .tasks import task, task_name
+from . import worker
+from .worker import Worker
+# Create your tests here.
+
+calls = []
+
+
+@task(batch=True)
+def record_batch(payloads):
+    if 'fail' in payloads:
+        raise ValueError("bad payload")
+    calls.append(('batch', sorted(payloads)))
+
+
+@task(max_attempts=2)
+def record_one(payload):
+    if payload == 'fail':
+        raise ValueError("bad payload")
+    calls.append(('one', payload))
+
+
+def not_a_task(payload):
+    pass
+
+
+class JobQueueTest(TestCase):
+
+    def setUp(self):
+        del calls[:]
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        # replace the console handler, keep the test output clean
+        self.addCleanup(setattr, worker.logger, 'handlers', worker.logger.handlers)
+        worker.logger.handlers = [handler]
+        self.log = records
+
+    def work(self):
+        Worker(name='test').run(once=True)
+
+    def test_enqueue_coalesce_pending_jobs_with_same_key(self):
+        first = Job.objects.enqueue(record_batch, 1, key='shirts')
+        self.assertIsNone(Job.objects.enqueue(record_batch, 2, key='shirts'))
+        self.assertIsNotNone(Job.objects.enqueue(record_batch, 3, key='shoes'))
+        self.assertIsNotNone(Job.objects.enqueue(record_batch, 4))
+        self.assertIsNotNone(Job.objects.enqueue(record_batch, 5))
+        self.assertEqual(first.name, 'jobs.tests.record_batch')
+        self.assertEqual(Job.objects.filter(status=Job.PENDING).count(), 4)
+
+        # a claimed job doesn't absorb new changes, they need another run
+        Job.objects.claim('other', 10)
+        self.assertIsNotNone(Job.objects.enqueue(record_batch, 6, key='shirts'))
+        self.assertIsNone(Job.objects.enqueue(record_batch, 7, key='shirts'))
+
+    def test_enqueue_reject_plain_function(self):
+        with self.assertRaises(ValueError):
+            Job.objects.enqueue(not_a_task, 1)
+
+    @override_settings(JOBS_EAGER=True)
+    def test_eager_run_inside_enqueue(self):
+        self.assertIsNone(Job.objects.enqueue(record_batch, 1, key='shirts'))
+        self.assertIsNone(Job.objects.enqueue(record_one, 2))
+        self.assertEqual(calls, [('batch', [1]), ('one', 2)])
+        self.assertFalse(Job.objects.exists())
+
+    def test_worker_run_jobs_of_a_task_in_one_batch(self):
+        for payload in range(5):
+            Job.objects.enqueue(record_batch, payload)
+        Job.objects.enqueue(record_one, 'a')
+        Job.objects.enqueue(record_one, 'b')
+        Job.objects.enqueue(record_batch, 10, delay=60)
+
+        batch_worker = Worker(name='test', batch_size=3)
+        batch_worker.last_cleanup = time.time()
+        with self.assertNumQueries(7):
+            # claim (4 queries), task in a savepoint (2 queries), mark done
+            self.assertEqual(batch_worker.run_once(), 3)
+        self.work()
+        self.assertEqual(calls, [('batch', [0, 1, 2]), ('batch', [3, 4]), ('one', 'a'), ('one', 'b')])
+        self.assertEqual(Job.objects.filter(status=Job.DONE).count(), 7)
+        self.assertEqual(Job.objects.get(status=Job.PENDING).get_payload(), 10)
+
+    def test_claim_skip_jobs_claimed_by_another_worker(self):
+        for payload in range(4):
+            Job.objects.enqueue(record_batch, payload)
+        first = Job.objects.claim('a', 2)
+        second = Job.objects.claim('b', 10)
+        self.assertEqual([job.get_payload() for job in first], [0, 1])
+        self.assertEqual([job.get_payload() for job in second], [2, 3])
+        self.assertEqual(Job.objects.claim('c', 10), [])
+        self.assertEqual({job.attempts for job in first + second}, {1})
+
+    def test_failed_batch_only_fail_the_bad_job(self):
+        for payload in [1, 'fail', 2]:
+            Job.objects.enqueue(record_batch, payload)
+        self.work()
+        self.assertEqual(calls, [('batch', [1]), ('batch', [2])])
+        job = Job.objects.get(status=Job.PENDING)
+        self.assertEqual(job.get_payload(), 'fail')
+        self.assertIn("bad payload", job.last_error)
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertEqual(len(self.log), 1)
+
+    def test_retry_with_backoff_then_fail(self):
+        job = Job.objects.enqueue(record_one, 'fail')
+        self.assertEqual(job.max_attempts, 2)
+        self.work()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.PENDING, 1))
+        self.assertEqual(worker.retry_delay(1), worker.RETRY_DELAY)
+        self.assertEqual(worker.retry_delay(3), worker.RETRY_DELAY * 4)
+
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        self.work()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+        self.assertIn("ValueError", job.last_error)
+
+    def test_requeue_stale_running_jobs(self):
+        lost = Job.objects.enqueue(record_one, 'lost')
+        exhausted = Job.objects.enqueue(record_one, 'exhausted')
+        Job.objects.claim('gone', 10)
+        Job.objects.filter(pk=exhausted.pk).update(attempts=2)
+        Job.objects.update(started=timezone.now() - timedelta(seconds=600))
+
+        self.assertEqual(Job.objects.requeue_stale(300), 2)
+        self.assertEqual(Job.objects.get(pk=lost.pk).status, Job.PENDING)
+        self.assertEqual(Job.objects.get(pk=exhausted.pk).status, Job.FAILED)
+        self.work()
+        self.assertEqual(calls, [('one', 'lost')])
+
+    def test_purge_done_jobs(self):
+        Job.objects.enqueue(record_one, 'old')
+        Job.objects.enqueue(record_one, 'new')
+        self.work()
+        Job.objects.filter(payload='"old"').update(finished=timezone.now() - timedelta(days=2))
+        self.assertEqual(Job.objects.purge(86400), 1)
+        self.assertEqual(list(Job.objects.values_list('payload', flat=True)), ['"new"'])
+
+    def test_run_workers_command(self):
+        for payload in range(3):
+            Job.objects.enqueue(record_batch, payload)
+        call_command('run_workers', once=True)
+        self.assertEqual(calls, [('batch', [0, 1, 2])])
+
+    def test_status_view(self):
+        url = reverse('job-status')
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+        User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        self.client.login(username='admin', password='secret')
+
+        Job.objects.enqueue(record_one, 'fail')
+        Job.objects.enqueue(record_one, 'ok')
+        Job.objects.enqueue(record_batch, 1)
+        Job.objects.filter(name=task_name(record_one)).update(max_attempts=1)
+        self.work()
+
+        response = self.client.get(url, {'format': 'json'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(data['tasks'], {
+            'jobs.tests.record_batch': {'done': 1},
+            'jobs.tests.record_one': {'done': 1, 'failed': 1},
+        })
+        self.assertIsNone(data['oldest_pending_seconds'])
+        self.assertEqual([row['name'] for row in data['failures']], ['jobs.tests.record_one'])
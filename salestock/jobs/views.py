@@ -0,0 +1,36 @@
+from __future__ import unicode_literals
+
+from collections import defaultdict
+
+from django.db.models import Count, Min
+from django.utils import timezone
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from .models import Job
+
+
+class JobStatusView(APIView):
+    """
+    queue health for staff: job count per task and status, age of the oldest
+    due job and the latest failures
+    """
+    permission_classes = (IsAdminUser,)
+    failures = 20
+
+    def get(self, request, format=None):
+        now = timezone.now()
+        tasks = defaultdict(dict)
+        for row in Job.objects.values('name', 'status').annotate(count=Count('pk')).order_by('name', 'status'):
+            tasks[row['name']][row['status']] = row['count']
+        oldest = Job.objects.filter(status=Job.PENDING, run_after__lte=now).aggregate(
+            oldest=Min('run_after')
+        )['oldest']
+        failures = Job.objects.filter(status=Job.FAILED).order_by('-finished').values(
+            'id', 'name', 'key', 'attempts', 'finished', 'last_error'
+        )[:self.failures]
+        return Response({
+            'tasks': tasks,
+            'oldest_pending_seconds': (now - oldest).total_seconds() if oldest else None,
+            'failures': list(failures),
+        })
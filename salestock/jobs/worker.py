@@ -0,0 +1,108 @@
+"""
+worker loop behind `python manage.py run_workers`: claim a batch of due jobs of
+one task, run it, mark the jobs done, or retry them later with exponential
+backoff until max_attempts, then leave them failed with the traceback.
+"""
+from __future__ import unicode_literals
+
+import logging
+import os
+import socket
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+# seconds before the first retry, doubled on every attempt up to RETRY_MAX_DELAY
+RETRY_DELAY = 5
+RETRY_MAX_DELAY = 3600
+
+
+def retry_delay(attempts):
+    return min(RETRY_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+
+
+class Worker(object):
+
+    def __init__(self, name=None, batch_size=None, poll_interval=None, timeout=None):
+        self.name = name or '%s:%d' % (socket.gethostname(), os.getpid())
+        self.batch_size = batch_size or getattr(settings, 'JOBS_BATCH_SIZE', 100)
+        self.poll_interval = poll_interval if poll_interval is not None else getattr(
+            settings, 'JOBS_POLL_INTERVAL', 1.0
+        )
+        self.timeout = timeout or getattr(settings, 'JOBS_TIMEOUT', 300)
+        self.keep_done = getattr(settings, 'JOBS_KEEP_DONE', 86400)
+        self.last_cleanup = 0
+
+    def run(self, once=False):
+        """
+        process jobs until interrupted, or until the queue is empty when once
+        """
+        while True:
+            processed = self.run_once()
+            if not processed:
+                if once:
+                    return
+                # drop broken or too old connections, like django does between requests
+                close_old_connections()
+                time.sleep(self.poll_interval)
+
+    def run_once(self):
+        """
+        claim and run one batch, return the number of jobs processed
+        """
+        if time.time() - self.last_cleanup > self.timeout:
+            self.last_cleanup = time.time()
+            Job.objects.requeue_stale(self.timeout)
+            Job.objects.purge(self.keep_done)
+        jobs = Job.objects.claim(self.name, self.batch_size)
+        if jobs:
+            self.run_batch(jobs)
+        return len(jobs)
+
+    def run_batch(self, jobs):
+        try:
+            func = jobs[0].get_task()
+        except (ImportError, ValueError):
+            self.failed(jobs, traceback.format_exc(), retry=False)
+            return
+        if func.job_batch and len(jobs) > 1:
+            # on failure run the jobs one by one, so a bad payload only fail its own job
+            if self.call(func, jobs, [job.get_payload() for job in jobs], record_failure=False):
+                return
+        for job in jobs:
+            payload = job.get_payload()
+            self.call(func, [job], [payload] if func.job_batch else payload)
+
+    def call(self, func, jobs, argument, record_failure=True):
+        """
+        run the task in a transaction, a failed run leave no partial write
+        behind. return True on success
+        """
+        try:
+            with transaction.atomic():
+                func(argument)
+        except Exception:
+            if record_failure:
+                logger.exception("%s failed", jobs[0].name)
+                self.failed(jobs, traceback.format_exc())
+            return False
+        Job.objects.filter(pk__in=[job.pk for job in jobs]).update(
+            status=Job.DONE, finished=timezone.now(), last_error='',
+        )
+        return True
+
+    def failed(self, jobs, error, retry=True):
+        now = timezone.now()
+        for job in jobs:
+            if retry and job.attempts < job.max_attempts:
+                changes = dict(status=Job.PENDING, run_after=now + timedelta(seconds=retry_delay(job.attempts)))
+            else:
+                changes = dict(status=Job.FAILED, finished=now)
+            Job.objects.filter(pk=job.pk).update(last_error=error, **changes)
@@ -11,6 +11,7 @@ class ProductAdmin(ContentManageableModelAdmin):
     and auto add that fields to metadata at the bottom of admin page.
     """
     list_display = ['title', 'category', 'active']
+    list_select_related = ['category']
 
 
 class Categoryadmin(ContentManageableModelAdmin):
@@ -5,3 +5,6 @@ from django.apps import AppConfig
 
 class ProductsConfig(AppConfig):
     name = 'products'
+
+    def ready(self):
+        from . import checks, signals  # noqa, register checks and connect signal receivers
@@ -0,0 +1,222 @@
+"""
+bulk write path for products, shared by POST /products/bulk/ and catalog imports.
+it skip Product.save() (and signals) so every side effect of save() is
+reproduced here in batch: slug, updated, creator, normalized color, color n-grams,
+search index, category stats, tombstones, cache invalidation and category snapshots.
+"""
+from __future__ import unicode_literals
+
+import itertools
+import json
+
+from django.conf import settings
+from django.db import transaction
+from django.template.defaultfilters import slugify
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from jobs.models import Job
+from . import cache, histogram, snapshots
+from .lookups import lookup_cache
+from .models import (
+    Category, CategoryPriceBucket, Product, ProductColorNgram, ProductTombstone, SearchPosting, product_slug,
+)
+
+
+def iter_chunks(rows, size):
+    """
+    yield (offset, chunk) from any iterable without loading it all in memory
+    """
+    rows = iter(rows)
+    offset = 0
+    while True:
+        chunk = list(itertools.islice(rows, size))
+        if not chunk:
+            return
+        yield offset, chunk
+        offset += len(chunk)
+
+
+def iter_ndjson(stream):
+    """
+    decode one json document per line, malformed line is yielded as
+    ValidationError so it's reported for that row only
+    """
+    if stream is None:
+        return
+    for number, line in enumerate(iter(stream.readline, b''), 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line.decode('utf-8'))
+        except ValueError as exc:
+            yield ValidationError({'non_field_errors': ['Malformed JSON on line %d: %s' % (number, exc)]})
+
+
+def update_category_stats(new_products, refresh_category_ids=()):
+    """
+    fold the new products into category stats with one UPDATE per category
+    and price histograms, categories of updated products are recomputed
+    """
+    stats = {}
+    for product in new_products:
+        if not product.active or product.category_id in refresh_category_ids:
+            continue
+        count, min_price, max_price = stats.get(product.category_id, (0, product.price, product.price))
+        stats[product.category_id] = (count + 1, min(min_price, product.price), max(max_price, product.price))
+    for category_id, (count, min_price, max_price) in stats.items():
+        Category.objects.add_product_stats(category_id, min_price, max_price, count)
+    Category.objects.refresh_stats(refresh_category_ids)
+    CategoryPriceBucket.objects.add(histogram.deltas(added=[
+        (product.category_id, product.price) for product in new_products
+        if product.active and product.category_id not in refresh_category_ids
+    ]))
+    CategoryPriceBucket.objects.rebuild(refresh_category_ids)
+
+
+def index_category_products(category_ids, batch_size=1000):
+    """
+    rebuild search postings of every product in the categories, their
+    documents hold the category title and description
+    """
+    queryset = Product.objects.get_queryset().filter(
+        category__in=category_ids
+    ).only('id', 'title', 'category').order_by('pk')
+    for _, chunk in iter_chunks(queryset.iterator(), batch_size):
+        SearchPosting.objects.index_products(chunk)
+
+
+class SlugCache(dict):
+    """
+    slugify is slow, a batch usually repeat titles, so compute each one once
+    """
+    slugify = staticmethod(slugify)
+
+    def __missing__(self, title):
+        slug = self[title] = self.slugify(title)
+        return slug
+
+
+class ProductSlugCache(SlugCache):
+    """
+    SlugCache skipping the reserved product urls, see Product.save
+    """
+    slugify = staticmethod(product_slug)
+
+
+def write_products(rows, user=None, upsert=False, slugs=None):
+    """
+    write a batch of validated rows in a single transaction.
+    rows is list of (row number, data), data hold Product fields with either
+    `category` instance or `category_id`.
+    new slug is created with bulk_create, existing slug is rejected, or updated
+    in place when upsert is true.
+    return (created, updated, errors)
+    """
+    slugs = ProductSlugCache() if slugs is None else slugs
+    now = timezone.now()
+    errors = []
+    by_slug = {}
+    for number, data in rows:
+        data = dict(data)
+        if 'category' in data:
+            category = data.pop('category')
+            data['category_id'] = getattr(category, 'pk', category)
+        data['slug'] = data.get('slug') or slugs[data['title']]
+        if data['slug'] in by_slug:
+            errors.append((number, {'slug': ['Duplicated slug in the same batch.']}))
+            continue
+        by_slug[data['slug']] = (number, data)
+
+    with transaction.atomic():
+        existing = {
+            slug: (pk, category_id, active)
+            for slug, pk, category_id, active in Product.objects.get_queryset().filter(
+                slug__in=list(by_slug)
+            ).values_list('slug', 'pk', 'category_id', 'active')
+        }
+
+        new_products, updated_pks, deactivated = [], [], []
+        category_ids, refresh_category_ids = set(), set()
+        for slug, (number, data) in sorted(by_slug.items(), key=lambda item: item[1][0]):
+            data['color_normalized'] = Product.normalize_color(data.get('color'))
+            category_ids.add(data['category_id'])
+            if slug not in existing:
+                new_products.append(Product(creator=user, updated=now, **data))
+            elif upsert:
+                pk, old_category_id, was_active = existing[slug]
+                if was_active and not data.get('active', True):
+                    deactivated.append(Product(pk=pk, **data))
+                category_ids.add(old_category_id)
+                refresh_category_ids.update([old_category_id, data['category_id']])
+                Product.objects.get_queryset().filter(pk=pk).update(
+                    last_modified_by=user, updated=now, **data
+                )
+                updated_pks.append(pk)
+            else:
+                errors.append((number, {'slug': ['product with this slug already exists.']}))
+
+        Product.objects.bulk_create(new_products)
+        update_category_stats(new_products, refresh_category_ids)
+        ProductTombstone.objects.record(deactivated, ProductTombstone.DEACTIVATED)
+        # bulk_create doesn't return primary keys on every backend, load them back by slug
+        queryset = Product.objects.get_queryset().only('id', 'color', 'title', 'category')
+        written = (
+            list(queryset.filter(slug__in=[p.slug for p in new_products])) +
+            list(queryset.filter(pk__in=updated_pks))
+        )
+        if getattr(settings, 'PRODUCT_COLOR_NGRAM_INDEX', True):
+            ProductColorNgram.objects.index_products(written)
+        if written and getattr(settings, 'PRODUCT_SEARCH_INDEX', True):
+            from .tasks import index_products  # avoid circular import
+            Job.objects.enqueue(index_products, [p.pk for p in written])
+
+    category_slugs = list(Category.objects.filter(pk__in=category_ids).values_list('slug', flat=True))
+    cache.invalidate_products(category_slugs)
+    # a batch may touch most of a category, rebuilding on next read is cheaper than patching
+    snapshots.invalidate_on_commit(category_slugs)
+    if updated_pks:
+        lookup_cache.clear_rows(Product._meta.label_lower)
+    lookup_cache.invalidate_rows(Category._meta.label_lower, category_ids)
+    return len(new_products), len(updated_pks), sorted(errors)
+
+
+def write_categories(rows, user=None, upsert=False, slugs=None):
+    """
+    same as write_products for categories, return (created, updated, errors)
+    """
+    slugs = SlugCache() if slugs is None else slugs
+    now = timezone.now()
+    errors = []
+    by_slug = {}
+    for number, data in rows:
+        data = dict(data)
+        data['slug'] = data.get('slug') or slugs[data['title']]
+        if data['slug'] in by_slug:
+            errors.append((number, {'slug': ['Duplicated slug in the same batch.']}))
+            continue
+        by_slug[data['slug']] = (number, data)
+
+    with transaction.atomic():
+        existing = dict(Category.objects.filter(slug__in=list(by_slug)).values_list('slug', 'pk'))
+        new_categories, updated_pks = [], []
+        for slug, (number, data) in sorted(by_slug.items(), key=lambda item: item[1][0]):
+            if slug not in existing:
+                new_categories.append(Category(creator=user, updated=now, **data))
+            elif upsert:
+                Category.objects.filter(pk=existing[slug]).update(
+                    last_modified_by=user, updated=now, **data
+                )
+                updated_pks.append(existing[slug])
+            else:
+                errors.append((number, {'slug': ['category with this slug already exists.']}))
+        Category.objects.bulk_create(new_categories)
+        if updated_pks and getattr(settings, 'PRODUCT_SEARCH_INDEX', True):
+            from .tasks import index_categories  # avoid circular import
+            Job.objects.enqueue(index_categories, updated_pks)
+
+    cache.invalidate_categories(list(by_slug))
+    if updated_pks:
+        lookup_cache.clear_rows(Category._meta.label_lower)
+        lookup_cache.clear_rows(Product._meta.label_lower)
+    return len(new_categories), len(updated_pks), sorted(errors)
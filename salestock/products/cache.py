@@ -0,0 +1,208 @@
+from __future__ import unicode_literals
+
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.encoding import force_bytes
+
+
+SCOPE_PRODUCTS = 'products'
+SCOPE_CATEGORIES = 'categories'
+STATS_KEYS = ('hits', 'misses')
+# backends whose add() is atomic for every process sharing them, the file
+# based and database caches check then set
+ATOMIC_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.memcached.MemcachedCache',
+    'django.core.cache.backends.memcached.PyLibMCCache',
+    'django_redis.cache.RedisCache',
+)
+
+
+def category_scope(slug):
+    return 'category:%s' % slug
+
+
+def get_cache():
+    return caches[getattr(settings, 'RESPONSE_CACHE_ALIAS', 'default')]
+
+
+def get_generations_cache():
+    """
+    generations, stats, locks and the replica last write marker, small keys
+    that must not be culled with the responses
+    """
+    return caches[getattr(settings, 'RESPONSE_CACHE_GENERATIONS_ALIAS', 'default')]
+
+
+def has_atomic_add():
+    alias = getattr(settings, 'RESPONSE_CACHE_GENERATIONS_ALIAS', 'default')
+    return settings.CACHES.get(alias, {}).get('BACKEND') in ATOMIC_BACKENDS
+
+
+def get_timeout():
+    return getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300)
+
+
+def _new_generation():
+    # never reuse a generation that could still have responses stored
+    # after the counter itself was evicted
+    return uuid.uuid4().hex
+
+
+def get_generations(scopes):
+    """
+    every scope has a generation counter, the counters are part of response
+    cache key so bumping a counter drop every response stored under that scope
+    """
+    cache = get_generations_cache()
+    keys = ['generation:%s' % scope for scope in scopes]
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            cache.add(key, _new_generation(), None)
+            generations[key] = cache.get(key)
+    return [generations[key] for key in keys]
+
+
+def bump(scope):
+    """
+    store a new generation for scope and return it. a fresh value rather than
+    incr(): two concurrent bumps on a backend without atomic incr (file based)
+    could both write the same number and lose an invalidation, with a fresh
+    value the last one wins and was written after both writes committed
+    """
+    generation = _new_generation()
+    get_generations_cache().set('generation:%s' % scope, generation, None)
+    return generation
+
+
+def invalidate(*scopes):
+    for scope in set(scopes):
+        bump(scope)
+
+
+def invalidate_on_commit(*scopes):
+    """
+    invalidate once the current transaction commit (right away outside one).
+    bumping before the commit would let a concurrent reader store the
+    uncommitted state under the new generation
+    """
+    transaction.on_commit(lambda: invalidate(*scopes))
+
+
+def invalidate_categories(slugs):
+    """
+    product listing of the given categories, and the category listing itself
+    """
+    invalidate_on_commit(SCOPE_CATEGORIES, *[category_scope(slug) for slug in slugs if slug])
+
+
+def invalidate_products(category_slugs):
+    """
+    products listing and product listing of every category the products
+    belongs to (both before and after the write), category listing too
+    because it carry product stats
+    """
+    invalidate_on_commit(
+        SCOPE_PRODUCTS, SCOPE_CATEGORIES, *[category_scope(slug) for slug in category_slugs if slug]
+    )
+
+
+def get_or_compute(scopes, signature, compute):
+    """
+    cache any computed value under the generations of scopes, for data that
+    doesn't depend on the user (unlike rendered responses)
+    """
+    timeout = get_timeout()
+    if not timeout:
+        return compute()
+    cache = get_cache()
+    generations = '.'.join('%s' % g for g in get_generations(scopes))
+    key = 'data:%s:%s' % (hashlib.md5(force_bytes(signature)).hexdigest(), generations)
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, timeout)
+    return value
+
+
+def record(name, count=1):
+    # approximate on backends without atomic incr
+    cache = get_generations_cache()
+    key = 'stats:%s' % name
+    if not cache.add(key, count, None):
+        try:
+            cache.incr(key, count)
+        except ValueError:
+            cache.set(key, count, None)
+
+
+def get_stats(names=STATS_KEYS):
+    cache = get_generations_cache()
+    values = cache.get_many(['stats:%s' % name for name in names])
+    return {name: values.get('stats:%s' % name, 0) for name in names}
+
+
+def reset_stats(names=STATS_KEYS):
+    get_generations_cache().delete_many(['stats:%s' % name for name in names])
+
+
+class ResponseCacheMixin(object):
+    """
+    cache rendered list responses for anonymous users.
+
+    key is built from path, query string and format (url suffix or
+    content negotiation), plus the generation of every scope returned by
+    get_cache_scopes(), writes bump the generation of affected scopes only.
+    """
+    cache_scopes = ()
+
+    def get_cache_scopes(self):
+        return self.cache_scopes
+
+    def is_response_cacheable(self, request):
+        return (
+            get_timeout() and
+            request.method in ('GET', 'HEAD') and
+            not request.user.is_authenticated()
+        )
+
+    def get_response_cache_key(self, request):
+        scopes = self.get_cache_scopes()
+        query = sorted(request.query_params.lists())
+        signature = '%s?%r|%s|%s' % (
+            request.path, query, self.format_kwarg, request.accepted_renderer.format
+        )
+        generations = '.'.join('%s' % g for g in get_generations(scopes))
+        return 'response:%s:%s' % (
+            hashlib.md5(force_bytes(signature)).hexdigest(),
+            generations,
+        )
+
+    def list(self, request, *args, **kwargs):
+        if not self.is_response_cacheable(request):
+            return super(ResponseCacheMixin, self).list(request, *args, **kwargs)
+
+        cache = get_cache()
+        key = self.get_response_cache_key(request)
+        cached = cache.get(key)
+        if cached is not None:
+            record('hits')
+            content, content_type = cached
+            response = HttpResponse(content, content_type=content_type)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        record('misses')
+        response = super(ResponseCacheMixin, self).list(request, *args, **kwargs)
+        if response.status_code == 200:
+            def store(rendered):
+                cache.set(key, (rendered.content, rendered['Content-Type']), get_timeout())
+            response.add_post_render_callback(store)
+        response['X-Cache'] = 'MISS'
+        return response
@@ -0,0 +1,508 @@
+"""
+read-only catalog snapshot for read heavy traffic (flash sales): active products
+and every category written to one file by `python manage.py build_catalog_snapshot`,
+then memory mapped by every process. the page cache hold the file once for every
+worker of the host, rows are decoded straight from the mapping on request.
+
+the file is a columnar file (see products.columnar) with an `id` column and
+index columns of row numbers sorted by slug, (price, id), (created, id) and
+(category, price, id), the header carry the serialized categories. detail
+lookups are binary searches over the slug index, price filters are ranges of
+the price indexes, other filters are checked on the dictionary codes.
+
+a new snapshot is written next to the current one and renamed over it, processes
+notice the new file with a stat() per request and map it, requests already
+reading the previous mapping keep it until they are done.
+
+with CATALOG_SNAPSHOT_PATH set, GET and HEAD on product and category lists and
+details are answered from the snapshot, unless it's older than
+CATALOG_SNAPSHOT_MAX_AGE. writes, other reads and products missing from the
+snapshot go to the database. answers from the snapshot carry its build time
+in X-Catalog-Snapshot and its age in seconds in X-Catalog-Snapshot-Age.
+"""
+from __future__ import unicode_literals
+
+import io
+import json
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from decimal import Decimal
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.six.moves import range
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+from . import columnar, export
+from .conditional import make_etag
+from .models import Category, Product
+from .renderers import FastJSONRenderer, Rows, format_datetime
+from .serializers import CategoryDetailSerializer, CategorySerializer, FlatProductSerializer
+
+
+SNAPSHOT_HEADER = 'X-Catalog-Snapshot'
+AGE_HEADER = 'X-Catalog-Snapshot-Age'
+INDEX_CODE = 'I'
+
+# attributes FlatProductSerializer and keyset pagination read
+SnapshotProduct = namedtuple('SnapshotProduct', 'pk title slug category_id size color price active created updated')
+# data is the CategoryDetailSerializer representation, products url aside
+SnapshotCategory = namedtuple('SnapshotCategory', 'pk slug updated data')
+
+
+def get_path():
+    return getattr(settings, 'CATALOG_SNAPSHOT_PATH', None)
+
+
+def get_max_age():
+    return getattr(settings, 'CATALOG_SNAPSHOT_MAX_AGE', None)
+
+
+def to_datetime(value):
+    value = columnar.from_microseconds(value)
+    return timezone.make_aware(value, timezone.utc) if settings.USE_TZ else value
+
+
+def category_data(serializer, category):
+    """
+    CategoryDetailSerializer representation as json, products url is null, it
+    depends on the request
+    """
+    data = OrderedDict()
+    for name, field in serializer.fields.items():
+        attribute = None if name == 'products' else field.get_attribute(category)
+        data[name] = None if attribute is None else field.to_representation(attribute)
+    return json.dumps(data, cls=JSONEncoder)
+
+
+def build(path=None):
+    """
+    write a snapshot of the active products and every category next to path
+    (CATALOG_SNAPSHOT_PATH by default) then rename it over path, return the product count
+    """
+    path = path or get_path()
+    built = timezone.now()
+    categories = list(Category.objects.order_by('pk').prefetch_related('price_buckets'))
+    keys = []
+
+    def rows():
+        for row in export.iter_rows(Product.objects.all(), with_pk=True):
+            values = dict(zip(export.EXPORT_COLUMNS, row[1:]))
+            keys.append((
+                row[0], values['slug'], int(values['price']),
+                columnar.to_microseconds(values['created']), values['category'],
+            ))
+            yield row[1:]
+
+    count, columns = export.encode_columns(rows(), {category.pk: category.slug for category in categories})
+    positions = range(count)
+    category_index = sorted(positions, key=lambda row: (keys[row][4], keys[row][2], keys[row][0]))
+    category_ranges = {}
+    for position, row in enumerate(category_index):
+        start, end = category_ranges.get(keys[row][4], (position, position))
+        category_ranges[keys[row][4]] = (start, position + 1)
+    indexes = (
+        ('slug_index', lambda row: keys[row][1]),
+        ('price_index', lambda row: (keys[row][2], keys[row][0])),
+        ('created_index', lambda row: (keys[row][3], keys[row][0])),
+    )
+    columns.append(columnar.int_column('id', 'q', [key[0] for key in keys]))
+    columns += [columnar.int_column(name, INDEX_CODE, sorted(positions, key=key)) for name, key in indexes]
+    columns.append(columnar.int_column('category_index', INDEX_CODE, category_index))
+
+    serializer = CategoryDetailSerializer()
+    temporary = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        with io.open(temporary, 'wb') as f:
+            columnar.write(
+                f, count, columns, export.EXPORT_COLUMNS,
+                built=columnar.to_microseconds(built),
+                categories=[
+                    [category.pk, category.slug, columnar.to_microseconds(category.updated),
+                     category_data(serializer, category)]
+                    for category in categories
+                ],
+                category_ranges={'%d' % pk: list(bounds) for pk, bounds in category_ranges.items()},
+            )
+        os.rename(temporary, path)
+    except Exception:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    return count
+
+
+def bisect(rows, key, value, right=False):
+    """
+    first position of rows (sorted by key) where key reach value,
+    first position past value when right
+    """
+    low, high = 0, len(rows)
+    while low < high:
+        middle = (low + high) // 2
+        current = key(rows[middle])
+        if current < value or (right and current == value):
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+class Index(object):
+    """
+    row numbers at positions start to end of an index column, read from the mapping
+    """
+
+    def __init__(self, snapshot, name, start=0, end=None):
+        self.snapshot = snapshot
+        self.name = name
+        self.start = start
+        self.end = len(snapshot) if end is None else end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, position):
+        return self.snapshot.item(self.name, self.start + position)
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield self[position]
+
+    def narrow(self, start, end):
+        return Index(self.snapshot, self.name, self.start + start, self.start + max(start, end))
+
+
+class CatalogSnapshot(columnar.ColumnarFile):
+
+    def __init__(self, path):
+        super(CatalogSnapshot, self).__init__(path)
+        self.path = path
+        stat = os.fstat(self.file.fileno())
+        self.identity = (stat.st_dev, stat.st_ino)
+        self.built = to_datetime(self.header['built'])
+        self.packers = {
+            name: (struct.Struct(str('<%s' % column['code'])), self.data_offset + column['offset'])
+            for name, column in self.columns.items() if column['type'] != columnar.TEXT
+        }
+        self.dictionaries = {name: self.columns[name]['dictionary'] for name in ('category', 'size', 'color')}
+        self.categories = [
+            SnapshotCategory(pk, slug, to_datetime(updated), json.loads(data, object_pairs_hook=OrderedDict))
+            for pk, slug, updated, data in self.header['categories']
+        ]
+        self.category_slugs = {category.slug: category for category in self.categories}
+        self.category_ranges = {int(pk): tuple(bounds) for pk, bounds in self.header['category_ranges'].items()}
+
+    @property
+    def version(self):
+        return self.header['built']
+
+    def age(self):
+        return time.time() - self.header['built'] / 1000000.0
+
+    def item(self, name, row):
+        """
+        raw integer of a packed or dictionary encoded column
+        """
+        packer, offset = self.packers[name]
+        return packer.unpack_from(self.map, offset + row * packer.size)[0]
+
+    def product(self, row):
+        item = self.item
+        return SnapshotProduct(
+            item('id', row), self.text('title', row), self.text('slug', row),
+            self.dictionaries['category'][item('category', row)],
+            self.dictionaries['size'][item('size', row)],
+            self.dictionaries['color'][item('color', row)],
+            Decimal(item('price', row)), bool(item('active', row)),
+            to_datetime(item('created', row)), to_datetime(item('updated', row)),
+        )
+
+    def find(self, slug):
+        """
+        row of the product with slug, None when missing
+        """
+        index = Index(self, 'slug_index')
+        position = bisect(index, lambda row: self.text('slug', row), slug)
+        if position < len(index) and self.text('slug', index[position]) == slug:
+            return index[position]
+        return None
+
+    def price_key(self, row):
+        return self.item('price', row), self.item('id', row)
+
+    def created_key(self, row):
+        return self.item('created', row), self.item('id', row)
+
+    def by_price(self, category=None):
+        """
+        rows of a category (every row when None) in (price, id) order
+        """
+        if category is None:
+            return Index(self, 'price_index')
+        start, end = self.category_ranges.get(category.pk, (0, 0))
+        return Index(self, 'category_index', start, end)
+
+    def select(self, cleaned_data, category=None):
+        """
+        (rows in (price, id) order within the price filters, predicate for the
+        other filters or None) of valid ProductFilter form data, same result as
+        ProductFilter over the database
+        """
+        index = self.by_price(category)
+        price = lambda row: self.item('price', row)
+        min_price, max_price = cleaned_data.get('min_price'), cleaned_data.get('max_price')
+        start = 0 if min_price is None else bisect(index, price, min_price)
+        end = len(index) if max_price is None else bisect(index, price, max_price, right=True)
+        index = index.narrow(start, end)
+
+        checks = []
+        size, color = cleaned_data.get('size'), cleaned_data.get('color')
+        if size:
+            checks.append(('size', {code for code, value in enumerate(self.dictionaries['size']) if value == size}))
+        if color:
+            needle = Product.normalize_color(color)
+            checks.append(('color', {
+                code for code, value in enumerate(self.dictionaries['color'])
+                if needle in Product.normalize_color(value)
+            }))
+        if not checks:
+            return index, None
+        return index, lambda row: all(self.item(name, row) in codes for name, codes in checks)
+
+
+_lock = threading.Lock()
+_state = {'snapshot': None}
+
+
+def get_snapshot():
+    """
+    snapshot of this process, mapped again when the file was replaced,
+    None when there is no usable snapshot
+    """
+    path = get_path()
+    if not path:
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    with _lock:
+        snapshot = _state['snapshot']
+        if snapshot is None or snapshot.path != path or snapshot.identity != (stat.st_dev, stat.st_ino):
+            try:
+                snapshot = CatalogSnapshot(path)
+            except (IOError, OSError, ValueError, KeyError):
+                return None
+            # the previous mapping is closed once the last request holding it is done
+            _state['snapshot'] = snapshot
+    max_age = get_max_age()
+    if max_age is not None and snapshot.age() > max_age:
+        return None
+    return snapshot
+
+
+class SnapshotReadMixin(object):
+    """
+    answer list and retrieve from the catalog snapshot when the request only
+    use snapshot_list_params, with its own ETag. must come first, before
+    ConditionalGetMixin and ResponseCacheMixin
+    """
+    snapshot_list_params = {'format'}
+    catalog_snapshot = None
+
+    def use_snapshot(self, request, params):
+        if request.method in ('GET', 'HEAD') and set(request.query_params) <= params:
+            self.catalog_snapshot = get_snapshot()
+        return self.catalog_snapshot
+
+    def list(self, request, *args, **kwargs):
+        snapshot = self.use_snapshot(request, self.snapshot_list_params)
+        if snapshot is None:
+            return super(SnapshotReadMixin, self).list(request, *args, **kwargs)
+        query = sorted(request.query_params.lists())
+        etag = make_etag(request.path, query, snapshot.version, *self.get_variant(request))
+        return self.not_modified_or(request, etag, snapshot.built, lambda: self.snapshot_list(snapshot))
+
+    def retrieve(self, request, *args, **kwargs):
+        snapshot = self.use_snapshot(request, {'format'})
+        instance = None if snapshot is None else self.get_snapshot_object(snapshot)
+        if instance is None:
+            self.catalog_snapshot = None
+            return super(SnapshotReadMixin, self).retrieve(request, *args, **kwargs)
+        etag = make_etag(instance.slug, instance.updated.isoformat(), *self.get_variant(request))
+        return self.not_modified_or(
+            request, etag, instance.updated, lambda: Response(self.snapshot_detail(instance))
+        )
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super(SnapshotReadMixin, self).finalize_response(request, response, *args, **kwargs)
+        snapshot = self.catalog_snapshot
+        if snapshot is not None:
+            response[SNAPSHOT_HEADER] = format_datetime(snapshot.built)
+            response[AGE_HEADER] = '%d' % max(snapshot.age(), 0)
+        return response
+
+    def snapshot_list(self, snapshot):
+        raise NotImplementedError
+
+    def get_snapshot_object(self, snapshot):
+        """
+        object with slug and updated, None to read it from the database
+        """
+        raise NotImplementedError
+
+    def snapshot_detail(self, instance):
+        raise NotImplementedError
+
+
+class ProductSnapshotMixin(SnapshotReadMixin):
+    """
+    product lists (of the category in the slug url kwarg when snapshot_by_category)
+    and details, filtered and keyset paginated like the database
+    """
+    snapshot_list_params = {'format', 'color', 'size', 'min_price', 'max_price', 'page_size', 'cursor', 'ordering'}
+    snapshot_by_category = False
+    # same keys as FlatProductSerializer
+    snapshot_row_keys = ('title', 'slug', 'category', 'size', 'color', 'price', 'active', 'detail_url')
+
+    def get_snapshot_selection(self, snapshot):
+        """
+        (category or None, rows in (price, id) order, predicate), None when nothing can match
+        """
+        if not hasattr(self, '_snapshot_selection'):
+            self._snapshot_selection = None
+            category = None
+            if self.snapshot_by_category:
+                category = snapshot.category_slugs.get(self.kwargs['slug'])
+            form = self.filter_class(self.request.query_params).form
+            if form.is_valid() and (category is not None or not self.snapshot_by_category):
+                self._snapshot_selection = (category,) + snapshot.select(form.cleaned_data, category)
+        return self._snapshot_selection
+
+    def get_list_summary(self):
+        snapshot = self.catalog_snapshot
+        if snapshot is None:
+            return super(ProductSnapshotMixin, self).get_list_summary()
+        selection = self.get_snapshot_selection(snapshot)
+        lowest = highest = count_estimate = None
+        if selection is not None:
+            category, rows, predicate = selection
+            bounds = snapshot.by_price(category)
+            if len(bounds):
+                lowest = snapshot.item('price', bounds[0])
+                highest = snapshot.item('price', bounds[len(bounds) - 1])
+            # exact, where the database estimate from the histograms
+            count_estimate = len(rows) if predicate is None else None
+        elif self.filter_class(self.request.query_params).form.is_valid():
+            count_estimate = 0
+        return OrderedDict((
+            ('count_estimate', count_estimate),
+            ('price', OrderedDict((
+                ('min', None if lowest is None else self.price_field.to_representation(Decimal(lowest))),
+                ('max', None if highest is None else self.price_field.to_representation(Decimal(highest))),
+            ))),
+        ))
+
+    def snapshot_list(self, snapshot):
+        selection = self.get_snapshot_selection(snapshot)
+        paginator = self.paginator
+        if paginator is not None and paginator.start(self.request, self):
+            page = self.snapshot_page(snapshot, paginator, selection)
+            return paginator.get_paginated_response(self.snapshot_products(page))
+
+        products = []
+        if selection is not None:
+            category, rows, predicate = selection
+            # rows are stored in id order, like unpaginated database lists
+            rows = range(len(snapshot)) if len(rows) == len(snapshot) else sorted(rows)
+            if predicate is not None:
+                rows = [row for row in rows if predicate(row)]
+            products = [snapshot.product(row) for row in rows]
+
+        if isinstance(getattr(self.request, 'accepted_renderer', None), FastJSONRenderer):
+            serializer = FlatProductSerializer(context=self.get_serializer_context())
+            detail_url = serializer.detail_url_field
+            return Response(Rows(self.snapshot_row_keys, [
+                (p.title, p.slug, p.category_id, p.size, p.color, serializer.format_price(p.price), p.active,
+                 detail_url.to_representation(p))
+                for p in products
+            ]))
+        return Response(self.snapshot_products(products))
+
+    def snapshot_page(self, snapshot, paginator, selection):
+        """
+        same page as KeysetPagination.paginate_queryset, walking the price or created index
+        """
+        if selection is None:
+            return paginator.set_page([], False)
+        category, rows, predicate = selection
+        if paginator.field == 'price':
+            key = snapshot.price_key
+        else:
+            key = snapshot.created_key
+            rows = Index(snapshot, 'created_index') if len(rows) == len(snapshot) else sorted(rows, key=key)
+
+        descending = paginator.is_walking_down()
+        positions = range(len(rows) - 1, -1, -1) if descending else range(len(rows))
+        cursor = paginator.cursor
+        if cursor is not None:
+            value = cursor['value']
+            if paginator.field == 'created':
+                value = columnar.to_microseconds(value)
+            if descending:
+                positions = range(bisect(rows, key, (value, cursor['id'])) - 1, -1, -1)
+            else:
+                positions = range(bisect(rows, key, (value, cursor['id']), right=True), len(rows))
+
+        page = []
+        for position in positions:
+            row = rows[position]
+            if predicate is None or predicate(row):
+                page.append(row)
+                if len(page) > paginator.page_size:
+                    break
+        results = [snapshot.product(row) for row in page[:paginator.page_size]]
+        return paginator.set_page(results, len(page) > paginator.page_size)
+
+    def snapshot_products(self, products):
+        serializer = FlatProductSerializer(context=self.get_serializer_context())
+        return [serializer.to_representation(product) for product in products]
+
+    def get_snapshot_object(self, snapshot):
+        row = snapshot.find(self.kwargs[self.lookup_url_kwarg or self.lookup_field])
+        return None if row is None else snapshot.product(row)
+
+    def snapshot_detail(self, instance):
+        return FlatProductSerializer(context=self.get_serializer_context()).to_representation(instance)
+
+
+class CategorySnapshotMixin(SnapshotReadMixin):
+    """
+    category list and detail, with the price histogram on detail
+    """
+
+    def snapshot_category(self, category, fields, products):
+        data = category.data
+        return OrderedDict(
+            (name, products.to_representation(category) if name == 'products' else data[name]) for name in fields
+        )
+
+    def get_products_field(self):
+        return CategorySerializer(context=self.get_serializer_context()).fields['products']
+
+    def snapshot_list(self, snapshot):
+        products = self.get_products_field()
+        return Response([
+            self.snapshot_category(category, CategorySerializer.Meta.fields, products)
+            for category in snapshot.categories
+        ])
+
+    def get_snapshot_object(self, snapshot):
+        return snapshot.category_slugs.get(self.kwargs[self.lookup_url_kwarg or self.lookup_field])
+
+    def snapshot_detail(self, instance):
+        return self.snapshot_category(instance, CategoryDetailSerializer.Meta.fields, self.get_products_field())
@@ -0,0 +1,126 @@
+"""
+delta sync feed: active products created or updated after a mark, merged with
+tombstones of products removed after it.
+
+both streams are read with keyset queries on (timestamp, id) and merged in
+(timestamp, kind, id) order, so a page cost the same no matter how big the
+catalog is, only the rate of change matters.
+
+updated and removed are stamped before the write commit, so a row can become
+visible after rows stamped later than itself. the feed only goes up to
+now - PRODUCT_CHANGES_SAFETY_LAG, rows younger than that are left for the next
+sync, set it above the longest write transaction.
+"""
+from __future__ import unicode_literals
+
+import binascii
+import datetime
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import six, timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.six.moves.urllib import parse as urlparse
+from .models import Product, ProductQuerySet, ProductTombstone
+
+
+UPSERT = 0
+DELETE = 1
+BEGINNING = (datetime.datetime(1970, 1, 1, tzinfo=timezone.utc), UPSERT, 0)
+
+
+def encode_mark(mark):
+    timestamp, kind, pk = mark
+    querystring = urlparse.urlencode([
+        ('t', timestamp.isoformat()), ('k', six.text_type(kind)), ('i', six.text_type(pk))
+    ])
+    return urlsafe_b64encode(querystring.encode('utf-8')).decode('ascii')
+
+
+def decode_mark(value):
+    """
+    value is either a mark returned by the feed, or an ISO 8601 timestamp or
+    date for the first sync. raise ValueError when it's neither
+    """
+    if not value:
+        return BEGINNING
+    timestamp = parse_datetime(value)
+    if timestamp is not None:
+        if timezone.is_naive(timestamp):
+            timestamp = timezone.make_aware(timestamp, timezone.utc)
+        # everything at or before the timestamp is already known
+        return (timestamp, DELETE, six.MAXSIZE)
+    date = parse_date(value)
+    if date is not None:
+        # the whole day, from midnight UTC
+        return (datetime.datetime.combine(date, datetime.time(tzinfo=timezone.utc)), UPSERT, 0)
+
+    try:
+        querystring = urlsafe_b64decode(value.encode('ascii')).decode('utf-8')
+        tokens = dict(urlparse.parse_qsl(querystring, keep_blank_values=True))
+        timestamp = parse_datetime(tokens['t'])
+        kind = int(tokens['k'])
+        if timestamp is None or kind not in (UPSERT, DELETE):
+            raise ValueError('malformed mark')
+        return (timestamp, kind, int(tokens['i']))
+    except (TypeError, KeyError, UnicodeError, binascii.Error):
+        raise ValueError('malformed mark')
+
+
+def after(field, mark, kind):
+    """
+    Q matching rows of the given kind that come after mark in (field, kind, id) order
+    """
+    timestamp, mark_kind, pk = mark
+    if kind < mark_kind:
+        return Q(**{'%s__gt' % field: timestamp})
+    if kind > mark_kind:
+        return Q(**{'%s__gte' % field: timestamp})
+    # leading >= let the database range scan the (timestamp, id) index
+    return Q(**{'%s__gte' % field: timestamp}) & (Q(**{'%s__gt' % field: timestamp}) | Q(id__gt=pk))
+
+
+def get_horizon(now=None):
+    """
+    newest timestamp the feed can return, rows stamped before it are committed
+    """
+    lag = getattr(settings, 'PRODUCT_CHANGES_SAFETY_LAG', 5)
+    return (now or timezone.now()) - datetime.timedelta(seconds=lag)
+
+
+def changed_products(mark, using=None, until=None):
+    queryset = Product.objects.db_manager(using).all().filter(after('updated', mark, UPSERT))
+    if until is not None:
+        queryset = queryset.filter(updated__lte=until)
+    return queryset.only(*ProductQuerySet.LISTING_FIELDS + ('updated',)).order_by('updated', 'id')
+
+
+def removed_products(mark, using=None, until=None):
+    queryset = ProductTombstone.objects.db_manager(using).filter(after('removed', mark, DELETE))
+    if until is not None:
+        queryset = queryset.filter(removed__lte=until)
+    return queryset.order_by('removed', 'id')
+
+
+def get_changes(mark, limit, now=None):
+    """
+    return (changes, high water mark, has_more), changes is list of
+    (kind, object) ordered by mark, object is a Product for UPSERT
+    and a ProductTombstone for DELETE.
+    once everything up to the horizon is returned, the mark move to the horizon
+    """
+    horizon = get_horizon(now)
+    products = changed_products(mark, until=horizon)
+    tombstones = removed_products(mark, until=horizon)
+
+    rows = [((p.updated, UPSERT, p.pk), p) for p in products[:limit + 1]]
+    rows += [((t.removed, DELETE, t.pk), t) for t in tombstones[:limit + 1]]
+    rows.sort(key=lambda row: row[0])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if rows:
+        mark = rows[-1][0]
+    if not has_more:
+        mark = max(mark, (horizon, DELETE, six.MAXSIZE))
+    return [(key[1], obj) for key, obj in rows], mark, has_more
@@ -0,0 +1,43 @@
+"""
+system checks, registered in ProductsConfig.ready()
+"""
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.core import checks
+
+
+PER_PROCESS_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@checks.register(checks.Tags.caches)
+def check_response_cache(app_configs, **kwargs):
+    """
+    generations, snapshot versions, stats and replica stickiness live in the
+    generations cache, a per process backend only invalidate the worker that
+    wrote (responses themselves can stay per process, their keys carry the
+    generations). DEBUG allow it (runserver is one process), unless read
+    replicas are set: the last write marker would then hide writes from the
+    other processes
+    """
+    alias = getattr(settings, 'RESPONSE_CACHE_GENERATIONS_ALIAS', 'default')
+    backend = settings.CACHES.get(alias, {}).get('BACKEND')
+    if backend not in PER_PROCESS_BACKENDS:
+        return []
+    hint = "set GENERATIONS_CACHE_BACKEND and GENERATIONS_CACHE_LOCATION to a shared cache (memcached, redis)"
+    if getattr(settings, 'DATABASE_REPLICAS', []):
+        return [checks.Error(
+            "cache %r use %s, other processes would read replicas right after a write" % (alias, backend),
+            hint=hint,
+            id='products.E002',
+        )]
+    if settings.DEBUG:
+        return []
+    return [checks.Error(
+        "cache %r use %s, which isn't shared between processes" % (alias, backend),
+        hint=hint,
+        id='products.E001',
+    )]
@@ -0,0 +1,217 @@
+"""
+column oriented catalog file written by `manage.py export_products --format=columnar`,
+and its reader. the reader only use the standard library, so analytics jobs can
+copy this module without django:
+
+    with ColumnarFile('products.col') as table:
+        rows = table.filter(min_price=100000, category='shirts')
+        for title, price in table.read(rows, ['title', 'price']):
+            ...
+
+layout, every integer little endian:
+    MAGIC, header length (uint32), json header, padding to 8 bytes, column data.
+    the header holds the row count and for every column its type, offset (from
+    the start of column data), length in bytes and dictionary when encoded.
+
+column types:
+    int      packed integers, `code` is a struct format character: price (q),
+             created and updated (q, microseconds since epoch UTC), active (B)
+    dict     `code` sized indexes into `dictionary`: size, color and category
+             (dictionary of category ids, `slugs` maps them to category slugs)
+    text     utf-8 strings joined in one blob, after row count + 1 uint64
+             offsets: title and slug
+filtering on price or category only read those columns, the other ones are
+never touched (the file is memory mapped, untouched pages are never read).
+"""
+from __future__ import unicode_literals
+
+import datetime
+import io
+import json
+import mmap
+import numbers
+import struct
+
+
+MAGIC = b'SLSTKCOL'
+VERSION = 1
+ALIGNMENT = 8
+EPOCH = datetime.datetime(1970, 1, 1)
+
+INT = 'int'
+DICT = 'dict'
+TEXT = 'text'
+
+
+def to_microseconds(value):
+    """
+    aware or naive UTC datetime to microseconds since epoch
+    """
+    delta = value.replace(tzinfo=None) - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def from_microseconds(value):
+    """
+    microseconds since epoch to naive UTC datetime
+    """
+    return EPOCH + datetime.timedelta(microseconds=value)
+
+
+def code_for(size):
+    """
+    smallest unsigned struct format holding indexes into a dictionary of size entries
+    """
+    if size <= 1 << 8:
+        return 'B'
+    if size <= 1 << 16:
+        return 'H'
+    return 'I'
+
+
+def int_column(name, code, values, unit=None):
+    """
+    (name, description, payload) of a column of packed integers, for write()
+    """
+    return name, {'type': INT, 'code': code, 'unit': unit}, struct.pack(str('<%d%s' % (len(values), code)), *values)
+
+
+def write(stream, count, columns, order=None, **extra):
+    """
+    write a columnar file of count rows to a binary stream, columns is a list of
+    (name, description, payload), order the names read() return by default
+    (every column when None), extra keys are added to the header
+    """
+    descriptions, chunks, position = {}, [], 0
+    for name, description, payload in columns:
+        padding = -len(payload) % ALIGNMENT
+        descriptions[name] = dict(description, offset=position, length=len(payload))
+        chunks.extend([payload, b'\0' * padding])
+        position += len(payload) + padding
+
+    header = dict(extra, version=VERSION, rows=count, columns=descriptions)
+    header['order'] = list(order or [name for name, description, payload in columns])
+    header = json.dumps(header, sort_keys=True).encode('utf-8')
+    prefix = MAGIC + struct.pack(str('<I'), len(header)) + header
+    stream.write(prefix + b'\0' * (-len(prefix) % ALIGNMENT))
+    for chunk in chunks:
+        stream.write(chunk)
+
+
+class ColumnarFile(object):
+
+    def __init__(self, path):
+        self.file = io.open(path, 'rb')
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # mmap refuse empty files
+            self.file.close()
+            raise ValueError("%s is not a columnar export" % path)
+        if self.map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError("%s is not a columnar export" % path)
+        header_length, = struct.unpack_from('<I', self.map, len(MAGIC))
+        start = len(MAGIC) + 4
+        self.header = json.loads(self.map[start:start + header_length].decode('utf-8'))
+        if self.header['version'] != VERSION:
+            self.close()
+            raise ValueError("unsupported columnar version %s" % self.header['version'])
+        self.data_offset = start + header_length + (-(start + header_length) % ALIGNMENT)
+        self.columns = self.header['columns']
+
+    def __len__(self):
+        return self.header['rows']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    @property
+    def names(self):
+        return self.header['order']
+
+    def unpack(self, name):
+        """
+        tuple of the packed integers of a column
+        """
+        column = self.columns[name]
+        return struct.unpack_from('<%d%s' % (len(self), column['code']), self.map, self.data_offset + column['offset'])
+
+    def column(self, name):
+        """
+        decoded values of a whole column
+        """
+        column = self.columns[name]
+        if column['type'] == TEXT:
+            return [self.text(name, row) for row in range(len(self))]
+        values = self.unpack(name)
+        if column['type'] == DICT:
+            dictionary = column['dictionary']
+            return [dictionary[value] for value in values]
+        if column.get('unit') == 'microseconds':
+            return [from_microseconds(value) for value in values]
+        if column.get('unit') == 'bool':
+            return [bool(value) for value in values]
+        return list(values)
+
+    def text(self, name, row):
+        column = self.columns[name]
+        start, end = struct.unpack_from('<2Q', self.map, self.data_offset + column['offset'] + row * 8)
+        blob = self.data_offset + column['offset'] + (len(self) + 1) * 8
+        return self.map[blob + start:blob + end].decode('utf-8')
+
+    def value(self, name, row):
+        column = self.columns[name]
+        if column['type'] == TEXT:
+            return self.text(name, row)
+        size = struct.calcsize(column['code'])
+        value, = struct.unpack_from('<%s' % column['code'], self.map, self.data_offset + column['offset'] + row * size)
+        if column['type'] == DICT:
+            return column['dictionary'][value]
+        if column.get('unit') == 'microseconds':
+            return from_microseconds(value)
+        if column.get('unit') == 'bool':
+            return bool(value)
+        return value
+
+    def category_ids(self, category):
+        """
+        category ids matching a category id or slug
+        """
+        if isinstance(category, numbers.Integral):
+            return {category}
+        return {int(pk) for pk, slug in self.columns['category']['slugs'].items() if slug == category}
+
+    def filter(self, min_price=None, max_price=None, category=None):
+        """
+        indexes of the rows priced from min_price to max_price in a category
+        (id or slug), reading only the price and category columns
+        """
+        rows = range(len(self))
+        if min_price is not None or max_price is not None:
+            low = float('-inf') if min_price is None else min_price
+            high = float('inf') if max_price is None else max_price
+            prices = self.unpack('price')
+            rows = [row for row in rows if low <= prices[row] <= high]
+        if category is not None:
+            dictionary = self.columns['category']['dictionary']
+            wanted = self.category_ids(category)
+            codes = {code for code, value in enumerate(dictionary) if value in wanted}
+            categories = self.unpack('category')
+            rows = [row for row in rows if categories[row] in codes]
+        return list(rows)
+
+    def read(self, rows, names=None):
+        """
+        yield tuples of the given columns (every column when None) for the row indexes
+        """
+        names = names or self.names
+        for row in rows:
+            yield tuple(self.value(name, row) for name in names)
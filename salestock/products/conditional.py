@@ -0,0 +1,134 @@
+"""
+conditional GET for product and category endpoints.
+clients send back the ETag / Last-Modified they got, and when nothing changed
+the view answer 304 Not Modified before any serializer or response cache work.
+"""
+from __future__ import unicode_literals
+
+import calendar
+import hashlib
+
+from django.db.models import Count, Max
+from django.http import HttpResponseNotModified
+from django.utils.encoding import force_bytes
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+from rest_framework.response import Response
+from .cache import get_or_compute
+
+
+def make_etag(*parts):
+    return hashlib.md5(force_bytes('|'.join('%s' % part for part in parts))).hexdigest()
+
+
+def is_not_modified(request, etag, last_modified):
+    """
+    If-None-Match win over If-Modified-Since when both are sent (RFC 7232 section 6)
+    """
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        # weak comparison, a proxy compressing the body may have weakened our etag
+        etags = [e[2:] if e.startswith('W/') else e for e in if_none_match.split(',')]
+        etags = parse_etags(','.join(e.strip() for e in etags))
+        return '*' in etags or etag in etags
+
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return bool(if_modified_since and last_modified and last_modified <= if_modified_since)
+
+
+def to_timestamp(value):
+    return calendar.timegm(value.utctimetuple()) if value else None
+
+
+class ConditionalGetMixin(object):
+    """
+    ETag and Last-Modified on list and retrieve.
+
+    detail validators come from (slug, updated) of the object.
+    collection validators come from MAX(updated) and COUNT of the filtered
+    queryset, so a row leaving the collection change the count even when
+    it wasn't the newest one.
+    either way the representation format and the user are part of the etag.
+    collection state is cached under the generations of
+    get_collection_state_scopes(), so a response cache hit run no query.
+    must come before ResponseCacheMixin so a 304 skip the cache too.
+    """
+
+    def is_conditional(self, request):
+        return request.method in ('GET', 'HEAD')
+
+    def get_variant(self, request):
+        # same rows can be rendered differently, json vs browsable api for example
+        return (self.format_kwarg, request.accepted_renderer.format, request.user.pk)
+
+    def get_parent_queryset(self):
+        """
+        rows whose updated is bumped when a row leave the collection, a deleted
+        row leaves no updated behind so Last-Modified alone would miss it
+        """
+        return None
+
+    def get_collection_state_scopes(self):
+        """
+        response cache scopes bumped by every write that can change the collection
+        state, parent rows included. empty compute the state on every request
+        """
+        get_cache_scopes = getattr(self, 'get_cache_scopes', None)
+        return tuple(get_cache_scopes()) if get_cache_scopes else ()
+
+    def get_collection_state(self, queryset):
+        """
+        return (updated, count) of the filtered queryset in a single aggregate query
+        """
+        state = queryset.order_by().aggregate(updated=Max('updated'), count=Count('pk'))
+        updated = state['updated']
+        parents = self.get_parent_queryset()
+        if parents is not None:
+            parent_updated = parents.order_by().aggregate(updated=Max('updated'))['updated']
+            updated = max(updated, parent_updated) if updated and parent_updated else updated or parent_updated
+        return updated, state['count']
+
+    def not_modified_or(self, request, etag, last_modified, render):
+        last_modified = to_timestamp(last_modified)
+        if is_not_modified(request, etag, last_modified):
+            response = HttpResponseNotModified()
+        else:
+            response = render()
+            if response.status_code != 200:
+                return response
+        response['ETag'] = quote_etag(etag)
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        if not self.is_conditional(request):
+            return super(ConditionalGetMixin, self).list(request, *args, **kwargs)
+
+        query = sorted(request.query_params.lists())
+        scopes = self.get_collection_state_scopes()
+
+        def compute():
+            return self.get_collection_state(self.filter_queryset(self.get_queryset()))
+        if scopes:
+            updated, count = get_or_compute(scopes, 'state:%s?%r' % (request.path, query), compute)
+        else:
+            updated, count = compute()
+        etag = make_etag(request.path, query, updated and updated.isoformat(), count, *self.get_variant(request))
+        return self.not_modified_or(
+            request, etag, updated,
+            lambda: super(ConditionalGetMixin, self).list(request, *args, **kwargs)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        if not self.is_conditional(request):
+            return super(ConditionalGetMixin, self).retrieve(request, *args, **kwargs)
+
+        instance = self.get_object()
+        etag = make_etag(instance.slug, instance.updated.isoformat(), *self.get_variant(request))
+
+        def render():
+            # same as RetrieveModelMixin.retrieve, without fetching the object twice
+            serializer = self.get_serializer(instance)
+            return Response(serializer.data)
+        return self.not_modified_or(request, etag, instance.updated, render)
+
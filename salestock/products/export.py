@@ -0,0 +1,146 @@
+"""
+streaming export of the product catalog as ndjson or csv.
+rows are read in keyset chunks (WHERE id > last ORDER BY id LIMIT n) with
+.iterator(), so memory stay flat no matter how big the catalog is.
+the columnar format (see products.columnar) is written from the same rows.
+"""
+from __future__ import unicode_literals
+
+import array
+import csv
+import json
+import struct
+
+from django.utils import six
+from . import columnar
+from .renderers import format_datetime
+
+
+EXPORT_COLUMNS = ('title', 'slug', 'category', 'size', 'color', 'price', 'active', 'created', 'updated')
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+CHUNK_SIZE = 1000
+
+
+def iter_rows(queryset, chunk_size=CHUNK_SIZE, with_pk=False):
+    """
+    yield tuple of EXPORT_COLUMNS values for every product in queryset,
+    in primary key order, preceded by the primary key when with_pk
+    """
+    fields = ['pk'] + ['category_id' if c == 'category' else c for c in EXPORT_COLUMNS]
+    queryset = queryset.order_by('pk').values_list(*fields)
+    last_pk = 0
+    while True:
+        count = 0
+        for row in queryset.filter(pk__gt=last_pk)[:chunk_size].iterator():
+            count += 1
+            last_pk = row[0]
+            yield row if with_pk else row[1:]
+        if count < chunk_size:
+            return
+
+
+def format_row(row):
+    """
+    convert values to their json representation, same as the API responses
+    """
+    title, slug, category, size, color, price, active, created, updated = row
+    return (
+        title, slug, category, size, color, '{0:f}'.format(price), active,
+        format_datetime(created), format_datetime(updated),
+    )
+
+
+def iter_ndjson(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(EXPORT_COLUMNS, format_row(row))), ensure_ascii=False, sort_keys=True) + '\n'
+
+
+class Echo(object):
+    """
+    file-like object for csv.writer, write() just return the line
+    """
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows):
+    writer = csv.writer(Echo())
+
+    def encode(values):
+        if six.PY2:
+            return [six.text_type(v).encode('utf-8') for v in values]
+        return values
+
+    yield writer.writerow(encode(EXPORT_COLUMNS))
+    for row in rows:
+        yield writer.writerow(encode(format_row(row)))
+
+
+def iter_export(queryset, export_format, chunk_size=CHUNK_SIZE):
+    rows = iter_rows(queryset, chunk_size)
+    if export_format == 'csv':
+        return iter_csv(rows)
+    return iter_ndjson(rows)
+
+
+def encode_columns(rows, category_slugs=None):
+    """
+    (row count, columns for columnar.write()) of rows of iter_rows().
+    columns are built in memory, about 40 bytes per product plus title
+    and slug text. category_slugs maps category id to slug, for the reader
+    to filter by slug
+    """
+    integers = {
+        'price': ('q', None), 'active': ('B', 'bool'),
+        'created': ('q', 'microseconds'), 'updated': ('q', 'microseconds'),
+    }
+    values = {name: [] for name in integers}
+    offset_packer = struct.Struct(str('<Q'))
+    texts = {name: (bytearray(offset_packer.pack(0)), bytearray()) for name in ('title', 'slug')}
+    dictionaries = {name: {} for name in ('category', 'size', 'color')}
+    codes = {name: array.array(str('I')) for name in dictionaries}
+
+    count = 0
+    for row in rows:
+        count += 1
+        row = dict(zip(EXPORT_COLUMNS, row))
+        values['price'].append(int(row['price']))
+        values['active'].append(int(row['active']))
+        values['created'].append(columnar.to_microseconds(row['created']))
+        values['updated'].append(columnar.to_microseconds(row['updated']))
+        for name, (offsets, blob) in texts.items():
+            blob += row[name].encode('utf-8')
+            offsets += offset_packer.pack(len(blob))
+        for name, dictionary in dictionaries.items():
+            codes[name].append(dictionary.setdefault(row[name], len(dictionary)))
+
+    columns = []
+    for name in EXPORT_COLUMNS:
+        if name in integers:
+            code, unit = integers[name]
+            columns.append(columnar.int_column(name, code, values[name], unit))
+        elif name in texts:
+            offsets, blob = texts[name]
+            columns.append((name, {'type': columnar.TEXT}, bytes(offsets + blob)))
+        else:
+            dictionary = [value for value, _ in sorted(dictionaries[name].items(), key=lambda item: item[1])]
+            code = columnar.code_for(len(dictionary))
+            description = {'type': columnar.DICT, 'code': code, 'dictionary': dictionary}
+            if name == 'category':
+                description['slugs'] = {
+                    six.text_type(pk): slug for pk, slug in (category_slugs or {}).items() if pk in dictionaries[name]
+                }
+            columns.append((name, description, struct.pack(str('<%d%s' % (count, code)), *codes[name])))
+    return count, columns
+
+
+def write_columnar(rows, stream, category_slugs=None):
+    """
+    write rows of iter_rows() to a binary stream as a columnar file, return the row count
+    """
+    count, columns = encode_columns(rows, category_slugs)
+    columnar.write(stream, count, columns)
+    return count
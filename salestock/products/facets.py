@@ -0,0 +1,61 @@
+"""
+facet counts for the filter sidebar: products per size, per color and per
+price range of a filtered queryset, counted by one grouped query on
+(size, color, price bucket) then folded in python.
+"""
+from __future__ import unicode_literals
+
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.db.models import Case, Count, IntegerField, Value, When
+
+
+DEFAULT_PRICE_BUCKETS = (50000, 100000, 200000, 500000, 1000000)
+
+
+def get_price_buckets():
+    return sorted(getattr(settings, 'PRODUCT_PRICE_BUCKETS', DEFAULT_PRICE_BUCKETS))
+
+
+def price_bucket(bounds):
+    """
+    index of the price range as a sql expression, ranges are [min, max)
+    """
+    return Case(*[
+        When(price__lt=bound, then=Value(index)) for index, bound in enumerate(bounds)
+    ], default=Value(len(bounds)), output_field=IntegerField())
+
+
+def sorted_counts(counter):
+    return [
+        OrderedDict((('value', value), ('count', count)))
+        for value, count in sorted(counter.items(), key=lambda item: (-item[1], item[0]))
+    ]
+
+
+def compute_facets(queryset):
+    bounds = get_price_buckets()
+    rows = queryset.order_by().annotate(bucket=price_bucket(bounds)).values(
+        'size', 'color_normalized', 'bucket'
+    ).annotate(count=Count('id'))
+
+    sizes, colors, buckets = Counter(), Counter(), Counter()
+    for row in rows:
+        sizes[row['size']] += row['count']
+        colors[row['color_normalized']] += row['count']
+        buckets[row['bucket']] += row['count']
+
+    prices = []
+    for index, upper in enumerate(bounds + [None]):
+        prices.append(OrderedDict((
+            ('min', bounds[index - 1] if index else 0),
+            ('max', upper),
+            ('count', buckets[index]),
+        )))
+    return OrderedDict((
+        ('count', sum(sizes.values())),
+        ('size', sorted_counts(sizes)),
+        ('color', sorted_counts(colors)),
+        ('price', prices),
+    ))
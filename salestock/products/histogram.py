@@ -0,0 +1,148 @@
+"""
+per category price histograms: active products per price range, kept in
+CategoryPriceBucket and moved by every product write like category stats.
+paginated listings use them for a count estimate and price slider bounds
+without scanning products, category detail expose them.
+
+ranges are [edge, next edge) over PRODUCT_PRICE_HISTOGRAM_EDGES, the first
+range start at 0 and the last one has no upper bound. run
+`python manage.py rebuild_category_stats` after changing the edges.
+"""
+from __future__ import unicode_literals
+
+import bisect
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.db.models import Case, DecimalField, Max, Min, Sum, Value, When
+from rest_framework import serializers
+from .models import CategoryPriceBucket
+
+
+DEFAULT_EDGES = (25000, 50000, 100000, 150000, 200000, 300000, 500000, 1000000)
+
+
+def get_edges():
+    return sorted(getattr(settings, 'PRODUCT_PRICE_HISTOGRAM_EDGES', DEFAULT_EDGES))
+
+
+def lower_bound(price, edges):
+    """
+    lower bound of the range holding price
+    """
+    index = bisect.bisect_right(edges, price)
+    return edges[index - 1] if index else 0
+
+
+def lower_bound_expression(edges):
+    """
+    lower_bound() as a sql expression
+    """
+    lowers = [0] + list(edges)
+    return Case(*[
+        When(price__lt=edge, then=Value(lowers[index])) for index, edge in enumerate(edges)
+    ], default=Value(lowers[-1]), output_field=DecimalField(decimal_places=0, max_digits=10))
+
+
+def deltas(removed=(), added=()):
+    """
+    product count change per (category_id, lower bound), from the
+    (category_id, price) contributions of products leaving and joining
+    categories, None contributions are skipped
+    """
+    edges = get_edges()
+    counts = Counter()
+    for contributions, sign in ((removed, -1), (added, 1)):
+        for contribution in contributions:
+            if contribution is not None:
+                category_id, price = contribution
+                counts[category_id, lower_bound(price, edges)] += sign
+    return counts
+
+
+def get_ranges(counts):
+    """
+    every range with its count, counts maps lower bound to product count
+    """
+    edges = get_edges()
+    return [
+        OrderedDict((('min', lower), ('max', upper), ('count', counts.get(lower, 0))))
+        for lower, upper in zip([0] + edges, edges + [None])
+    ]
+
+
+def estimate_count(ranges, lowest, highest, min_price=None, max_price=None):
+    """
+    products priced from min_price to max_price. a range partly inside count
+    in proportion of the overlap, as if its prices were spread evenly between
+    its bounds, narrowed to the lowest and highest price of the products
+    """
+    if lowest is None or highest is None:
+        return 0
+    start = float('-inf') if min_price is None else float(min_price)
+    end = float('inf') if max_price is None else float(max_price)
+    total = 0.0
+    for price_range in ranges:
+        if not price_range['count']:
+            continue
+        # prices have no decimal places, a range hold [low, high]
+        low = float(max(price_range['min'], lowest))
+        high = float(highest if price_range['max'] is None else min(price_range['max'] - 1, highest))
+        if high < low:
+            # bounds waiting for a refresh, see CategoryManager.remove_product_stats
+            high = low
+        overlap = min(high, end) - max(low, start) + 1
+        if overlap > 0:
+            total += price_range['count'] * min(overlap / (high - low + 1), 1.0)
+    return int(round(total))
+
+
+def get_histogram(category_slug=None):
+    """
+    (ranges, lowest price, highest price) of a category, of every category
+    when None, in a single query on the histogram table
+    """
+    buckets = CategoryPriceBucket.objects.all()
+    if category_slug is not None:
+        buckets = buckets.filter(category__slug=category_slug)
+    rows = list(buckets.order_by().values('lower').annotate(
+        total=Sum('count'), lowest=Min('category__min_price'), highest=Max('category__max_price'),
+    ))
+    lowest = [row['lowest'] for row in rows if row['lowest'] is not None]
+    highest = [row['highest'] for row in rows if row['highest'] is not None]
+    return (
+        get_ranges({row['lower']: row['total'] for row in rows}),
+        min(lowest) if lowest else None,
+        max(highest) if highest else None,
+    )
+
+
+class PriceSummaryMixin(object):
+    """
+    paginated listings get `count_estimate` (from the price histograms, null
+    when filtering on anything else than price) and `price` slider bounds
+    """
+    summary_filters = ('min_price', 'max_price')
+    # bounds are rendered like product prices
+    price_field = serializers.DecimalField(max_digits=10, decimal_places=0)
+
+    def get_histogram_category(self):
+        return self.kwargs.get('slug')
+
+    def get_list_summary(self):
+        ranges, lowest, highest = get_histogram(self.get_histogram_category())
+        form = self.filter_class(self.request.query_params).form
+        count_estimate = None
+        if form.is_valid() and not any(
+            form.cleaned_data.get(name) for name in form.cleaned_data if name not in self.summary_filters
+        ):
+            count_estimate = estimate_count(
+                ranges, lowest, highest, form.cleaned_data.get('min_price'), form.cleaned_data.get('max_price')
+            )
+        return OrderedDict((
+            ('count_estimate', count_estimate),
+            ('price', OrderedDict((
+                ('min', None if lowest is None else self.price_field.to_representation(lowest)),
+                ('max', None if highest is None else self.price_field.to_representation(highest)),
+            ))),
+        ))
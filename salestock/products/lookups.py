@@ -0,0 +1,293 @@
+"""
+per process LRU caches for detail lookups by slug: slug -> pk, and pk -> row
+for safe methods, so a hot product or category detail doesn't query at all.
+
+every process drop the entries changed by its own writes right away, and append
+them to an invalidation log file once the transaction commit. before every
+lookup, a process read what the other processes appended since its last look,
+so gunicorn workers stay coherent with a single stat() in the common case.
+"""
+from __future__ import unicode_literals
+
+import copy
+import io
+import os
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+from django.http import Http404
+from rest_framework.permissions import SAFE_METHODS
+from . import cache
+
+
+STATS_NAMES = ('slug_hits', 'slug_misses', 'row_hits', 'row_misses', 'invalidations')
+
+
+class LRUCache(object):
+    """
+    bounded mapping dropping the least recently used key, safe to share between threads
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            try:
+                value = self.data.pop(key)
+            except KeyError:
+                return None
+            self.data[key] = value
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.data.pop(key, None)
+            self.data[key] = value
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def __len__(self):
+        return len(self.data)
+
+
+class Stats(object):
+    """
+    per process counters, flushed to the shared cache counters every
+    flush_every events so cache_stats can report every worker together
+    """
+    flush_every = 100
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = dict.fromkeys(STATS_NAMES, 0)
+        self.pending = dict.fromkeys(STATS_NAMES, 0)
+
+    def record(self, name):
+        with self.lock:
+            self.local[name] += 1
+            self.pending[name] += 1
+            if sum(self.pending.values()) < self.flush_every:
+                return
+            pending, self.pending = self.pending, dict.fromkeys(STATS_NAMES, 0)
+        for key, count in pending.items():
+            if count:
+                cache.record('lookup_%s' % key, count)
+
+    def get(self):
+        with self.lock:
+            return dict(self.local)
+
+
+class InvalidationLog(object):
+    """
+    append only file shared by the processes of one host, one line per
+    changed object: "<model label> <pk> <slug>". it's replaced by an empty file
+    past max_bytes, a reader seeing another file clear its caches entirely
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.position = None
+
+    @property
+    def path(self):
+        return getattr(settings, 'LOOKUP_CACHE_INVALIDATION_LOG', None)
+
+    @property
+    def max_bytes(self):
+        return getattr(settings, 'LOOKUP_CACHE_INVALIDATION_LOG_MAX_BYTES', 1024 * 1024)
+
+    def publish(self, lines):
+        path = self.path
+        if not path or not lines:
+            return
+        data = ''.join('%s\n' % line for line in lines).encode('utf-8')
+        if os.path.exists(path) and os.path.getsize(path) > self.max_bytes:
+            self.rotate(path)
+        while True:
+            with io.open(path, 'ab') as f:
+                f.write(data)
+                written_to = os.fstat(f.fileno()).st_ino
+            try:
+                if os.stat(path).st_ino == written_to:
+                    return
+            except OSError:
+                pass
+            # another process rotated the file under us, readers may have
+            # already moved to the new one, so write there too
+
+    def rotate(self, path):
+        temporary = '%s.%d' % (path, os.getpid())
+        io.open(temporary, 'wb').close()
+        os.rename(temporary, path)
+
+    def read(self):
+        """
+        return lines appended by any process since the last call,
+        None when the log was replaced and every cache must be cleared
+        """
+        path = self.path
+        if not path:
+            return []
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return []
+        with self.lock:
+            if self.position is None:
+                # first look, everything in the log happened before this process cached anything
+                self.position = (stat.st_ino, stat.st_size)
+                return []
+            inode, offset = self.position
+            if inode == stat.st_ino and offset == stat.st_size:
+                return []
+            if inode != stat.st_ino or stat.st_size < offset:
+                self.position = (stat.st_ino, 0)
+                return None
+            with io.open(path, 'rb') as f:
+                f.seek(offset)
+                data = f.read()
+            # a line being appended is read on the next call
+            complete = data.rfind(b'\n') + 1
+            self.position = (inode, offset + complete)
+        return data[:complete].decode('utf-8').splitlines()
+
+
+class LookupCache(object):
+
+    def __init__(self):
+        self.slugs = {}
+        self.rows = {}
+        self.stats = Stats()
+        self.log = InvalidationLog()
+
+    def get_maxsize(self):
+        return getattr(settings, 'LOOKUP_CACHE_SIZE', 1000)
+
+    def get_caches(self, label):
+        if label not in self.slugs:
+            self.slugs[label] = LRUCache(self.get_maxsize())
+            self.rows[label] = LRUCache(self.get_maxsize())
+        return self.slugs[label], self.rows[label]
+
+    def clear(self):
+        for lru in list(self.slugs.values()) + list(self.rows.values()):
+            lru.clear()
+
+    def sync(self):
+        lines = self.log.read()
+        if lines is None:
+            self.clear()
+            return
+        for line in lines:
+            label, pk, slug = (line.split(' ', 2) + ['', ''])[:3]
+            if pk == '*':
+                self.get_caches(label)[1].clear()
+            else:
+                self.drop(label, int(pk) if pk.isdigit() else None, [slug])
+
+    def drop(self, label, pk, slugs):
+        slug_cache, row_cache = self.get_caches(label)
+        for slug in slugs:
+            if slug:
+                slug_cache.delete(slug)
+        if pk is not None:
+            row_cache.delete(pk)
+
+    def invalidate(self, instance, slugs):
+        """
+        drop the instance under every given slug, here and in the other processes
+        """
+        label = instance._meta.label_lower
+        self.drop(label, instance.pk, slugs)
+        self.stats.record('invalidations')
+        lines = ['%s %s %s' % (label, instance.pk, slug or '') for slug in set(slugs)]
+        transaction.on_commit(lambda: self.log.publish(lines))
+
+    def invalidate_rows(self, label, pks):
+        """
+        drop cached rows by primary key, here and in the other processes,
+        for changes that don't touch the slug
+        """
+        if not pks:
+            return
+        row_cache = self.get_caches(label)[1]
+        for pk in pks:
+            row_cache.delete(pk)
+        self.stats.record('invalidations')
+        lines = ['%s %s ' % (label, pk) for pk in pks]
+        transaction.on_commit(lambda: self.log.publish(lines))
+
+    def clear_rows(self, label):
+        """
+        drop every cached row of a model, for changes reaching many rows at once
+        """
+        self.get_caches(label)[1].clear()
+        self.stats.record('invalidations')
+        transaction.on_commit(lambda: self.log.publish(['%s * ' % label]))
+
+
+lookup_cache = LookupCache()
+
+
+def is_enabled():
+    return getattr(settings, 'LOOKUP_CACHE', True)
+
+
+class CachedLookupMixin(object):
+    """
+    get_object() by slug through the process lookup cache.
+    safe methods get a copy of the cached row, other methods only skip the
+    slug lookup and read a fresh row by primary key. requests with query
+    parameters (other than format) take the usual path, filters may apply
+    """
+
+    def get_object(self):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        if not is_enabled() or set(self.request.query_params) - {'format'}:
+            return super(CachedLookupMixin, self).get_object()
+
+        lookup_cache.sync()
+        label = self.get_queryset().model._meta.label_lower
+        slug_cache, row_cache = lookup_cache.get_caches(label)
+        slug = self.kwargs[lookup_url_kwarg]
+        safe = self.request.method in SAFE_METHODS
+        stats = lookup_cache.stats
+
+        pk = slug_cache.get(slug)
+        if pk is None:
+            stats.record('slug_misses')
+            obj = super(CachedLookupMixin, self).get_object()
+            slug_cache.set(slug, obj.pk)
+            if safe:
+                row_cache.set(obj.pk, copy.copy(obj))
+            return obj
+        stats.record('slug_hits')
+
+        obj = row_cache.get(pk) if safe else None
+        if obj is not None:
+            stats.record('row_hits')
+            obj = copy.copy(obj)
+        else:
+            stats.record('row_misses')
+            obj = self.filter_queryset(self.get_queryset()).filter(pk=pk).first()
+            if obj is None or getattr(obj, self.lookup_field) != slug:
+                slug_cache.delete(slug)
+                raise Http404
+            if safe:
+                row_cache.set(pk, copy.copy(obj))
+        self.check_object_permissions(self.request, obj)
+        return obj
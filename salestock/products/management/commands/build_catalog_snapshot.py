@@ -0,0 +1,29 @@
+from __future__ import unicode_literals
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from products import catalog
+
+
+class Command(BaseCommand):
+    help = (
+        "Write the read-only catalog snapshot of active products and categories "
+        "and swap it in for the API (see products.catalog), once or every --every seconds"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help="file path, default to CATALOG_SNAPSHOT_PATH")
+        parser.add_argument('--every', type=float, help="rebuild forever, seconds between two builds")
+
+    def handle(self, *args, **options):
+        path = options['output'] or catalog.get_path()
+        if not path:
+            raise CommandError("set CATALOG_SNAPSHOT_PATH or pass --output")
+        while True:
+            started = time.time()
+            count = catalog.build(path)
+            self.stdout.write("%d products written to %s in %.2fs" % (count, path, time.time() - started))
+            if not options['every']:
+                return
+            time.sleep(max(options['every'] - (time.time() - started), 0))
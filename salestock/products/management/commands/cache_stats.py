@@ -0,0 +1,35 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+from products import cache, lookups
+
+
+class Command(BaseCommand):
+    help = (
+        "Report hit and miss counters of the listing response cache and of the "
+        "detail lookup caches, counters are shared across processes only with "
+        "file or memcached backend"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help="reset counters after reporting")
+
+    def handle(self, *args, **options):
+        stats = cache.get_stats()
+        total = stats['hits'] + stats['misses']
+        ratio = float(stats['hits']) / total if total else 0.0
+        self.stdout.write("response cache: %d hits, %d misses, hit ratio %.2f" % (
+            stats['hits'], stats['misses'], ratio
+        ))
+        names = ['lookup_%s' % name for name in lookups.STATS_NAMES]
+        stats = {name[len('lookup_'):]: count for name, count in cache.get_stats(names).items()}
+        for kind in ('slug', 'row'):
+            hits, misses = stats['%s_hits' % kind], stats['%s_misses' % kind]
+            ratio = float(hits) / (hits + misses) if hits + misses else 0.0
+            self.stdout.write("%s lookup cache: %d hits, %d misses, hit ratio %.2f" % (
+                kind, hits, misses, ratio
+            ))
+        self.stdout.write("lookup cache invalidations: %d" % stats['invalidations'])
+        if options['reset']:
+            cache.reset_stats()
+            cache.reset_stats(names)
@@ -0,0 +1,89 @@
+from __future__ import unicode_literals
+
+import itertools
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, DEFAULT_DB_ALIAS
+from products import changes
+from products.models import Category, Product
+from products.views import ProductFilter
+
+
+# sample value for every ProductFilter field, only the shape of the query matter
+SAMPLE_FILTERS = [
+    ('color', 'black'),
+    ('size', 'M'),
+    ('min_price', '100000'),
+    ('max_price', '200000'),
+]
+
+SQLITE_TABLE_SCAN = re.compile(r'^SCAN (TABLE )?(?P<table>\w+)\b(?! USING (COVERING )?INDEX)')
+POSTGRES_TABLE_SCAN = re.compile(r'Seq Scan on (?P<table>\w+)')
+
+
+class Command(BaseCommand):
+    help = (
+        "Run EXPLAIN for every ProductFilter combination on product listing "
+        "and fail when one of them fall back to a full scan of the product table"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            raise CommandError("query plan check doesn't support %s" % connection.vendor)
+
+        table = Product._meta.db_table
+        failures = []
+        for label, queryset in self.get_querysets(options['database']):
+            plan = self.explain(connection, queryset)
+            scans = [line for line in plan if self.is_table_scan(connection, line, table)]
+            self.stdout.write("%s %s" % ('FAIL' if scans else 'ok  ', label))
+            for line in plan:
+                self.stdout.write("      %s" % line)
+            if scans:
+                failures.append(label)
+
+        if failures:
+            raise CommandError(
+                "full table scan on %s for: %s" % (table, ', '.join(failures))
+            )
+        self.stdout.write("all product filter combinations use an index")
+
+    def get_querysets(self, using):
+        category = Category.objects.using(using).first()
+        category_slug = category.slug if category else 'sample-category'
+        scopes = [
+            ('products', Product.objects.db_manager(using).all()),
+            ('category', Product.objects.db_manager(using).filter_by_category(category_slug)),
+        ]
+        for scope, base in scopes:
+            for size in range(len(SAMPLE_FILTERS) + 1):
+                for combination in itertools.combinations(SAMPLE_FILTERS, size):
+                    data = dict(combination)
+                    label = '%s[%s]' % (scope, ','.join(sorted(data)) or '-')
+                    yield label, ProductFilter(data, queryset=base).qs
+        yield 'changes', changes.changed_products(changes.BEGINNING, using)
+
+    def explain(self, connection, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                # (id, parent, notused, detail)
+                return [row[-1] for row in cursor.fetchall()]
+            # a seq scan is only picked when no index can answer the query
+            cursor.execute('SET enable_seqscan = off')
+            try:
+                cursor.execute('EXPLAIN ' + sql, params)
+                return [row[0] for row in cursor.fetchall()]
+            finally:
+                cursor.execute('RESET enable_seqscan')
+
+    def is_table_scan(self, connection, line, table):
+        pattern = SQLITE_TABLE_SCAN if connection.vendor == 'sqlite' else POSTGRES_TABLE_SCAN
+        match = pattern.search(line.strip())
+        return match is not None and match.group('table') == table
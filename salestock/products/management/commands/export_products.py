@@ -0,0 +1,54 @@
+from __future__ import unicode_literals
+
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import six
+from products import export
+from products.models import Category, Product
+from products.views import ProductFilter
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream the active product catalog to a file as ndjson or csv, or write "
+        "it as a columnar file (see products.columnar)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', default='ndjson', choices=sorted(export.EXPORT_FORMATS) + ['columnar'])
+        parser.add_argument('--output', help="file path, default to stdout")
+        parser.add_argument('--category', help="category slug")
+        parser.add_argument('--chunk-size', type=int, default=export.CHUNK_SIZE)
+        for name in ProductFilter.base_filters:
+            parser.add_argument('--%s' % name.replace('_', '-'), dest=name)
+
+    def handle(self, *args, **options):
+        if options['category']:
+            queryset = Product.objects.filter_by_category(options['category'])
+        else:
+            queryset = Product.objects.all()
+        data = {
+            name: options[name] for name in ProductFilter.base_filters
+            if options.get(name) is not None
+        }
+        filterset = ProductFilter(data, queryset=queryset)
+        if not filterset.form.is_valid():
+            raise CommandError(filterset.form.errors.as_text())
+
+        output = open(options['output'], 'wb') if options['output'] else None
+        try:
+            stream = output or getattr(sys.stdout, 'buffer', sys.stdout)
+            if options['format'] == 'columnar':
+                export.write_columnar(
+                    export.iter_rows(filterset.qs, options['chunk_size']), stream,
+                    dict(Category.objects.values_list('pk', 'slug')),
+                )
+                return
+            for chunk in export.iter_export(filterset.qs, options['format'], options['chunk_size']):
+                if isinstance(chunk, six.text_type):
+                    chunk = chunk.encode('utf-8')
+                stream.write(chunk)
+        finally:
+            if output:
+                output.close()
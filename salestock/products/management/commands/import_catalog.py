@@ -0,0 +1,147 @@
+from __future__ import unicode_literals
+
+import csv
+import io
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import six
+from rest_framework.exceptions import ValidationError
+from products import bulk
+from products.models import Category
+from products.serializers import CategoryBulkSerializer, ProductBulkSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream categories or products from a csv or ndjson file into the database "
+        "in bounded batches. Products refer to their category by slug. "
+        "Every batch print the --offset/--start-line to resume from after an interruption. "
+        "csv records must fit on one line."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('file')
+        parser.add_argument('--model', choices=['product', 'category'], default='product')
+        parser.add_argument('--format', choices=['csv', 'ndjson'],
+                            help="default from file extension")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--upsert', action='store_true',
+                            help="update rows with existing slug instead of rejecting them")
+        parser.add_argument('--offset', type=int, default=0,
+                            help="byte offset of the first line to import")
+        parser.add_argument('--start-line', type=int, default=1,
+                            help="line number of the first line to import, "
+                                 "lines before it are skipped unless --offset is given")
+
+    def handle(self, *args, **options):
+        path = options['file']
+        file_format = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if file_format not in ('csv', 'ndjson'):
+            raise CommandError("unknown file format, use --format")
+
+        self.model = options['model']
+        self.upsert = options['upsert']
+        if self.model == 'product':
+            # slug -> id map built once, products only carry the category slug
+            self.category_ids = dict(Category.objects.values_list('slug', 'pk'))
+            self.category_pks = {pk: pk for pk in self.category_ids.values()}
+
+        totals = {'created': 0, 'updated': 0, 'errors': 0}
+        started = time.time()
+        imported = 0
+        with io.open(path, 'rb') as f:
+            rows = self.iter_rows(f, file_format, options['offset'], options['start_line'])
+            for _, chunk in bulk.iter_chunks(rows, options['batch_size']):
+                created, updated, errors = self.write(chunk)
+                totals['created'] += created
+                totals['updated'] += updated
+                totals['errors'] += len(errors)
+                for line, detail in errors:
+                    self.stderr.write("line %d: %s" % (line, json.dumps(detail)))
+
+                imported += len(chunk)
+                next_line, next_offset = chunk[-1][2], chunk[-1][3]
+                self.stdout.write("%d rows, %.0f rows/s, resume with --offset=%d --start-line=%d" % (
+                    imported, imported / max(time.time() - started, 1e-6), next_offset, next_line
+                ))
+
+        self.stdout.write("done: %(created)d created, %(updated)d updated, %(errors)d errors" % totals)
+
+    def iter_rows(self, f, file_format, offset, start_line):
+        """
+        yield (line number, row, next line number, byte offset of next line)
+        reading one line at a time, so the file is never loaded in memory.
+        with offset, start_line is the number of the line found at that offset,
+        without it lines before start_line are skipped
+        """
+        header = None
+        number = 1
+        if file_format == 'csv':
+            header = self.parse_csv(f.readline())
+            number = 2
+            if offset and offset < f.tell():
+                raise CommandError("--offset point inside the csv header")
+        if offset:
+            f.seek(offset)
+            number = start_line
+        position = f.tell()
+
+        while True:
+            line = f.readline()
+            if not line:
+                return
+            line_number = number
+            number += 1
+            position += len(line)
+            if line_number < start_line or not line.strip():
+                continue
+            if header is not None:
+                # empty cell means "use the default"
+                row = {k: v for k, v in zip(header, self.parse_csv(line)) if v != ''}
+            else:
+                try:
+                    row = json.loads(line.decode('utf-8'))
+                except ValueError as exc:
+                    row = ValidationError({'non_field_errors': ['Malformed JSON: %s' % exc]})
+            yield line_number, row, number, position
+
+    def parse_csv(self, line):
+        if six.PY2:
+            return [v.decode('utf-8') for v in next(csv.reader([line]))]
+        return next(csv.reader([line.decode('utf-8')]))
+
+    def write(self, chunk):
+        numbers = [line for line, row, next_line, offset in chunk]
+        rows = [row for line, row, next_line, offset in chunk]
+        if self.model == 'product':
+            for index, row in enumerate(rows):
+                if not isinstance(row, dict) or row.get('category') is None:
+                    continue
+                if not isinstance(row['category'], (six.integer_types, six.string_types)):
+                    # ndjson can hold a list or an object, which can't be looked up
+                    rows[index] = ValidationError({
+                        'category': ['Incorrect type. Expected a category slug, received %s.'
+                                     % type(row['category']).__name__]
+                    })
+                elif row['category'] not in self.category_ids:
+                    rows[index] = ValidationError({
+                        'category': ['Category "%s" does not exist.' % row['category']]
+                    })
+                else:
+                    row['category'] = self.category_ids[row['category']]
+            serializer = ProductBulkSerializer(
+                data=rows, many=True,
+                context={'categories': self.category_pks}
+            )
+        else:
+            serializer = CategoryBulkSerializer(data=rows, many=True)
+
+        serializer.is_valid(raise_exception=True)
+        errors = [(numbers[index], detail) for index, detail in serializer.row_errors]
+        valid = [(numbers[index], data) for index, data in serializer.validated_data]
+        write = bulk.write_products if self.model == 'product' else bulk.write_categories
+        created, updated, write_errors = write(valid, upsert=self.upsert)
+        return created, updated, sorted(errors + write_errors)
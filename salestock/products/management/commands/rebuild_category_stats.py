@@ -0,0 +1,40 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Max, Min
+from django.utils import timezone
+from products.models import Category, CategoryPriceBucket, Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute active_product_count, min_price, max_price and price histogram "
+        "of every category from scratch with grouped queries over active products, "
+        "needed after changing PRODUCT_PRICE_HISTOGRAM_EDGES"
+    )
+
+    def handle(self, *args, **options):
+        stats = {
+            row['category']: row for row in
+            Product.objects.all().order_by().values('category').annotate(
+                count=Count('id'), min_price=Min('price'), max_price=Max('price')
+            )
+        }
+        now = timezone.now()
+        changed = 0
+        with transaction.atomic():
+            for category in Category.objects.only('id', 'active_product_count', 'min_price', 'max_price'):
+                row = stats.get(category.pk, {'count': 0, 'min_price': None, 'max_price': None})
+                current = (category.active_product_count, category.min_price, category.max_price)
+                if current == (row['count'], row['min_price'], row['max_price']):
+                    continue
+                Category.objects.filter(pk=category.pk).update(
+                    active_product_count=row['count'],
+                    min_price=row['min_price'],
+                    max_price=row['max_price'],
+                    updated=now,
+                )
+                changed += 1
+            CategoryPriceBucket.objects.rebuild()
+        self.stdout.write("rebuilt stats of %d categories, %d changed" % (len(stats), changed))
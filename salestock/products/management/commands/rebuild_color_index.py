@@ -0,0 +1,33 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from products.models import Product, ProductColorNgram
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute Product.color_normalized and the color n-gram lookup table, "
+        "needed after turning PRODUCT_COLOR_NGRAM_INDEX on"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        queryset = Product.objects.get_queryset().only('id', 'color').order_by('pk')
+        last_pk, total = 0, 0
+        while True:
+            batch = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            with transaction.atomic():
+                for product in batch:
+                    Product.objects.get_queryset().filter(pk=product.pk).update(
+                        color_normalized=Product.normalize_color(product.color)
+                    )
+                ProductColorNgram.objects.index_products(batch)
+            last_pk = batch[-1].pk
+            total += len(batch)
+        self.stdout.write("reindexed color of %d products" % total)
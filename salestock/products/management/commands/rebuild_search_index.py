@@ -0,0 +1,30 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from products.models import Product, SearchPosting
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the full text search index of every product from scratch, "
+        "needed after turning PRODUCT_SEARCH_INDEX on"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        queryset = Product.objects.get_queryset().only('id', 'title', 'category').order_by('pk')
+        SearchPosting.objects.clear()
+        last_pk, total = 0, 0
+        while True:
+            batch = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            with transaction.atomic():
+                SearchPosting.objects.index_products(batch)
+            last_pk = batch[-1].pk
+            total += len(batch)
+        self.stdout.write("indexed %d products" % total)
@@ -0,0 +1,321 @@
+"""
+per request instrumentation: wall time, database queries and their time,
+serializer time and response size of every request, aggregated per url name
+into in-process histograms and exposed on /metrics in Prometheus text format.
+
+queries are timed by a cursor wrapper installed on every connection, django 1.9
+has no execute hook and the debug cursor is too slow to keep on in production.
+requests slower than REQUEST_METRICS_SLOW_SECONDS are logged with their SQL.
+"""
+from __future__ import division, unicode_literals
+
+import bisect
+import contextlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.utils import CursorDebugWrapper, CursorWrapper
+from django.http import HttpResponse, HttpResponseForbidden
+from django.views.generic import View
+from rest_framework.serializers import ListSerializer
+
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# url names left out of the metrics
+EXCLUDED_VIEWS = {'metrics'}
+
+_local = threading.local()
+
+
+def is_enabled():
+    return getattr(settings, 'REQUEST_METRICS', True)
+
+
+def get_slow_threshold():
+    # seconds, None disable the slow request log
+    return getattr(settings, 'REQUEST_METRICS_SLOW_SECONDS', 1.0)
+
+
+class Histogram(object):
+    """
+    cumulative buckets, sum and count of observed values, one set per labels
+    """
+
+    def __init__(self, name, documentation, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def observe(self, labels, value):
+        with self.lock:
+            counts, total = self.series.get(labels) or ([0] * (len(self.buckets) + 1), 0)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.series[labels] = (counts, total + value)
+
+    def clear(self):
+        with self.lock:
+            self.series.clear()
+
+    def expose(self):
+        lines = [
+            '# HELP %s %s' % (self.name, self.documentation),
+            '# TYPE %s histogram' % self.name,
+        ]
+        with self.lock:
+            series = sorted((labels, list(counts), total) for labels, (counts, total) in self.series.items())
+        for labels, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (self.name, format_labels(labels + (('le', bound),)), cumulative))
+            lines.append('%s_sum%s %s' % (self.name, format_labels(labels), repr(float(total))))
+            lines.append('%s_count%s %d' % (self.name, format_labels(labels), cumulative))
+        return lines
+
+
+class Counter(object):
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def inc(self, labels, value=1):
+        with self.lock:
+            self.series[labels] = self.series.get(labels, 0) + value
+
+    def clear(self):
+        with self.lock:
+            self.series.clear()
+
+    def expose(self):
+        lines = [
+            '# HELP %s %s' % (self.name, self.documentation),
+            '# TYPE %s counter' % self.name,
+        ]
+        with self.lock:
+            series = sorted(self.series.items())
+        for labels, value in series:
+            lines.append('%s%s %d' % (self.name, format_labels(labels), value))
+        return lines
+
+
+def format_labels(labels):
+    def escape(value):
+        return ('%s' % value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+    return '{%s}' % ','.join('%s="%s"' % (name, escape(value)) for name, value in labels)
+
+
+requests_total = Counter('salestock_requests_total', "Requests by view, method and status.")
+request_duration = Histogram(
+    'salestock_request_duration_seconds', "Wall time of the request.", DURATION_BUCKETS
+)
+request_queries = Histogram(
+    'salestock_request_queries', "Database queries run by the request.", QUERY_BUCKETS
+)
+request_query_duration = Histogram(
+    'salestock_request_query_duration_seconds', "Time spent in database queries.", DURATION_BUCKETS
+)
+request_serializer_duration = Histogram(
+    'salestock_request_serializer_duration_seconds', "Time spent in serializers.", DURATION_BUCKETS
+)
+response_bytes = Histogram(
+    'salestock_response_bytes', "Size of the response body.", BYTES_BUCKETS
+)
+METRICS = [
+    requests_total, request_duration, request_queries,
+    request_query_duration, request_serializer_duration, response_bytes,
+]
+
+
+def clear():
+    for metric in METRICS:
+        metric.clear()
+
+
+def expose():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.expose())
+    return '\n'.join(lines) + '\n'
+
+
+class RequestMetrics(object):
+    """
+    what one request spent, collected while it runs
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.queries = []
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+
+    @property
+    def query_time(self):
+        return sum(duration for _, _, duration in self.queries)
+
+
+def get_current():
+    return getattr(_local, 'current', None)
+
+
+def record_query(sql, params, duration):
+    current = get_current()
+    if current is not None:
+        current.queries.append((sql, params, duration))
+
+
+@contextlib.contextmanager
+def measure_serializer():
+    """
+    add the time of the block to the serializer time of the request,
+    nested serializers are only counted once
+    """
+    current = get_current()
+    if current is None:
+        yield
+        return
+    current.serializer_depth += 1
+    started = time.time()
+    try:
+        yield
+    finally:
+        current.serializer_depth -= 1
+        if not current.serializer_depth:
+            current.serializer_time += time.time() - started
+
+
+class TimedCursorWrapper(CursorWrapper):
+
+    def execute(self, sql, params=None):
+        started = time.time()
+        try:
+            return super(TimedCursorWrapper, self).execute(sql, params)
+        finally:
+            record_query(sql, params, time.time() - started)
+
+    def executemany(self, sql, param_list):
+        started = time.time()
+        try:
+            return super(TimedCursorWrapper, self).executemany(sql, param_list)
+        finally:
+            record_query(sql, None, time.time() - started)
+
+
+def install_cursor_wrapper(connection):
+    """
+    time every query of the connection, connections are per thread so it's
+    done once per connection object, on its first request
+    """
+    if getattr(connection, '_timed_cursor', False):
+        return
+    connection.make_cursor = lambda cursor: TimedCursorWrapper(cursor, connection)
+    connection.make_debug_cursor = lambda cursor: CursorDebugWrapper(
+        TimedCursorWrapper(cursor, connection), connection
+    )
+    connection._timed_cursor = True
+
+
+class TimedSerializerMixin(object):
+    """
+    count .data in the serializer time of the request, use TimedListSerializer
+    as Meta.list_serializer_class to count many=True once per list instead of per row
+    """
+
+    @property
+    def data(self):
+        with measure_serializer():
+            return super(TimedSerializerMixin, self).data
+
+
+class TimedListSerializer(TimedSerializerMixin, ListSerializer):
+    pass
+
+
+def get_filters(request, view_func):
+    """
+    names of the view filter_class parameters used by the request, values are
+    left out to keep the number of series bounded
+    """
+    filter_class = getattr(getattr(view_func, 'cls', None), 'filter_class', None)
+    if filter_class is None:
+        return ''
+    return ','.join(sorted(set(request.GET) & set(filter_class.base_filters)))
+
+
+class MetricsMiddleware(object):
+    """
+    must come first in MIDDLEWARE_CLASSES so the wall time cover the other middlewares
+    """
+
+    def process_request(self, request):
+        if not is_enabled():
+            return None
+        for connection in connections.all():
+            install_cursor_wrapper(connection)
+        _local.current = request._metrics = RequestMetrics()
+        return None
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if hasattr(request, '_metrics'):
+            request._metrics.filters = get_filters(request, view_func)
+        return None
+
+    def process_response(self, request, response):
+        current = getattr(request, '_metrics', None)
+        if current is None:
+            return response
+        _local.current = None
+        match = getattr(request, 'resolver_match', None)
+        view = match.url_name if match is not None and match.url_name else 'unresolved'
+        if view in EXCLUDED_VIEWS:
+            return response
+
+        duration = time.time() - current.started
+        labels = (('view', view), ('method', request.method), ('filters', getattr(current, 'filters', '')))
+        requests_total.inc(labels + (('status', response.status_code),))
+        request_duration.observe(labels, duration)
+        request_queries.observe(labels, len(current.queries))
+        request_query_duration.observe(labels, current.query_time)
+        request_serializer_duration.observe(labels, current.serializer_time)
+        if not response.streaming:
+            response_bytes.observe(labels, len(response.content))
+
+        threshold = get_slow_threshold()
+        if threshold is not None and duration >= threshold:
+            self.log_slow_request(request, view, duration, current)
+        return response
+
+    def log_slow_request(self, request, view, duration, current):
+        lines = ['slow request %s %s (%s) %.3fs, %d queries in %.3fs, serializer %.3fs' % (
+            request.method, request.get_full_path(), view, duration,
+            len(current.queries), current.query_time, current.serializer_time,
+        )]
+        for sql, params, query_duration in current.queries:
+            lines.append('  %.3fs %s %r' % (query_duration, sql, params))
+        logger.warning('\n'.join(lines))
+
+
+class MetricsView(View):
+    """
+    Prometheus scrape endpoint, open to REQUEST_METRICS_ALLOWED_IPS only
+    (every address when the setting is empty)
+    """
+
+    def get(self, request, *args, **kwargs):
+        allowed = getattr(settings, 'REQUEST_METRICS_ALLOWED_IPS', ('127.0.0.1', '::1'))
+        if allowed and request.META.get('REMOTE_ADDR') not in allowed:
+            return HttpResponseForbidden()
+        return HttpResponse(expose(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-18 09:46
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_color_index(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    ProductColorNgram = apps.get_model('products', 'ProductColorNgram')
+    for product in Product.objects.all().iterator():
+        normalized = product.color.lower()
+        Product.objects.filter(pk=product.pk).update(color_normalized=normalized)
+        ProductColorNgram.objects.bulk_create([
+            ProductColorNgram(product_id=product.pk, gram=gram)
+            for gram in sorted({normalized[i:i + 3] for i in range(len(normalized) - 2)})
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_product_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductColorNgram',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gram', models.CharField(max_length=3)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='color_normalized',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=120),
+        ),
+        migrations.AddField(
+            model_name='productcolorngram',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='color_ngrams', to='products.Product'),
+        ),
+        migrations.AlterIndexTogether(
+            name='productcolorngram',
+            index_together=set([('gram', 'product')]),
+        ),
+        migrations.RunPython(populate_color_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-18 09:54
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Min
+
+
+def populate_category_stats(apps, schema_editor):
+    Category = apps.get_model('products', 'Category')
+    Product = apps.get_model('products', 'Product')
+    stats = Product.objects.filter(active=True).values('category').annotate(
+        count=Count('id'), min_price=Min('price'), max_price=Max('price')
+    )
+    for row in stats:
+        Category.objects.filter(pk=row['category']).update(
+            active_product_count=row['count'],
+            min_price=row['min_price'],
+            max_price=row['max_price'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_product_color_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='active_product_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='max_price',
+            field=models.DecimalField(blank=True, decimal_places=0, editable=False, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='min_price',
+            field=models.DecimalField(blank=True, decimal_places=0, editable=False, max_digits=10, null=True),
+        ),
+        migrations.RunPython(populate_category_stats, migrations.RunPython.noop),
+    ]
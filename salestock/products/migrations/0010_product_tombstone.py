@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-18 09:59
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0009_category_product_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductTombstone',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_id', models.IntegerField()),
+                ('slug', models.SlugField(blank=True, null=True)),
+                ('category_id', models.IntegerField(blank=True, null=True)),
+                ('reason', models.CharField(choices=[('deleted', 'deleted'), ('deactivated', 'deactivated')], max_length=12)),
+                ('removed', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='product',
+            index_together=set([('active', 'updated'), ('active', 'created'), ('active', 'price'), ('active', 'size', 'price'), ('active', 'category', 'price')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='producttombstone',
+            index_together=set([('removed', 'id')]),
+        ),
+    ]
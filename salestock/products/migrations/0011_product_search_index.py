@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-18 10:01
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+from collections import Counter
+import re
+
+
+def terms(text):
+    return [token[:40] for token in re.findall(r'\w+', (text or '').lower(), re.UNICODE)]
+
+
+def populate_search_index(apps, schema_editor):
+    Category = apps.get_model('products', 'Category')
+    Product = apps.get_model('products', 'Product')
+    SearchDocument = apps.get_model('products', 'SearchDocument')
+    SearchPosting = apps.get_model('products', 'SearchPosting')
+    categories = {c.pk: terms(c.title) + terms(c.description) for c in Category.objects.all()}
+    for product in Product.objects.all().iterator():
+        counts = Counter(terms(product.title) + categories.get(product.category_id, []))
+        length = sum(counts.values())
+        SearchDocument.objects.create(product_id=product.pk, length=length)
+        SearchPosting.objects.bulk_create([
+            SearchPosting(term=term, product_id=product.pk, frequency=frequency, length=length)
+            for term, frequency in counts.items()
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0010_product_tombstone'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='products.Product')),
+                ('length', models.PositiveIntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SearchPosting',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=40)),
+                ('frequency', models.PositiveIntegerField()),
+                ('length', models.PositiveIntegerField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_postings', to='products.Product')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='searchposting',
+            index_together=set([('term', 'product')]),
+        ),
+        migrations.RunPython(populate_search_index, migrations.RunPython.noop),
+    ]
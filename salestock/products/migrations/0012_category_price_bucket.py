@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-18 10:34
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def populate_price_buckets(apps, schema_editor):
+    from products.histogram import get_edges, lower_bound_expression
+    CategoryPriceBucket = apps.get_model('products', 'CategoryPriceBucket')
+    Product = apps.get_model('products', 'Product')
+    rows = Product.objects.filter(active=True).order_by().annotate(
+        lower=lower_bound_expression(get_edges())
+    ).values('category', 'lower').annotate(count=Count('id'))
+    CategoryPriceBucket.objects.bulk_create([
+        CategoryPriceBucket(category_id=row['category'], lower=row['lower'], count=row['count']) for row in rows
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0011_product_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryPriceBucket',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lower', models.DecimalField(decimal_places=0, max_digits=10)),
+                ('count', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='price_buckets', to='products.Category')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='categorypricebucket',
+            unique_together=set([('category', 'lower')]),
+        ),
+        migrations.RunPython(populate_price_buckets, migrations.RunPython.noop),
+    ]
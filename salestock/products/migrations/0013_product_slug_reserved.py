@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-18 10:58
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import products.models
+
+
+def rename_reserved_slugs(apps, schema_editor):
+    """
+    products already slugged after a collection url couldn't be reached
+    """
+    Product = apps.get_model('products', 'Product')
+    for product in Product.objects.filter(slug__in=products.models.RESERVED_PRODUCT_SLUGS):
+        suffix = 1
+        while Product.objects.filter(slug='%s-%d' % (product.slug, suffix)).exists():
+            suffix += 1
+        Product.objects.filter(pk=product.pk).update(slug='%s-%d' % (product.slug, suffix))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0012_category_price_bucket'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='slug',
+            field=models.SlugField(blank=True, null=True, unique=True, validators=[products.models.validate_product_slug]),
+        ),
+        migrations.RunPython(rename_reserved_slugs, migrations.RunPython.noop),
+    ]
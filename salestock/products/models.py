@@ -1,16 +1,84 @@
 from __future__ import unicode_literals
 
-from django.db import models
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, F, Max, Min, Value
+from django.db.models.functions import Coalesce, Greatest, Least
+from django.utils import timezone
 from cms.models import ContentManageable
+from jobs.models import Job
 from django.template.defaultfilters import slugify
 # Create your models here.
 
 
+class CategoryManager(models.Manager):
+    """
+    keep denormalized active product stats of categories up to date.
+    updated is bumped too, because category representation change with the stats
+    """
+
+    def add_product_stats(self, category_id, min_price, max_price=None, count=1):
+        """
+        `count` active products priced from min_price to max_price joined the category,
+        done in a single UPDATE without looking at the other products
+        """
+        if max_price is None:
+            max_price = min_price
+        # bind prices as int, sqlite bind Decimal as text which MIN()/MAX() compare
+        # above every number. prices have no decimal places so int is exact
+        min_value = Value(int(min_price))
+        max_value = Value(int(max_price))
+        self.filter(pk=category_id).update(
+            active_product_count=F('active_product_count') + count,
+            min_price=Least(Coalesce('min_price', min_value), min_value),
+            max_price=Greatest(Coalesce('max_price', max_value), max_value),
+            updated=timezone.now(),
+        )
+
+    def remove_product_stats(self, category_id, price):
+        """
+        an active product with price left the category, the count is updated
+        in place, min and max only need recomputing (refresh_stats) when the
+        product was holding one of them.
+        return True when min and max have to be recomputed
+        """
+        stale = self.filter(pk=category_id).filter(models.Q(min_price=price) | models.Q(max_price=price)).exists()
+        self.filter(pk=category_id).update(
+            active_product_count=F('active_product_count') - 1,
+            updated=timezone.now(),
+        )
+        return stale
+
+    def refresh_stats(self, category_ids):
+        """
+        recompute stats of the given categories from their active products
+        """
+        for category_id in set(category_ids):
+            stats = Product.objects.all().filter(category_id=category_id).aggregate(
+                count=Count('id'), min_price=Min('price'), max_price=Max('price')
+            )
+            self.filter(pk=category_id).update(
+                active_product_count=stats['count'],
+                min_price=stats['min_price'],
+                max_price=stats['max_price'],
+                updated=timezone.now(),
+            )
+
+
 class Category(ContentManageable):
     title = models.CharField(max_length=120)
     slug = models.SlugField(blank=True, null=True, unique=True)
     description = models.TextField(blank=True, null=True)
     active = models.BooleanField(default=True)
+    # denormalized from active products, see CategoryManager
+    active_product_count = models.PositiveIntegerField(default=0, editable=False)
+    min_price = models.DecimalField(decimal_places=0, max_digits=10, null=True, blank=True, editable=False)
+    max_price = models.DecimalField(decimal_places=0, max_digits=10, null=True, blank=True, editable=False)
+    objects = CategoryManager()
 
 
     def __unicode__(self):
@@ -29,11 +97,127 @@ class Category(ContentManageable):
         verbose_name_plural = "categories"
 
 
+class CategoryPriceBucketManager(models.Manager):
+
+    def add(self, counts):
+        """
+        apply product count changes, counts maps (category_id, lower) to a delta,
+        see products.histogram.deltas
+        """
+        for (category_id, lower), delta in counts.items():
+            if not delta:
+                continue
+            bucket = self.filter(category_id=category_id, lower=lower)
+            if bucket.update(count=F('count') + delta):
+                continue
+            try:
+                with transaction.atomic():
+                    self.create(category_id=category_id, lower=lower, count=delta)
+            except IntegrityError:
+                # created by a concurrent write
+                bucket.update(count=F('count') + delta)
+
+    def rebuild(self, category_ids=None):
+        """
+        recompute price histograms of the categories, of every category when
+        None, from their active products with one grouped query
+        """
+        from .histogram import get_edges, lower_bound_expression  # avoid circular import
+        products = Product.objects.all().order_by()
+        buckets = self.all()
+        if category_ids is not None:
+            category_ids = list(category_ids)
+            if not category_ids:
+                return
+            products = products.filter(category__in=category_ids)
+            buckets = buckets.filter(category__in=category_ids)
+        rows = products.annotate(lower=lower_bound_expression(get_edges())).values(
+            'category', 'lower'
+        ).annotate(count=Count('id'))
+        buckets.delete()
+        self.bulk_create([
+            self.model(category_id=row['category'], lower=row['lower'], count=row['count']) for row in rows
+        ])
+
+
+class CategoryPriceBucket(models.Model):
+    """
+    active products of a category priced from lower up to the next edge,
+    see products.histogram
+    """
+    category = models.ForeignKey(Category, related_name='price_buckets', on_delete=models.CASCADE)
+    lower = models.DecimalField(decimal_places=0, max_digits=10)
+    count = models.IntegerField(default=0)
+    objects = CategoryPriceBucketManager()
+
+    class Meta:
+        unique_together = [('category', 'lower')]
+
+
+COLOR_NGRAM_SIZE = 3
+
+
+def color_ngrams(value, size=COLOR_NGRAM_SIZE):
+    """
+    return set of distinct n-grams of normalized color, used as lookup keys
+    for substring search: "black" -> {"bla", "lac", "ack"}
+    """
+    return {value[i:i + size] for i in range(len(value) - size + 1)}
+
+
+SEARCH_TERM_LENGTH = 40
+SEARCH_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+def search_terms(text):
+    """
+    lower cased words of text, the same tokenizer is used for indexing and querying
+    """
+    return [token[:SEARCH_TERM_LENGTH] for token in SEARCH_TOKEN.findall((text or '').lower())]
+
+
+# collection urls of products/urls.py matched before /products/<slug>/,
+# a product with one of these slugs couldn't be reached
+RESERVED_PRODUCT_SLUGS = frozenset(['bulk', 'changes', 'export', 'facets', 'search'])
+
+
+def product_slug(title):
+    """
+    slug generated from a product title, suffixed when it's a reserved url
+    """
+    slug = slugify(title)
+    if slug in RESERVED_PRODUCT_SLUGS:
+        slug += '-1'
+    return slug
+
+
+def validate_product_slug(value):
+    if value in RESERVED_PRODUCT_SLUGS:
+        raise ValidationError("%s is reserved by a product url." % value)
+
+
 class ProductQuerySet(models.query.QuerySet):
+    # columns read by FlatProductSerializer and keyset pagination
+    LISTING_FIELDS = ('id', 'title', 'slug', 'category', 'size', 'color', 'price', 'active', 'created')
+
     # return currently active products
     def active(self):
         return self.filter(active=True)
 
+    def with_relations(self):
+        """
+        join category and users in the same query, so serializer or admin
+        reading them doesn't run one query per product
+        """
+        return self.select_related('category', 'creator', 'last_modified_by')
+
+    def for_listing(self):
+        """
+        read only listing, fetch just the columns the list serializer needs.
+        category is only rendered as its id, so it doesn't need a join
+        """
+        return self.only(*self.LISTING_FIELDS)
+
 
 class ProductManager(models.Manager):
 
@@ -45,25 +229,179 @@ class ProductManager(models.Manager):
         return self.get_queryset().active()
 
 
+    # active products of the category
     def filter_by_category(self, category_slug):
-        return self.get_queryset().filter(category__slug=category_slug)
+        return self.all().filter(category__slug=category_slug)
 
 
 
 class Product(ContentManageable):
     title = models.CharField(max_length=120)
-    slug = models.SlugField(blank=True, null=True, unique=True)
+    slug = models.SlugField(blank=True, null=True, unique=True, validators=[validate_product_slug])
     category = models.ForeignKey(Category, related_name='products')
     size = models.CharField(max_length=4)
     color = models.CharField(max_length=120)
     price = models.DecimalField(decimal_places=0, max_digits=10)
     active = models.BooleanField(default=True)
+    # lower cased color kept in sync by save(), so color lookups can use an index
+    color_normalized = models.CharField(max_length=120, blank=True, default='', editable=False, db_index=True)
     objects = ProductManager()
 
     def __unicode__(self):
         return self.title
 
+    @staticmethod
+    def normalize_color(color):
+        return (color or '').lower()
+
     def save(self, *args, **kwargs):
         if not self.slug:
-            self.slug = slugify(self.title)
-        return super(Product, self).save(*args, **kwargs)
+            self.slug = product_slug(self.title)
+        self.color_normalized = self.normalize_color(self.color)
+        reindex_color = self.has_changed('color_normalized')
+        reindex_search = self.has_changed('title') or self.has_changed('category_id')
+        result = super(Product, self).save(*args, **kwargs)
+        if reindex_color and getattr(settings, 'PRODUCT_COLOR_NGRAM_INDEX', True):
+            ProductColorNgram.objects.index_products([self])
+        if reindex_search and getattr(settings, 'PRODUCT_SEARCH_INDEX', True):
+            from .tasks import index_products  # avoid circular import
+            Job.objects.enqueue(index_products, [self.pk], key=self.pk)
+        return result
+
+    class Meta:
+        """
+        composite indexes shaped for ProductFilter lookups, every listing
+        query filter on active=True first (see ProductManager.all)
+        """
+        index_together = [
+            ('active', 'created'),
+            ('active', 'price'),
+            ('active', 'category', 'price'),
+            ('active', 'size', 'price'),
+            ('active', 'updated'),
+        ]
+
+
+class ProductColorNgramManager(models.Manager):
+
+    def index_products(self, products):
+        """
+        replace n-grams rows of given saved products with their current color
+        """
+        products = [p for p in products if p.pk is not None]
+        self.filter(product__in=[p.pk for p in products]).delete()
+        self.bulk_create([
+            self.model(product_id=p.pk, gram=gram)
+            for p in products
+            for gram in sorted(color_ngrams(Product.normalize_color(p.color)))
+        ])
+
+
+class ProductColorNgram(models.Model):
+    """
+    optional n-gram lookup table for substring search on product color,
+    one row per distinct n-gram of Product.color_normalized
+    """
+    product = models.ForeignKey(Product, related_name='color_ngrams')
+    gram = models.CharField(max_length=COLOR_NGRAM_SIZE)
+    objects = ProductColorNgramManager()
+
+    class Meta:
+        index_together = [('gram', 'product')]
+
+
+class SearchPostingManager(models.Manager):
+
+    def index_products(self, products):
+        """
+        replace postings and document length of given saved products, text
+        is the product title plus title and description of its category
+        """
+        products = [p for p in products if p.pk is not None]
+        if not products:
+            return
+        categories = Category.objects.only('title', 'description').in_bulk(list({p.category_id for p in products}))
+        pks = [p.pk for p in products]
+        self.filter(product__in=pks).delete()
+        SearchDocument.objects.filter(product__in=pks).delete()
+
+        documents, postings = [], []
+        for product in products:
+            category = categories.get(product.category_id)
+            terms = Counter(search_terms(product.title))
+            if category is not None:
+                terms.update(search_terms(category.title))
+                terms.update(search_terms(category.description))
+            length = sum(terms.values())
+            documents.append(SearchDocument(product_id=product.pk, length=length))
+            postings.extend(
+                self.model(term=term, product_id=product.pk, frequency=frequency, length=length)
+                for term, frequency in terms.items()
+            )
+        SearchDocument.objects.bulk_create(documents)
+        self.bulk_create(postings)
+        # collection stats used by ranking are cached, see products.search
+        from .search import clear_stats
+        clear_stats()
+
+    def clear(self):
+        self.all().delete()
+        SearchDocument.objects.all().delete()
+
+
+class SearchDocument(models.Model):
+    """
+    indexed length of every product, search ranking need the collection size
+    and average length
+    """
+    product = models.OneToOneField(Product, primary_key=True, related_name='search_document')
+    length = models.PositiveIntegerField()
+
+
+class SearchPosting(models.Model):
+    """
+    inverted index, one row per distinct term of a product.
+    length of the document is repeated so ranking doesn't need another join
+    """
+    term = models.CharField(max_length=SEARCH_TERM_LENGTH)
+    product = models.ForeignKey(Product, related_name='search_postings')
+    frequency = models.PositiveIntegerField()
+    length = models.PositiveIntegerField()
+    objects = SearchPostingManager()
+
+    class Meta:
+        index_together = [('term', 'product')]
+
+
+class ProductTombstoneManager(models.Manager):
+
+    def record(self, products, reason):
+        """
+        remember products that left the active catalog, so delta sync can
+        tell mirrors to drop them
+        """
+        now = timezone.now()
+        self.bulk_create([
+            self.model(product_id=p.pk, slug=p.slug, category_id=p.category_id, reason=reason, removed=now)
+            for p in products
+        ])
+
+
+class ProductTombstone(models.Model):
+    """
+    one row per product deleted or deactivated, a deleted product has no
+    row left to carry its updated timestamp
+    """
+    DELETED = 'deleted'
+    DEACTIVATED = 'deactivated'
+    REASON_CHOICES = ((DELETED, 'deleted'), (DEACTIVATED, 'deactivated'))
+
+    product_id = models.IntegerField()
+    slug = models.SlugField(blank=True, null=True)
+    category_id = models.IntegerField(blank=True, null=True)
+    reason = models.CharField(max_length=12, choices=REASON_CHOICES)
+    removed = models.DateTimeField(default=timezone.now)
+    objects = ProductTombstoneManager()
+
+    class Meta:
+        index_together = [('removed', 'id')]
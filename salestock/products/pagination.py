@@ -0,0 +1,178 @@
+from __future__ import unicode_literals
+
+import binascii
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Q
+from django.utils import six
+from django.utils.dateparse import parse_datetime
+from django.utils.six.moves.urllib import parse as urlparse
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    opt-in keyset (seek) pagination, only active when the client send
+    ?cursor= or ?page_size= so plain list responses stay unchanged.
+
+    every page is fetched with WHERE (field, id) > (value, id) ORDER BY field, id LIMIT n
+    so the cost of a page is the same no matter how deep the client goes.
+    url:
+        http://localhost/products/?page_size=20&ordering=-price
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    ordering_query_param = 'ordering'
+    page_size = 20
+    max_page_size = 100
+
+    # ordering field -> parser for the value stored inside the cursor
+    orderings = {
+        'created': parse_datetime,
+        'price': Decimal,
+    }
+    default_ordering = 'created'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.start(request, view):
+            return None
+
+        # walking backwards means flipping the direction, then flipping the page back
+        descending = self.is_walking_down()
+        prefix = '-' if descending else ''
+        queryset = queryset.order_by(prefix + self.field, prefix + 'id')
+
+        if self.cursor is not None:
+            lookup = 'lt' if descending else 'gt'
+            value, pk = self.cursor['value'], self.cursor['id']
+            queryset = queryset.filter(
+                Q(**{'%s__%s' % (self.field, lookup): value}) |
+                Q(**{self.field: value, 'id__%s' % lookup: pk})
+            )
+
+        results = list(queryset[:self.page_size + 1])
+        return self.set_page(results[:self.page_size], len(results) > self.page_size)
+
+    def is_walking_down(self):
+        """
+        whether the page is read in descending (field, id) order
+        """
+        return self.descending != (self.cursor is not None and self.cursor['reverse'])
+
+    def start(self, request, view=None):
+        """
+        read page size, ordering and cursor from the request,
+        return False when the request isn't paginated
+        """
+        if not (self.cursor_query_param in request.query_params or
+                self.page_size_query_param in request.query_params):
+            return False
+
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request)
+        self.field = self.ordering.lstrip('-')
+        self.descending = self.ordering.startswith('-')
+        self.cursor = self.decode_cursor(request)
+        # count estimate and price bounds, see products.histogram.PriceSummaryMixin
+        self.summary = view.get_list_summary() if hasattr(view, 'get_list_summary') else None
+        return True
+
+    def set_page(self, results, has_more):
+        """
+        keep the page fetched after start(), in walking direction, has_more
+        tell whether rows were left behind it. return the page in display order
+        """
+        reverse = self.cursor is not None and self.cursor['reverse']
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.cursor is not None
+        self.page = results
+        return results
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict(
+            [('next', self.get_next_link()), ('previous', self.get_previous_link())] +
+            list((self.summary or {}).items()) +
+            [('results', data)]
+        ))
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, request):
+        ordering = request.query_params.get(self.ordering_query_param, self.default_ordering)
+        if ordering.lstrip('-') not in self.orderings:
+            return self.default_ordering
+        return ordering
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def decode_cursor(self, request):
+        """
+        cursor is an opaque base64 string holding ordering, direction,
+        and (value, id) of the row the page starts after
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        try:
+            querystring = urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8')
+            tokens = dict(urlparse.parse_qsl(querystring, keep_blank_values=True))
+            if tokens['o'] != self.ordering:
+                raise ValueError('cursor belongs to another ordering')
+            value = self.orderings[self.field](tokens['v'])
+            if value is None:
+                raise ValueError('malformed cursor value')
+            return {
+                'reverse': tokens.get('r') == '1',
+                'value': value,
+                'id': int(tokens['i']),
+            }
+        except (TypeError, ValueError, KeyError, InvalidOperation, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, instance, reverse):
+        tokens = [
+            ('o', self.ordering),
+            ('v', six.text_type(getattr(instance, self.field))),
+            ('i', six.text_type(instance.pk)),
+        ]
+        if reverse:
+            tokens.append(('r', '1'))
+        querystring = urlparse.urlencode(tokens)
+        encoded = urlsafe_b64encode(querystring.encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+
+class SearchPagination(LimitOffsetPagination):
+    """
+    search results are ordered by score, not by a column, so they are
+    paginated with ?limit= and ?offset= over the ranked list
+    """
+    default_limit = 20
+    max_limit = 100
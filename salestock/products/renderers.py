@@ -0,0 +1,136 @@
+"""
+fastjson renderer and parser, same JSON as JSONRenderer and JSONParser.
+
+the stock renderer emit unicode (UNICODE_JSON), python 2 json encode unicode
+strings in pure python then, fastjson escape non ascii characters so the
+whole document goes through the C encoder. Decimal is rendered as a string,
+like DecimalField does, datetimes like the rest framework encoder.
+
+list views using FastRowsListMixin skip model instances and serializers for
+unpaginated fastjson GET, rows straight from values_list() are rendered as
+objects by the renderer.
+select it with ?format=fastjson, or per view by putting it first in renderer_classes.
+"""
+from __future__ import unicode_literals
+
+import datetime
+import decimal
+import json
+from json.encoder import encode_basestring_ascii
+
+from django.conf import settings
+from django.utils import six
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+
+def format_datetime(value):
+    # same as the rest framework encoder, ex: 2016-07-13T06:44:00.123Z,
+    # every datetime leaving the api (export, headers) goes through it
+    representation = value.isoformat()
+    if value.microsecond:
+        representation = representation[:23] + representation[26:]
+    if representation.endswith('+00:00'):
+        representation = representation[:-6] + 'Z'
+    return representation
+
+
+class FastJSONEncoder(JSONEncoder):
+
+    def default(self, obj):
+        if isinstance(obj, decimal.Decimal):
+            return six.text_type(obj)
+        return super(FastJSONEncoder, self).default(obj)
+
+
+class Rows(list):
+    """
+    list of value tuples, rendered by FastJSONRenderer as one object per row with
+    the given keys. only for responses that are sure to be rendered as fastjson
+    """
+
+    def __init__(self, keys, rows):
+        super(Rows, self).__init__(rows)
+        self.keys = keys
+
+
+class FastJSONRenderer(JSONRenderer):
+    media_type = 'application/json'
+    format = 'fastjson'
+    ensure_ascii = True
+    encoder = FastJSONEncoder(ensure_ascii=True, check_circular=False, separators=(',', ':'))
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return bytes()
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super(FastJSONRenderer, self).render(data, accepted_media_type, renderer_context)
+        if isinstance(data, Rows):
+            return self.render_rows(data).encode('ascii')
+        return self.encoder.encode(data).encode('ascii')
+
+    def encode_value(self, value):
+        # exact types first, bool is an int subclass
+        kind = type(value)
+        if kind is six.text_type or kind is str:
+            return encode_basestring_ascii(value)
+        if value is None:
+            return 'null'
+        if kind is bool:
+            return 'true' if value else 'false'
+        if kind in six.integer_types:
+            return '%d' % value
+        if kind is decimal.Decimal:
+            return '"%s"' % value
+        if kind is datetime.datetime:
+            return encode_basestring_ascii(format_datetime(value))
+        return self.encoder.encode(value)
+
+    def render_rows(self, rows):
+        template = '{%s}' % ','.join(
+            '%s:%%s' % encode_basestring_ascii(key).replace('%', '%%') for key in rows.keys
+        )
+        encode = self.encode_value
+        return '[%s]' % ','.join(template % tuple([encode(value) for value in row]) for row in rows)
+
+
+class FastJSONParser(BaseParser):
+    """
+    JSONParser keeping numbers with a fraction as Decimal, so prices are exact
+    """
+    media_type = 'application/json'
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        try:
+            return json.loads(stream.read().decode(encoding), parse_float=decimal.Decimal)
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % six.text_type(exc))
+
+
+class FastRowsListMixin(object):
+    """
+    unpaginated fastjson list rendered from get_rows(queryset), a Rows or None
+    to take the usual path. must come after ConditionalGetMixin and ResponseCacheMixin
+    """
+
+    def get_rows(self, queryset):
+        return None
+
+    def list(self, request, *args, **kwargs):
+        if not isinstance(getattr(request, 'accepted_renderer', None), FastJSONRenderer):
+            return super(FastRowsListMixin, self).list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        rows = self.get_rows(queryset)
+        if rows is None:
+            return Response(self.get_serializer(queryset, many=True).data)
+        return Response(rows)
@@ -0,0 +1,108 @@
+"""
+read replica routing: GET and HEAD on views with use_read_replica = True read
+from one of DATABASE_REPLICAS, everything else goes to the primary.
+
+reads stay on the primary DATABASE_REPLICA_LAG seconds after a write: for the
+client who wrote through a cookie (read your writes), and for every client
+through a timestamp in the generations cache, so the response cache, snapshots
+and lookup cache are never filled from a replica that hasn't seen the write.
+the timestamp must be seen by every process, products.checks refuse a per
+process cache when replicas are set.
+the timestamp is global, not per client: with a write every DATABASE_REPLICA_LAG
+seconds or more often, every read stays on the primary.
+"""
+from __future__ import unicode_literals
+
+import contextlib
+import math
+import random
+import threading
+import time
+
+from django.conf import settings
+from rest_framework.permissions import SAFE_METHODS
+from .cache import get_generations_cache
+
+
+STICKY_COOKIE = 'salestock_primary'
+LAST_WRITE_KEY = 'replica:last-write'
+
+_local = threading.local()
+
+
+def get_replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def get_lag():
+    return getattr(settings, 'DATABASE_REPLICA_LAG', 2)
+
+
+def get_replica():
+    """
+    alias reads of the current thread go to, None for the primary
+    """
+    return getattr(_local, 'replica', None)
+
+
+@contextlib.contextmanager
+def use_replica(alias):
+    previous, _local.replica = get_replica(), alias
+    try:
+        yield
+    finally:
+        _local.replica = previous
+
+
+class ReplicaRouter(object):
+
+    def db_for_read(self, model, **hints):
+        return get_replica()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in get_replicas():
+            return False
+        return None
+
+
+class ReplicaMiddleware(object):
+
+    def process_request(self, request):
+        _local.replica = None
+        return None
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'cls', None)
+        if request.method in ('GET', 'HEAD') and getattr(view_class, 'use_read_replica', False):
+            _local.replica = self.choose_replica(request)
+        return None
+
+    def choose_replica(self, request):
+        replicas = get_replicas()
+        if not replicas:
+            return None
+        now = time.time()
+        try:
+            if float(request.COOKIES.get(STICKY_COOKIE, 0)) > now:
+                return None
+        except ValueError:
+            pass
+        last_write = get_generations_cache().get(LAST_WRITE_KEY)
+        if last_write is not None and last_write + get_lag() > now:
+            return None
+        return random.choice(replicas)
+
+    def process_response(self, request, response):
+        _local.replica = None
+        if request.method not in SAFE_METHODS and get_replicas():
+            now, lag = time.time(), get_lag()
+            response.set_cookie(STICKY_COOKIE, '%.3f' % (now + lag), max_age=int(math.ceil(lag)), httponly=True)
+            get_generations_cache().set(LAST_WRITE_KEY, now, lag)
+        return response
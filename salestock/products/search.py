@@ -0,0 +1,75 @@
+"""
+full text search over the SearchPosting inverted index, ranked with BM25.
+only postings of the query terms are read, joined with the products matched
+by the list filters and scored in a single grouped query, so the cost follow
+how common the terms are, not the catalog size.
+"""
+from __future__ import division, unicode_literals
+
+import math
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, Count, ExpressionWrapper, F, FloatField, Sum, Value, When
+from .models import Product, SearchDocument, SearchPosting, search_terms
+
+
+K1 = 1.2
+B = 0.75
+STATS_KEY = 'search:stats'
+
+
+def get_stats():
+    """
+    (number of documents, average document length), cached because it's an
+    aggregate over the whole index. every reindex clear it
+    """
+    stats = cache.get(STATS_KEY)
+    if stats is None:
+        row = SearchDocument.objects.aggregate(count=Count('pk'), length=Sum('length'))
+        count = row['count'] or 0
+        stats = (count, (row['length'] or 0) / count if count else 0)
+        cache.set(STATS_KEY, stats, getattr(settings, 'PRODUCT_SEARCH_STATS_TIMEOUT', 60))
+    return stats
+
+
+def clear_stats():
+    cache.delete(STATS_KEY)
+
+
+def rank(query, queryset=None):
+    """
+    return a values queryset of {'id', 'score'} of products best first,
+    products without any of the query terms are left out. queryset (active
+    products by default) restrict the candidates, its filters are joined with
+    the postings in the same query, and scores are summed by the database
+    so only the requested slice reach python
+    """
+    if queryset is None:
+        queryset = Product.objects.all()
+    terms = set(search_terms(query))
+    count, average_length = get_stats()
+    if not terms or not count:
+        return queryset.none().values('id')
+
+    # document frequency over the whole index, not only the filtered products
+    frequencies = SearchPosting.objects.filter(term__in=terms).order_by().values_list('term').annotate(Count('id'))
+    idf = Case(*[
+        When(posting_term=term, then=Value(math.log(1 + (count - frequency + 0.5) / (frequency + 0.5))))
+        for term, frequency in frequencies
+    ], default=Value(0.0), output_field=FloatField())
+    # frequency * (k1 + 1) / (frequency + k1 * (1 - b + b * length / average length))
+    frequency, length = F('search_postings__frequency'), F('search_postings__length')
+    saturation = ExpressionWrapper(
+        Value(K1 + 1) * frequency / (frequency + Value(K1 * (1 - B)) + Value(K1 * B / average_length) * length),
+        output_field=FloatField()
+    )
+    # filter before annotate, so the sum only covers the postings of the query terms.
+    # conditions on search_postings__term inside Case would turn the postings join
+    # into a LEFT JOIN, which keep the database from starting with the postings
+    # index, they compare the annotated term of the joined posting instead
+    return queryset.filter(search_postings__term__in=terms).annotate(
+        posting_term=F('search_postings__term')
+    ).order_by().values('id').annotate(
+        score=Sum(ExpressionWrapper(idf * saturation, output_field=FloatField()))
+    ).order_by('-score', 'id')
@@ -1,19 +1,53 @@
-from .models import Category, Product
+import re
+from collections import OrderedDict
+from decimal import Decimal
+from .histogram import get_ranges
+from .metrics import TimedListSerializer, TimedSerializerMixin
+from .models import Category, Product, validate_product_slug
 from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
 from django.template.defaultfilters import slugify
 
 
+class SlugIdentityField(serializers.HyperlinkedIdentityField):
+    """
+    HyperlinkedIdentityField that call reverse() once per request and format,
+    then build every link by joining the url prefix, the slug and the suffix.
+    slug that need url quoting still goes through reverse()
+    """
+    placeholder = '__slug__'
+    safe_slug = re.compile(r'^[-a-zA-Z0-9_]+$')
+
+    def get_url(self, obj, view_name, request, format):
+        if hasattr(obj, 'pk') and obj.pk in (None, ''):
+            return None
+        slug = getattr(obj, self.lookup_field)
+        if not slug or not self.safe_slug.match(slug):
+            return super(SlugIdentityField, self).get_url(obj, view_name, request, format)
+
+        template = getattr(self, '_url_template', None)
+        if template is None or template[0] is not request or template[1] != format:
+            url = self.reverse(
+                view_name, kwargs={self.lookup_url_kwarg: self.placeholder},
+                request=request, format=format
+            )
+            prefix, suffix = url.split(self.placeholder, 1)
+            template = self._url_template = (request, format, prefix, suffix)
+        return template[2] + slug + template[3]
+
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Return serializers of category models
     """
-    products = serializers.HyperlinkedIdentityField(view_name='product-category-list', lookup_field='slug')
+    products = SlugIdentityField(view_name='product-category-list', lookup_field='slug')
 
 
     class Meta:
         model = Category
-        fields = ('title', 'slug', 'products', 'description', 'active')
+        fields = ('title', 'slug', 'products', 'description', 'active',
+                  'active_product_count', 'min_price', 'max_price')
+        list_serializer_class = TimedListSerializer
 
 
     def create(self, validated_data):
@@ -25,13 +59,133 @@ class CategorySerializer(serializers.ModelSerializer):
         return Category.objects.create(**validated_data)
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class CategoryDetailSerializer(CategorySerializer):
+    """
+    category with its price histogram, see products.histogram
+    """
+    price_histogram = serializers.SerializerMethodField()
+
+    class Meta(CategorySerializer.Meta):
+        fields = CategorySerializer.Meta.fields + ('price_histogram',)
+
+    def get_price_histogram(self, obj):
+        # price_buckets is prefetched, cached category rows keep them
+        return get_ranges({bucket.lower: bucket.count for bucket in obj.price_buckets.all()})
+
+
+class ProductSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     return serializers for Product models
     """
-    detail_url = serializers.HyperlinkedIdentityField(view_name='product-detail', lookup_field='slug')
+    detail_url = SlugIdentityField(view_name='product-detail', lookup_field='slug')
 
     class Meta:
         model = Product
         fields = ('title', 'slug', 'category', 'size', 'color', 'price', 'active', 'detail_url')
         extra_kwargs = {'url': {'lookup_field': 'slug'}}
+        list_serializer_class = TimedListSerializer
+
+
+class FlatProductSerializer(TimedSerializerMixin, serializers.BaseSerializer):
+    """
+    read only serializer for product list actions, same output as ProductSerializer
+    but every row is built straight from model attributes instead of walking
+    the serializer fields for each instance
+    """
+    class Meta:
+        list_serializer_class = TimedListSerializer
+
+    def __init__(self, *args, **kwargs):
+        super(FlatProductSerializer, self).__init__(*args, **kwargs)
+        fields = ProductSerializer().fields
+        self.price_field = fields['price']
+        self.detail_url_field = SlugIdentityField(view_name='product-detail', lookup_field='slug')
+        self.detail_url_field.bind('detail_url', self)
+
+    def format_price(self, price):
+        # price has decimal_places=0, integral Decimal from database doesn't need quantize
+        if isinstance(price, Decimal) and price.as_tuple()[2] == 0:
+            return '%d' % price
+        return self.price_field.to_representation(price)
+
+    def to_base_representation(self, instance):
+        """
+        every field but detail_url, the only one depending on the request
+        """
+        price = instance.price
+        return OrderedDict((
+            ('title', instance.title),
+            ('slug', instance.slug),
+            ('category', instance.category_id),
+            ('size', instance.size),
+            ('color', instance.color),
+            ('price', None if price is None else self.format_price(price)),
+            ('active', instance.active),
+        ))
+
+    def to_representation(self, instance):
+        data = self.to_base_representation(instance)
+        data['detail_url'] = self.detail_url_field.to_representation(instance)
+        return data
+
+
+class BulkCategoryField(serializers.PrimaryKeyRelatedField):
+    """
+    resolve category from `categories` preloaded in serializer context
+    (pk -> Category, or pk -> pk when only the id is needed),
+    so validating a batch doesn't run one query per row
+    """
+    def to_internal_value(self, data):
+        categories = self.context.get('categories')
+        if categories is None:
+            return super(BulkCategoryField, self).to_internal_value(data)
+        try:
+            return categories[int(data)]
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+
+class BulkListSerializer(serializers.ListSerializer):
+    """
+    validate every row on its own, invalid rows are kept in row_errors
+    instead of failing the whole list.
+    validated_data is list of (row index, data) of valid rows
+    """
+    def to_internal_value(self, data):
+        if not isinstance(data, list):
+            raise ValidationError({'non_field_errors': ['Expected a list of items.']})
+        valid, self.row_errors = [], []
+        for index, item in enumerate(data):
+            try:
+                if isinstance(item, ValidationError):
+                    raise item
+                valid.append((index, self.child.run_validation(item)))
+            except ValidationError as exc:
+                self.row_errors.append((index, exc.detail))
+        return valid
+
+
+class ProductBulkSerializer(ProductSerializer):
+    """
+    ProductSerializer for bulk create/upsert, slug is declared without
+    unique validator because it's checked in one query per batch
+    """
+    slug = serializers.SlugField(
+        max_length=50, required=False, allow_null=True, allow_blank=True, validators=[validate_product_slug]
+    )
+    category = BulkCategoryField(queryset=Category.objects.all())
+
+    class Meta(ProductSerializer.Meta):
+        list_serializer_class = BulkListSerializer
+
+
+class CategoryBulkSerializer(CategorySerializer):
+    """
+    CategorySerializer for catalog import, slug uniqueness is checked per batch
+    """
+    slug = serializers.SlugField(max_length=50, required=False, allow_null=True, allow_blank=True)
+
+    class Meta(CategorySerializer.Meta):
+        list_serializer_class = BulkListSerializer
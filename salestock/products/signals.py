@@ -0,0 +1,133 @@
+"""
+side effects of product and category writes, connected in ProductsConfig.ready()
+so they run for the REST API, django admin and plain ORM usage alike.
+bulk paths that skip save() must call the same helpers themselves.
+"""
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from jobs.models import Job
+from . import cache, histogram, snapshots, tasks
+from .lookups import lookup_cache
+from .models import Category, CategoryPriceBucket, Product, ProductTombstone
+
+
+def _category_slugs(category_ids):
+    category_ids = {pk for pk in category_ids if pk is not None}
+    if not category_ids:
+        return []
+    return list(Category.objects.filter(pk__in=category_ids).values_list('slug', flat=True))
+
+
+def _stats_contribution(instance, loaded):
+    """
+    (category_id, price) an instance add to category stats, None when inactive
+    """
+    get = instance.get_loaded_value if loaded else lambda attname: getattr(instance, attname)
+    if not get('active'):
+        return None
+    return get('category_id'), get('price')
+
+
+@receiver(post_save, sender=Product, dispatch_uid='products.product_saved')
+@receiver(post_delete, sender=Product, dispatch_uid='products.product_deleted')
+def product_changed(sender, instance, **kwargs):
+    category_ids = [instance.category_id, instance.get_loaded_value('category_id')]
+    cache.invalidate_products(_category_slugs(category_ids))
+
+
+@receiver(post_save, sender=Product, dispatch_uid='products.product_snapshot_saved')
+@receiver(post_delete, sender=Product, dispatch_uid='products.product_snapshot_deleted')
+def product_snapshot_changed(sender, instance, **kwargs):
+    if not snapshots.is_enabled():
+        return
+    old_category_id = instance.get_loaded_value('category_id')
+    slugs = dict(Category.objects.filter(
+        pk__in={instance.category_id, old_category_id} - {None}
+    ).values_list('pk', 'slug'))
+    if old_category_id in slugs and old_category_id != instance.category_id:
+        snapshots.patch_on_commit(slugs[old_category_id], removed=[instance.pk])
+    if instance.category_id in slugs:
+        if kwargs.get('signal') is post_delete:
+            snapshots.patch_on_commit(slugs[instance.category_id], removed=[instance.pk])
+        else:
+            snapshots.patch_on_commit(slugs[instance.category_id], products=[instance])
+
+
+@receiver(post_save, sender=Product, dispatch_uid='products.product_stats_saved')
+def product_stats_saved(sender, instance, created, **kwargs):
+    old = None if created else _stats_contribution(instance, loaded=True)
+    new = _stats_contribution(instance, loaded=False)
+    if old == new:
+        return
+    stale = old is not None and Category.objects.remove_product_stats(*old)
+    if new is not None:
+        Category.objects.add_product_stats(*new)
+    CategoryPriceBucket.objects.add(histogram.deltas(removed=[old], added=[new]))
+    if stale:
+        # recompute inline, a queued refresh would leave the bounds wrong for
+        # as long as no worker run
+        Category.objects.refresh_stats([old[0]])
+
+
+@receiver(post_delete, sender=Product, dispatch_uid='products.product_stats_deleted')
+def product_stats_deleted(sender, instance, **kwargs):
+    loaded = hasattr(instance, '_loaded_values')
+    old = _stats_contribution(instance, loaded=loaded)
+    if old is None:
+        return
+    CategoryPriceBucket.objects.add(histogram.deltas(removed=[old]))
+    if Category.objects.remove_product_stats(*old):
+        Category.objects.refresh_stats([old[0]])
+
+
+@receiver(post_save, sender=Product, dispatch_uid='products.product_tombstone_saved')
+def product_deactivated(sender, instance, created, **kwargs):
+    if not created and instance.get_loaded_value('active') and not instance.active:
+        ProductTombstone.objects.record([instance], ProductTombstone.DEACTIVATED)
+
+
+@receiver(post_delete, sender=Product, dispatch_uid='products.product_tombstone_deleted')
+def product_deleted(sender, instance, **kwargs):
+    # inactive product already left the catalog when it was deactivated
+    if instance.get_loaded_value('active', instance.active):
+        ProductTombstone.objects.record([instance], ProductTombstone.DELETED)
+
+
+@receiver(post_save, sender=Category, dispatch_uid='products.category_saved')
+@receiver(post_delete, sender=Category, dispatch_uid='products.category_deleted')
+def category_changed(sender, instance, **kwargs):
+    cache.invalidate_categories([instance.slug, instance.get_loaded_value('slug')])
+    if instance.get_loaded_value('slug') != instance.slug or kwargs.get('signal') is post_delete:
+        snapshots.invalidate_on_commit([instance.slug, instance.get_loaded_value('slug')])
+
+
+@receiver(post_save, sender=Product, dispatch_uid='products.product_lookup_saved')
+@receiver(post_delete, sender=Product, dispatch_uid='products.product_lookup_deleted')
+def product_lookup_changed(sender, instance, **kwargs):
+    lookup_cache.invalidate(instance, [instance.slug, instance.get_loaded_value('slug')])
+    # cached category rows carry product stats and price histogram
+    lookup_cache.invalidate_rows(
+        Category._meta.label_lower, {instance.category_id, instance.get_loaded_value('category_id')} - {None}
+    )
+
+
+@receiver(post_save, sender=Category, dispatch_uid='products.category_lookup_saved')
+@receiver(post_delete, sender=Category, dispatch_uid='products.category_lookup_deleted')
+def category_lookup_changed(sender, instance, **kwargs):
+    lookup_cache.invalidate(instance, [instance.slug, instance.get_loaded_value('slug')])
+    # cached product rows hold their category
+    lookup_cache.clear_rows(Product._meta.label_lower)
+
+
+@receiver(post_save, sender=Category, dispatch_uid='products.category_search_saved')
+def category_search_changed(sender, instance, created, **kwargs):
+    """
+    category text is part of every product document of the category
+    """
+    if created or not getattr(settings, 'PRODUCT_SEARCH_INDEX', True):
+        return
+    if instance.has_changed('title') or instance.has_changed('description'):
+        Job.objects.enqueue(tasks.index_categories, [instance.pk], key=instance.pk)
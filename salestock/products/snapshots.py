@@ -0,0 +1,198 @@
+"""
+materialized product listing per category, the serialized active products of
+the category ordered by id, stored in the response cache.
+
+ProductCategoryList serve unpaginated GET from the snapshot and apply
+ProductFilter in memory, writes patch the snapshot of the affected categories
+instead of dropping it. every snapshot carry the version it was built or
+patched for, a snapshot older than the category version is rebuilt, so a
+snapshot built from rows read before a concurrent write is never served.
+signals patch and invalidate once the write commit, the version must live in a
+cache every process share (see products.checks), next to the generations.
+"""
+from __future__ import unicode_literals
+
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.response import Response
+from .cache import bump, get_cache, get_generations, get_generations_cache, has_atomic_add
+from .models import Category, Product, ProductQuerySet
+from .serializers import FlatProductSerializer
+
+
+# pk and slug let SlugIdentityField build detail_url from the row itself
+SnapshotRow = namedtuple('SnapshotRow', 'pk slug size color_normalized price updated data')
+
+# request parameters the snapshot can answer, anything else goes to the database
+SERVABLE_PARAMS = {'format', 'ordering', 'color', 'size', 'min_price', 'max_price'}
+
+
+def is_enabled():
+    return getattr(settings, 'PRODUCT_CATEGORY_SNAPSHOTS', True)
+
+
+def get_timeout():
+    # safety net for writes that skip signals (raw sql), patched snapshot don't need to expire
+    return getattr(settings, 'PRODUCT_CATEGORY_SNAPSHOT_TIMEOUT', 3600)
+
+
+def snapshot_key(slug):
+    return 'snapshot:%s' % slug
+
+
+def lock_key(slug):
+    return 'snapshot-lock:%s' % slug
+
+
+def get_version(slug):
+    return get_generations([snapshot_key(slug)])[0]
+
+
+def bump_version(slug):
+    return bump(snapshot_key(slug))
+
+
+def make_row(product, serializer=None):
+    serializer = serializer or FlatProductSerializer()
+    return SnapshotRow(
+        product.pk, product.slug, product.size, product.color_normalized,
+        product.price, product.updated, serializer.to_base_representation(product),
+    )
+
+
+def build(slug):
+    """
+    read the active products of the category in one query and store the snapshot,
+    return None when the category doesn't exist
+    """
+    version = get_version(slug)
+    category = Category.objects.filter(slug=slug).only('id', 'updated').first()
+    if category is None:
+        return None
+    products = Product.objects.all().filter(category_id=category.pk).only(
+        *ProductQuerySet.LISTING_FIELDS + ('updated', 'color_normalized')
+    ).order_by('pk')
+    serializer = FlatProductSerializer()
+    rows = [make_row(product, serializer) for product in products]
+    snapshot = {
+        'version': version,
+        'rows': rows,
+        'updated': max([category.updated] + [row.updated for row in rows]),
+    }
+    get_cache().set(snapshot_key(slug), snapshot, get_timeout())
+    return snapshot
+
+
+def get_snapshot(slug):
+    cache = get_cache()
+    snapshot = cache.get(snapshot_key(slug))
+    if snapshot is not None and snapshot['version'] == get_version(slug):
+        return snapshot
+    return build(slug)
+
+
+def patch(slug, removed=(), products=()):
+    """
+    drop removed product ids from the snapshot and insert or replace products,
+    inactive ones are only dropped. when another process is patching the same
+    snapshot, bump the version instead so the next read rebuild it. the lock
+    need an atomic add, without one two processes could both patch and the
+    last would store a snapshot missing the other write, so always rebuild
+    """
+    cache, locks = get_cache(), get_generations_cache()
+    if not has_atomic_add() or not locks.add(lock_key(slug), 1, 10):
+        bump_version(slug)
+        return
+    try:
+        snapshot = cache.get(snapshot_key(slug))
+        current = get_version(slug)
+        version = bump_version(slug)
+        if snapshot is None or snapshot['version'] != current:
+            return
+        removed = set(removed) | {product.pk for product in products}
+        rows = [row for row in snapshot['rows'] if row.pk not in removed]
+        rows += [make_row(product) for product in products if product.active]
+        rows.sort(key=lambda row: row.pk)
+        cache.set(snapshot_key(slug), {
+            'version': version,
+            'rows': rows,
+            'updated': timezone.now(),
+        }, get_timeout())
+    finally:
+        locks.delete(lock_key(slug))
+
+
+def patch_on_commit(slug, removed=(), products=()):
+    """
+    patch once the current transaction commit (right away outside one), nothing
+    when it roll back. patching before would serve uncommitted rows to every process
+    """
+    transaction.on_commit(lambda: patch(slug, removed, products))
+
+
+def invalidate(slugs):
+    for slug in set(slugs):
+        if slug:
+            bump_version(slug)
+
+
+def invalidate_on_commit(slugs):
+    slugs = list(slugs)
+    transaction.on_commit(lambda: invalidate(slugs))
+
+
+def filter_rows(rows, cleaned_data):
+    """
+    same result as ProductFilter over the database, cleaned_data is its valid form data
+    """
+    min_price, max_price = cleaned_data.get('min_price'), cleaned_data.get('max_price')
+    size, color = cleaned_data.get('size'), cleaned_data.get('color')
+    if min_price is not None:
+        rows = [row for row in rows if row.price >= min_price]
+    if max_price is not None:
+        rows = [row for row in rows if row.price <= max_price]
+    if size:
+        rows = [row for row in rows if row.size == size]
+    if color:
+        needle = Product.normalize_color(color)
+        rows = [row for row in rows if needle in row.color_normalized]
+    return rows
+
+
+class SnapshotListMixin(object):
+    """
+    answer list from the category snapshot when the request only use
+    ProductFilter parameters and no pagination, must come after
+    ConditionalGetMixin and ResponseCacheMixin
+    """
+
+    def get_snapshot_rows(self):
+        """
+        (snapshot, filtered rows), (None, None) when the request need the database
+        """
+        if not hasattr(self, '_snapshot_rows'):
+            self._snapshot_rows = None, None
+            request = self.request
+            if is_enabled() and request.method in ('GET', 'HEAD') and set(request.query_params) <= SERVABLE_PARAMS:
+                snapshot = get_snapshot(self.kwargs['slug'])
+                if snapshot is not None:
+                    form = self.filter_class(request.query_params).form
+                    rows = filter_rows(snapshot['rows'], form.cleaned_data) if form.is_valid() else []
+                    self._snapshot_rows = snapshot, rows
+        return self._snapshot_rows
+
+    def list(self, request, *args, **kwargs):
+        snapshot, rows = self.get_snapshot_rows()
+        if snapshot is None:
+            return super(SnapshotListMixin, self).list(request, *args, **kwargs)
+        detail_url = FlatProductSerializer(context=self.get_serializer_context()).detail_url_field
+        data = []
+        for row in rows:
+            item = OrderedDict(row.data)
+            item['detail_url'] = detail_url.to_representation(row)
+            data.append(item)
+        return Response(data)
+
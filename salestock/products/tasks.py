@@ -0,0 +1,47 @@
+"""
+write side effects run by run_workers instead of inside the request, see the
+jobs app. payloads are lists of primary keys, each task merge the payloads of
+its batch so ten writes to one category cost one rebuild.
+"""
+from __future__ import unicode_literals
+
+import itertools
+
+from jobs.tasks import task
+from . import bulk, cache
+from .lookups import lookup_cache
+from .models import Category, Product, SearchPosting
+
+
+def merge(payloads):
+    return sorted(set(itertools.chain.from_iterable(payloads)))
+
+
+@task(batch=True)
+def index_products(payloads, batch_size=500):
+    """
+    rebuild search postings of the products
+    """
+    pks = merge(payloads)
+    queryset = Product.objects.get_queryset().only('id', 'title', 'category')
+    for start in range(0, len(pks), batch_size):
+        SearchPosting.objects.index_products(queryset.filter(pk__in=pks[start:start + batch_size]))
+
+
+@task(batch=True)
+def index_categories(payloads):
+    """
+    rebuild search postings of every product of the categories
+    """
+    bulk.index_category_products(merge(payloads))
+
+
+@task(batch=True)
+def refresh_category_stats(payloads):
+    """
+    recompute min and max price of the categories, after a product holding one of them left
+    """
+    Category.objects.refresh_stats(merge(payloads))
+    # category listing and cached category rows carry the stats
+    cache.invalidate_on_commit(cache.SCOPE_CATEGORIES)
+    lookup_cache.clear_rows(Category._meta.label_lower)
@@ -1,13 +1,73 @@
-from django.core.urlresolvers import reverse
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.core.urlresolvers import resolve, reverse
+from django.http import HttpResponse
 from django.test import TestCase, RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APIRequestFactory, APITestCase, APIClient, force_authenticate
-from .models import Category, Product
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework import serializers
+from .models import Category, CategoryPriceBucket, Product, ProductColorNgram, SearchPosting
+from .pagination import KeysetPagination
+from .renderers import FastJSONParser, FastJSONRenderer, Rows, format_datetime
+from .serializers import FlatProductSerializer, ProductSerializer, CategorySerializer
 
-from .views import CategoryViewSet, ProductViewSet
+from .views import CategoryViewSet, ProductViewSet, ProductFilter, ProductCategoryList
+from . import (
+    bulk, cache, catalog, changes, checks, columnar, export, histogram, lookups, metrics, routers, search, snapshots,
+    tasks
+)
+from jobs.models import Job
+from jobs.tasks import task_name
+from jobs.worker import Worker
 # Create your tests here.
 from django.contrib.auth.models import AnonymousUser, User
+import datetime
 import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from django.utils.six import BytesIO, StringIO
+from decimal import Decimal
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from unittest import skipIf
+
+try:
+    from salestock import evented
+except ImportError:
+    # gevent isn't installed
+    evented = None
+
+
+def create_product(title, category, price, **kwargs):
+    """
+    product with the size and color most tests don't care about, kwargs override any field
+    """
+    kwargs.setdefault('size', "M")
+    kwargs.setdefault('color', "Black")
+    return Product.objects.create(title=title, category=category, price=price, **kwargs)
+
+
+def clear_response_caches():
+    caches['responses'].clear()
+    caches['generations'].clear()
+
+
+def run_commit_hooks():
+    """
+    TestCase never commit, run what transaction.on_commit() queued as if the test transaction did
+    """
+    callbacks, connection.run_on_commit = connection.run_on_commit, []
+    for savepoints, callback in callbacks:
+        callback()
 
 
 class CategoriesPageTest(TestCase):
@@ -160,6 +220,32 @@ class ProductsPageTest(TestCase):
         self.assertEqual(result.title, "test product")
         self.assertEqual(result.category, category)
 
+    def test_products_named_after_collection_urls_stay_reachable(self):
+        category = Category.objects.create(title="test category", slug="test-category")
+        user = User.objects.create_user(username="nasa", email="mail@mail.com", password="topsecret")
+        client = APIClient()
+        client.force_authenticate(user=user)
+        for route in ['bulk', 'changes', 'export', 'facets', 'search']:
+            product = create_product(route, category, 1000)
+            self.assertEqual(product.slug, '%s-1' % route)
+            url = reverse('product-detail', kwargs={'slug': product.slug})
+            response = client.get(url, {'format': 'json'})
+            self.assertEqual((response.status_code, response.data['title']), (status.HTTP_200_OK, route))
+            response = client.patch(url, {'color': 'Red'}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK, route)
+            self.assertEqual(client.delete(url).status_code, status.HTTP_204_NO_CONTENT, route)
+
+            data = {'title': route, 'slug': route, 'size': 'M', 'color': 'Black', 'category': category.pk,
+                    'price': 1000}
+            response = client.post(reverse('product-list'), data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, route)
+            self.assertIn('slug', response.data)
+            response = client.post(reverse('product-bulk'), [data, dict(data, slug='')], format='json')
+            self.assertEqual(response.data['errors'][0]['row'], 0)
+            self.assertEqual(response.data['created'], 1)
+            self.assertTrue(Product.objects.filter(slug='%s-1' % route).exists())
+            Product.objects.filter(slug='%s-1' % route).delete()
+
     def test_product_object_manager_filter_by_category(self):
         category = Category.objects.create(
             title="test category",
@@ -437,3 +523,1693 @@ class ProductsPageTest(TestCase):
 
 
 
+
+
+class ProductPaginationTest(TestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.category = Category.objects.create(
+            title="test category",
+            slug="test-category",
+            description="description of category"
+        )
+        for i in range(5):
+            Product.objects.create(
+                title="test product %d" % i,
+                size="M",
+                color="Black",
+                category=self.category,
+                price=100000 + (i % 3) * 1000
+            )
+
+    def get_page(self, url, **params):
+        request = self.factory.get(url, params)
+        view = ProductViewSet.as_view({'get': 'list'})
+        response = view(request)
+        response.render()
+        return response, json.loads(response.content)
+
+    def test_list_without_page_params_is_not_paginated(self):
+        response, json_data = self.get_page(reverse("product-list"))
+        self.assertEqual(len(json_data), 5)
+
+    def test_keyset_pages_walk_forward_and_back_by_created(self):
+        response, first = self.get_page(reverse("product-list"), page_size=2)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [p['title'] for p in first['results']],
+            ["test product 0", "test product 1"]
+        )
+        self.assertIsNone(first['previous'])
+
+        response, second = self.get_page(first['next'])
+        self.assertEqual(
+            [p['title'] for p in second['results']],
+            ["test product 2", "test product 3"]
+        )
+
+        response, back = self.get_page(second['previous'])
+        self.assertEqual(back['results'], first['results'])
+
+        response, last = self.get_page(second['next'])
+        self.assertEqual([p['title'] for p in last['results']], ["test product 4"])
+        self.assertIsNone(last['next'])
+
+    def test_keyset_pages_by_price_break_ties_by_id(self):
+        url = reverse("product-list")
+        titles = []
+        response, page = self.get_page(url, page_size=2, ordering='-price')
+        while True:
+            titles += [p['title'] for p in page['results']]
+            if not page['next']:
+                break
+            response, page = self.get_page(page['next'])
+        self.assertEqual(titles, [
+            "test product 2",
+            "test product 4", "test product 1",
+            "test product 3", "test product 0",
+        ])
+
+    def test_page_size_is_bounded(self):
+        response, json_data = self.get_page(reverse("product-list"), page_size=100000)
+        self.assertEqual(len(json_data['results']), 5)
+        request = Request(self.factory.get(reverse("product-list"), {'page_size': 100000}))
+        self.assertEqual(KeysetPagination().get_page_size(request), KeysetPagination.max_page_size)
+
+    def test_invalid_cursor_returns_not_found(self):
+        response, json_data = self.get_page(reverse("product-list"), cursor='garbage')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ProductQueryPlanTest(TestCase):
+
+    def test_every_product_filter_combination_use_an_index(self):
+        out = StringIO()
+        call_command('check_query_plans', stdout=out)
+        self.assertIn("all product filter combinations use an index", out.getvalue())
+        self.assertNotIn("FAIL", out.getvalue())
+
+
+class ProductColorIndexTest(TestCase):
+
+    def setUp(self):
+        self.category = Category.objects.create(
+            title="test category",
+            slug="test-category",
+            description="description of category"
+        )
+        for i, color in enumerate(["Black", "Navy Blue", "black, White", "Red"]):
+            Product.objects.create(
+                title="test product %d" % i,
+                size="M",
+                color=color,
+                category=self.category,
+                price=199000
+            )
+
+    def filter_color(self, color):
+        qs = ProductFilter({'color': color}, queryset=Product.objects.all()).qs
+        return sorted(p.title for p in qs)
+
+    def icontains(self, color):
+        return sorted(p.title for p in Product.objects.all().filter(color__icontains=color))
+
+    def test_color_filter_match_icontains(self):
+        for color in ["black", "BLA", "ack", "lack, w", "bl", "e", "purple", ""]:
+            if color:
+                self.assertEqual(self.filter_color(color), self.icontains(color))
+        self.assertEqual(self.filter_color("LACK"), ["test product 0", "test product 2"])
+
+    def test_save_keep_normalized_color_and_ngrams_in_sync(self):
+        product = Product.objects.get(title="test product 3")
+        self.assertEqual(product.color_normalized, "red")
+        product.color = "Dark Green"
+        product.save()
+        grams = set(ProductColorNgram.objects.filter(product=product).values_list('gram', flat=True))
+        self.assertIn("gre", grams)
+        self.assertNotIn("red", grams)
+        self.assertEqual(self.filter_color("green"), ["test product 3"])
+        self.assertEqual(self.filter_color("red"), [])
+
+
+class ResponseCacheTest(TestCase):
+
+    def setUp(self):
+        clear_response_caches()
+        self.factory = APIRequestFactory()
+        self.shirts = Category.objects.create(title="shirts", slug="shirts")
+        self.shoes = Category.objects.create(title="shoes", slug="shoes")
+        self.product = Product.objects.create(
+            title="test product",
+            slug="test-product",
+            size="M",
+            color="Black",
+            category=self.shirts,
+            price=199000
+        )
+        run_commit_hooks()
+
+    def get(self, view, url, **kwargs):
+        response = view(self.factory.get(url), **kwargs)
+        # cache hits are returned as plain HttpResponse, already rendered
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+
+    def list_products(self, url=None):
+        return self.get(ProductViewSet.as_view({'get': 'list'}), url or reverse("product-list"))
+
+    def list_category(self, slug):
+        url = reverse("product-category-list", kwargs={'slug': slug})
+        return self.get(ProductCategoryList.as_view(), url, slug=slug)
+
+    def test_second_anonymous_read_is_served_from_cache(self):
+        first = self.list_products()
+        second = self.list_products()
+        self.assertEqual(first['X-Cache'], 'MISS')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(cache.get_stats(), {'hits': 1, 'misses': 1})
+
+    def test_hit_run_no_query(self):
+        self.list_products()
+        self.list_category("shirts")
+        with self.assertNumQueries(0):
+            self.assertEqual(self.list_products()['X-Cache'], 'HIT')
+            self.assertEqual(self.list_category("shirts")['X-Cache'], 'HIT')
+        # etag still follow category writes, product list Last-Modified include categories
+        etag = self.list_products()['ETag']
+        self.shoes.title = "boots"
+        self.shoes.save()
+        run_commit_hooks()
+        self.assertNotEqual(self.list_products()['ETag'], etag)
+
+    def test_format_is_part_of_cache_key(self):
+        self.list_products(reverse("product-list") + "?format=json")
+        response = self.list_products(reverse("product-list") + "?format=api")
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertIn("text/html", response['Content-Type'])
+
+    def test_product_write_invalidate_only_affected_category(self):
+        self.list_products()
+        self.list_category("shirts")
+        self.list_category("shoes")
+        self.product.title = "renamed product"
+        self.product.save()
+        run_commit_hooks()
+
+        response = self.list_products()
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertIn("renamed product", response.content)
+        self.assertEqual(self.list_category("shirts")['X-Cache'], 'MISS')
+        self.assertEqual(self.list_category("shoes")['X-Cache'], 'HIT')
+
+    def test_moving_product_invalidate_old_and_new_category(self):
+        self.list_category("shirts")
+        self.list_category("shoes")
+        product = Product.objects.get(slug="test-product")
+        product.category = self.shoes
+        product.save()
+        run_commit_hooks()
+        self.assertEqual(self.list_category("shirts")['X-Cache'], 'MISS')
+        self.assertEqual(self.list_category("shoes")['X-Cache'], 'MISS')
+
+    def test_delete_by_viewset_invalidate_listing(self):
+        user = User.objects.create_user(username="nasa", email="mail@mail.com", password="topsecret")
+        self.list_products()
+        request = self.factory.delete(reverse("product-detail", kwargs={'slug': "test-product"}))
+        force_authenticate(request, user=user)
+        ProductViewSet.as_view({'delete': 'destroy'})(request, slug="test-product")
+        run_commit_hooks()
+        response = self.list_products()
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(json.loads(response.content), [])
+
+    def test_invalidated_once_the_write_commit(self):
+        self.list_products()
+        self.product.title = "renamed product"
+        self.product.save()
+        # a reader before the commit still get the committed listing, and nothing
+        # it stores survive the commit
+        self.assertEqual(self.list_products()['X-Cache'], 'HIT')
+        run_commit_hooks()
+        self.assertEqual(self.list_products()['X-Cache'], 'MISS')
+
+    def test_generations_survive_culled_responses(self):
+        self.list_products()
+        generations = cache.get_generations([cache.SCOPE_PRODUCTS])
+        caches['responses'].clear()
+        self.assertEqual(cache.get_generations([cache.SCOPE_PRODUCTS]), generations)
+        self.assertEqual(cache.get_stats(), {'hits': 0, 'misses': 1})
+
+    def test_bump_never_write_a_generation_twice(self):
+        # two processes bumping without atomic incr still both change the generation
+        generation, = cache.get_generations([cache.SCOPE_PRODUCTS])
+        first, second = cache.bump(cache.SCOPE_PRODUCTS), cache.bump(cache.SCOPE_PRODUCTS)
+        self.assertEqual(len({generation, first, second}), 3)
+        self.assertEqual(cache.get_generations([cache.SCOPE_PRODUCTS]), [second])
+
+    def test_check_refuse_per_process_cache_without_debug(self):
+        locmem = dict(settings.CACHES, generations={'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'})
+        shared = dict(settings.CACHES, generations={
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': tempfile.gettempdir(),
+        })
+        with self.settings(CACHES=locmem, DEBUG=False):
+            self.assertEqual([error.id for error in checks.check_response_cache(None)], ['products.E001'])
+        with self.settings(CACHES=shared, DEBUG=False):
+            self.assertEqual(checks.check_response_cache(None), [])
+        with self.settings(CACHES=locmem, DEBUG=True):
+            self.assertEqual(checks.check_response_cache(None), [])
+        # responses keys carry the generations, they can stay per process
+        with self.settings(CACHES=dict(shared, responses=locmem['generations']), DEBUG=False):
+            self.assertEqual(checks.check_response_cache(None), [])
+
+    def test_authenticated_request_is_not_cached(self):
+        user = User.objects.create_user(username="nasa", email="mail@mail.com", password="topsecret")
+        view = ProductViewSet.as_view({'get': 'list'})
+        for i in range(2):
+            request = self.factory.get(reverse("product-list"))
+            force_authenticate(request, user=user)
+            response = view(request)
+            response.render()
+            self.assertFalse(response.has_header('X-Cache'))
+
+
+class ProductBulkTest(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username="nasa", email="mail@mail.com", password="topsecret")
+        self.client.force_authenticate(user=self.user)
+        self.category = Category.objects.create(title="test category", slug="test-category")
+
+    def row(self, title, **kwargs):
+        data = {
+            "title": title,
+            "size": "M",
+            "color": "Black",
+            "category": self.category.pk,
+            "price": 199000
+        }
+        data.update(kwargs)
+        return data
+
+    def test_bulk_create_without_login(self):
+        self.client.force_authenticate(user=None)
+        response = self.client.post(reverse("product-bulk"), [self.row("test product")], format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(Product.objects.count(), 0)
+
+    def test_bulk_create_fill_slug_creator_and_updated(self):
+        rows = [self.row("test product %d" % i) for i in range(3)]
+        response = self.client.post(reverse("product-bulk"), rows, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'created': 3, 'updated': 0, 'errors': []})
+        product = Product.objects.get(slug="test-product-1")
+        self.assertEqual(product.creator, self.user)
+        self.assertIsNotNone(product.updated)
+        self.assertEqual(product.color_normalized, "black")
+        self.assertEqual(
+            ProductFilter({'color': 'lac'}, queryset=Product.objects.all()).qs.count(), 3
+        )
+
+    def test_bulk_create_report_invalid_rows_and_write_the_rest(self):
+        Product.objects.create(title="existing", slug="existing", size="M", color="Red",
+                               category=self.category, price=1)
+        rows = [
+            self.row("good product"),
+            self.row("bad price", price="abc"),
+            self.row("unknown category", category=9999),
+            self.row("existing"),
+        ]
+        response = self.client.post(reverse("product-bulk"), rows, format='json')
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual([e['row'] for e in response.data['errors']], [1, 2, 3])
+        self.assertIn('price', response.data['errors'][0]['errors'])
+        self.assertIn('category', response.data['errors'][1]['errors'])
+        self.assertIn('slug', response.data['errors'][2]['errors'])
+        self.assertTrue(Product.objects.filter(slug="good-product").exists())
+
+    def test_bulk_upsert_update_by_slug(self):
+        Product.objects.create(title="existing", slug="existing", size="M", color="Red",
+                               category=self.category, price=1)
+        rows = [self.row("existing", color="Blue", price=5), self.row("new product")]
+        response = self.client.post(reverse("product-bulk") + "?upsert=1", rows, format='json')
+        self.assertEqual(response.data, {'created': 1, 'updated': 1, 'errors': []})
+        product = Product.objects.get(slug="existing")
+        self.assertEqual(product.color, "Blue")
+        self.assertEqual(product.price, 5)
+        self.assertEqual(product.last_modified_by, self.user)
+
+    def test_bulk_create_from_ndjson_stream(self):
+        body = "\n".join(json.dumps(self.row("product %d" % i)) for i in range(3))
+        body += "\n{not json\n"
+        response = self.client.post(
+            reverse("product-bulk"), body, content_type="application/x-ndjson"
+        )
+        self.assertEqual(response.data['created'], 3)
+        self.assertEqual(response.data['errors'][0]['row'], 3)
+        self.assertEqual(Product.objects.count(), 3)
+
+
+class ProductExportTest(TestCase):
+
+    def setUp(self):
+        self.category = Category.objects.create(title="test category", slug="test-category")
+        for i in range(5):
+            Product.objects.create(
+                title="test product %d" % i,
+                size="M" if i % 2 else "S",
+                color="Black",
+                category=self.category,
+                price=100000 * (i + 1),
+                active=i != 4
+            )
+
+    def read(self, response):
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_export_stream_active_products_as_ndjson(self):
+        response = self.client.get(reverse("product-export"))
+        self.assertEqual(response['Content-Type'], "application/x-ndjson")
+        rows = [json.loads(line) for line in self.read(response).splitlines()]
+        self.assertEqual([r['slug'] for r in rows], ["test-product-%d" % i for i in range(4)])
+        self.assertEqual(rows[0]['price'], "100000")
+        self.assertEqual(rows[0]['category'], self.category.pk)
+
+    def test_export_honor_product_filter(self):
+        response = self.client.get(reverse("product-export"), {'size': 'M', 'min_price': 300000})
+        rows = [json.loads(line) for line in self.read(response).splitlines()]
+        self.assertEqual([r['slug'] for r in rows], ["test-product-3"])
+
+    def test_export_csv_by_format_suffix(self):
+        response = self.client.get("/products/export.csv")
+        lines = self.read(response).splitlines()
+        self.assertEqual(lines[0], "title,slug,category,size,color,price,active,created,updated")
+        self.assertEqual(len(lines), 5)
+
+    def test_export_datetimes_in_api_format(self):
+        moment = datetime.datetime(2016, 7, 13, 6, 44, 0, 123456, tzinfo=timezone.utc)
+        Product.objects.get_queryset().filter(slug="test-product-3").update(updated=moment)
+        response = self.client.get(reverse("product-export"), {'size': 'M', 'min_price': 300000})
+        row = json.loads(self.read(response).splitlines()[0])
+        self.assertEqual(row['updated'], '2016-07-13T06:44:00.123Z')
+        self.assertEqual(row['updated'], json.loads(JSONRenderer().render({'at': moment}).decode('utf-8'))['at'])
+
+    def test_export_in_small_chunks_keep_every_row(self):
+        rows = list(export.iter_rows(Product.objects.all(), chunk_size=2))
+        self.assertEqual(len(rows), 4)
+
+    def test_export_products_command_write_file(self):
+        handle, path = tempfile.mkstemp()
+        os.close(handle)
+        try:
+            call_command('export_products', format='csv', output=path, max_price='200000')
+            with open(path) as f:
+                self.assertEqual(len(f.read().splitlines()), 3)
+        finally:
+            os.remove(path)
+
+
+class ColumnarExportTest(TestCase):
+
+    def setUp(self):
+        self.shirts = Category.objects.create(title="shirts", slug="shirts")
+        self.shoes = Category.objects.create(title="shoes", slug="shoes")
+        for i in range(6):
+            Product.objects.create(
+                title=u"product %d \u00e9" % i, size="M" if i % 2 else "S", color="Black",
+                category=self.shoes if i % 3 else self.shirts, price=100000 * (i + 1), active=i != 5,
+            )
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+        self.addCleanup(os.remove, self.path)
+
+    def test_round_trip_same_rows_as_json_export(self):
+        call_command('export_products', format='columnar', output=self.path)
+        expected = list(export.iter_rows(Product.objects.all()))
+        with columnar.ColumnarFile(self.path) as table:
+            self.assertEqual(len(table), 5)
+            self.assertEqual(table.names, list(export.EXPORT_COLUMNS))
+            rows = list(table.read(range(len(table))))
+            self.assertEqual(table.column('price'), [row[5] for row in expected])
+            self.assertEqual(table.columns['size']['dictionary'], ['S', 'M'])
+            self.assertEqual(table.columns['size']['code'], 'B')
+        for row, (title, slug, category, size, color, price, active, created, updated) in zip(rows, expected):
+            self.assertEqual(row, (title, slug, category, size, color, int(price), active,
+                                   created.replace(tzinfo=None), updated.replace(tzinfo=None)))
+
+    def test_filter_by_price_and_category(self):
+        call_command('export_products', format='columnar', output=self.path, size='S')
+        with columnar.ColumnarFile(self.path) as table:
+            slugs = lambda rows: [slug for slug, in table.read(rows, ['slug'])]
+            self.assertEqual(slugs(table.filter()), ['product-0-e', 'product-2-e', 'product-4-e'])
+            self.assertEqual(slugs(table.filter(min_price=200000, max_price=300000)), ['product-2-e'])
+            self.assertEqual(slugs(table.filter(category='shoes')), ['product-2-e', 'product-4-e'])
+            self.assertEqual(slugs(table.filter(category=self.shirts.pk, max_price=100000)), ['product-0-e'])
+            self.assertEqual(table.filter(category='missing'), [])
+
+    def test_empty_export_and_wrong_file(self):
+        call_command('export_products', format='columnar', output=self.path, min_price='9999999')
+        with columnar.ColumnarFile(self.path) as table:
+            self.assertEqual((len(table), table.filter(min_price=0)), (0, []))
+        with open(self.path, 'wb') as f:
+            f.write(b'{"title": "not columnar"}\n')
+        with self.assertRaises(ValueError):
+            columnar.ColumnarFile(self.path)
+
+
+class ImportCatalogTest(TestCase):
+
+    def setUp(self):
+        self.files = []
+
+    def tearDown(self):
+        for path in self.files:
+            os.remove(path)
+
+    def write_file(self, suffix, content):
+        handle, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(handle, 'wb') as f:
+            f.write(content.encode('utf-8'))
+        self.files.append(path)
+        return path
+
+    def import_catalog(self, *args, **kwargs):
+        out, err = StringIO(), StringIO()
+        call_command('import_catalog', *args, stdout=out, stderr=err, **kwargs)
+        return out.getvalue(), err.getvalue()
+
+    def test_import_categories_then_products_from_csv(self):
+        categories = self.write_file(".csv", "title,slug,description\nShirts,,all shirts\nShoes,shoes,\n")
+        self.import_catalog(categories, model='category')
+        self.assertEqual(sorted(Category.objects.values_list('slug', flat=True)), ["shirts", "shoes"])
+
+        products = self.write_file(".csv", (
+            "title,category,size,color,price\n"
+            "Blue Shirt,shirts,M,Blue,100000\n"
+            "Red Shoes,shoes,42,Red,250000\n"
+            "Lost Product,unknown,M,Red,1\n"
+        ))
+        out, err = self.import_catalog(products, batch_size=2)
+        self.assertIn("done: 2 created, 0 updated, 1 errors", out)
+        self.assertIn("line 4:", err)
+        product = Product.objects.get(slug="blue-shirt")
+        self.assertEqual(product.category.slug, "shirts")
+        self.assertEqual(product.color_normalized, "blue")
+
+    def test_import_ndjson_resume_from_offset(self):
+        Category.objects.create(title="Shirts", slug="shirts")
+        lines = [
+            json.dumps({"title": "Shirt %d" % i, "category": "shirts", "size": "M",
+                        "color": "Blue", "price": 1000 * i})
+            for i in range(5)
+        ]
+        path = self.write_file(".ndjson", "\n".join(lines) + "\n")
+        out, err = self.import_catalog(path, batch_size=2)
+        self.assertEqual(Product.objects.count(), 5)
+        # resume hint after first batch point at line 3
+        resume = out.splitlines()[0].split("resume with ")[1]
+        offset = int(resume.split()[0].split("=")[1])
+        self.assertEqual(resume.split()[1], "--start-line=3")
+
+        Product.objects.get_queryset().delete()
+        self.import_catalog(path, offset=offset, start_line=3)
+        self.assertEqual(
+            sorted(Product.objects.values_list('slug', flat=True)),
+            ["shirt-2", "shirt-3", "shirt-4"]
+        )
+
+    def test_import_report_category_of_wrong_type(self):
+        Category.objects.create(title="Shirts", slug="shirts")
+        lines = [
+            {"title": "Listed", "category": ["shirts"], "size": "M", "color": "Blue", "price": 1},
+            {"title": "Nested", "category": {"slug": "shirts"}, "size": "M", "color": "Blue", "price": 1},
+            {"title": "Shirt", "category": "shirts", "size": "M", "color": "Blue", "price": 1},
+        ]
+        path = self.write_file(".ndjson", "\n".join(json.dumps(line) for line in lines) + "\n")
+        out, err = self.import_catalog(path)
+        self.assertIn("done: 1 created, 0 updated, 2 errors", out)
+        self.assertIn("line 1:", err)
+        self.assertIn("Expected a category slug, received list.", err)
+        self.assertIn("received dict.", err)
+        self.assertEqual(list(Product.objects.values_list('slug', flat=True)), ["shirt"])
+
+    def test_import_skip_lines_before_start_line(self):
+        Category.objects.create(title="Shirts", slug="shirts")
+        path = self.write_file(".csv", (
+            "title,category,size,color,price\n"
+            "Shirt 1,shirts,M,Blue,1\n"
+            "Shirt 2,shirts,M,Blue,2\n"
+        ))
+        out, err = self.import_catalog(path, start_line=3)
+        self.assertEqual(list(Product.objects.values_list('slug', flat=True)), ["shirt-2"])
+
+
+class FastSerializerTest(TestCase):
+
+    class ReverseProductSerializer(ProductSerializer):
+        detail_url = serializers.HyperlinkedIdentityField(view_name='product-detail', lookup_field='slug')
+
+    class ReverseCategorySerializer(CategorySerializer):
+        products = serializers.HyperlinkedIdentityField(view_name='product-category-list', lookup_field='slug')
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.category = Category.objects.create(title="test category", slug="test-category")
+        Product.objects.create(title="test product", size="M", color="Black",
+                               category=self.category, price=199000)
+        Product.objects.create(title="other product", slug="other_product-2", size="L",
+                               color="Red", category=self.category, price=5, active=False)
+
+    def render(self, serializer_class, queryset, url):
+        request = Request(self.factory.get(url))
+        context = {'request': request, 'format': 'json' if url.endswith('.json') else None}
+        return JSONRenderer().render(serializer_class(queryset, many=True, context=context).data)
+
+    def test_output_is_byte_identical_to_reverse_per_row(self):
+        queryset = Product.objects.get_queryset().order_by('pk')
+        for url in ["/products/", "/products/?format=json", "/products/.json"]:
+            expected = self.render(self.ReverseProductSerializer, queryset, url)
+            self.assertEqual(self.render(ProductSerializer, queryset, url), expected)
+            self.assertEqual(self.render(FlatProductSerializer, queryset, url), expected)
+        self.assertIn(b'"detail_url":"http://testserver/products/test-product.json"', expected)
+
+    def test_category_link_is_byte_identical_to_reverse_per_row(self):
+        queryset = Category.objects.all()
+        self.assertEqual(
+            self.render(CategorySerializer, queryset, "/categories/"),
+            self.render(self.ReverseCategorySerializer, queryset, "/categories/")
+        )
+
+    def test_list_use_flat_serializer_and_retrieve_full_serializer(self):
+        view = ProductViewSet(action='list', request=Request(self.factory.get("/products/")), format_kwarg=None)
+        self.assertIs(view.get_serializer_class(), FlatProductSerializer)
+        view = ProductViewSet(action='list', request=Request(self.factory.post("/products/")), format_kwarg=None)
+        self.assertIs(view.get_serializer_class(), ProductSerializer)
+
+
+@override_settings(JOBS_EAGER=True)
+class CategoryStatsTest(TestCase):
+
+    def setUp(self):
+        self.shirts = Category.objects.create(title="shirts", slug="shirts")
+        self.shoes = Category.objects.create(title="shoes", slug="shoes")
+
+    def stats(self, category):
+        category = Category.objects.get(pk=category.pk)
+        return (category.active_product_count, category.min_price, category.max_price)
+
+    def test_save_and_delete_maintain_stats(self):
+        self.assertEqual(self.stats(self.shirts), (0, None, None))
+        cheap = create_product("cheap", self.shirts, 100)
+        expensive = create_product("expensive", self.shirts, 900)
+        create_product("hidden", self.shirts, 5, active=False)
+        self.assertEqual(self.stats(self.shirts), (2, 100, 900))
+
+        expensive.price = 500
+        expensive.save()
+        self.assertEqual(self.stats(self.shirts), (2, 100, 500))
+
+        cheap.category = self.shoes
+        cheap.save()
+        self.assertEqual(self.stats(self.shirts), (1, 500, 500))
+        self.assertEqual(self.stats(self.shoes), (1, 100, 100))
+
+        expensive.active = False
+        expensive.save()
+        self.assertEqual(self.stats(self.shirts), (0, None, None))
+
+        cheap.delete()
+        self.assertEqual(self.stats(self.shoes), (0, None, None))
+
+    def test_bulk_write_maintain_stats(self):
+        create_product("existing", self.shirts, 300)
+        rows = [
+            (0, {'title': "a", 'size': "M", 'color': "Red", 'price': 50, 'category': self.shirts}),
+            (1, {'title': "b", 'size': "M", 'color': "Red", 'price': 70, 'category': self.shoes}),
+            (2, {'title': "existing", 'size': "M", 'color': "Red", 'price': 1000, 'category': self.shoes}),
+        ]
+        bulk.write_products(rows, upsert=True)
+        self.assertEqual(self.stats(self.shirts), (1, 50, 50))
+        self.assertEqual(self.stats(self.shoes), (2, 70, 1000))
+
+    def test_rebuild_category_stats_command(self):
+        create_product("a", self.shirts, 100)
+        Category.objects.filter(pk=self.shirts.pk).update(active_product_count=42, min_price=None)
+        call_command('rebuild_category_stats', stdout=StringIO())
+        self.assertEqual(self.stats(self.shirts), (1, 100, 100))
+
+    def test_category_serializer_expose_stats(self):
+        create_product("a", self.shirts, 100)
+        request = APIRequestFactory().get(reverse('category-list'))
+        response = CategoryViewSet.as_view({'get': 'list'})(request)
+        response.render()
+        data = json.loads(response.content)[0]
+        self.assertEqual(data['active_product_count'], 1)
+        self.assertEqual(data['min_price'], "100")
+        self.assertEqual(data['max_price'], "100")
+
+
+class ProductQueryCountTest(TestCase):
+
+    def setUp(self):
+        clear_response_caches()
+        self.user = User.objects.create_superuser(username="nasa", email="mail@mail.com", password="topsecret")
+        self.categories = [Category.objects.create(title="category %d" % i, slug="category-%d" % i) for i in range(3)]
+        for i in range(12):
+            Product.objects.create(
+                title="product %d" % i, size="M", color="Black", price=100 + i,
+                category=self.categories[i % 3], creator=self.user, last_modified_by=self.user
+            )
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_product_list_query_count_not_depend_on_page_size(self):
+        for url in (reverse('product-list'), reverse('product-category-list', kwargs={'slug': 'category-0'})):
+            counts = {self.count_queries(url + '?format=json&page_size=%d' % size) for size in (1, 2, 10)}
+            self.assertEqual(len(counts), 1, url)
+
+    def test_listing_only_fetch_serialized_columns(self):
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(reverse('product-list') + '?format=json')
+        sql = context.captured_queries[-1]['sql']
+        self.assertNotIn('"updated"', sql)
+        self.assertNotIn('"color_normalized"', sql)
+
+    def test_admin_changelist_query_count_not_depend_on_rows(self):
+        self.client.login(username="nasa", password="topsecret")
+        url = reverse('admin:products_product_changelist')
+        many = self.count_queries(url)
+        Product.objects.get_queryset().filter(pk__gt=Product.objects.order_by('pk')[2].pk).delete()
+        self.assertEqual(self.count_queries(url), many)
+
+    def test_with_relations_load_category_and_users(self):
+        products = list(Product.objects.all().with_relations())
+        with self.assertNumQueries(0):
+            for product in products:
+                product.category.slug, product.creator.username, product.last_modified_by.username
+
+
+class ConditionalGetTest(TestCase):
+
+    def setUp(self):
+        clear_response_caches()
+        self.category = Category.objects.create(title="shirts", slug="shirts")
+        self.products = [
+            Product.objects.create(title="product %d" % i, size="M", color="Black", price=100 + i, category=self.category)
+            for i in range(3)
+        ]
+        past = timezone.make_aware(datetime.datetime(2016, 1, 1), timezone.utc)
+        Product.objects.get_queryset().update(updated=past)
+        Category.objects.update(updated=past)
+
+    def get(self, url, **headers):
+        return self.client.get(url, HTTP_ACCEPT='application/json', **headers)
+
+    def test_detail_if_none_match(self):
+        url = reverse('product-detail', kwargs={'slug': 'product-0'})
+        response = self.get(url)
+        etag = response['ETag']
+        self.assertEqual(response['Last-Modified'], 'Fri, 01 Jan 2016 00:00:00 GMT')
+
+        response = self.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(self.get(url, HTTP_IF_NONE_MATCH='W/' + etag).status_code, status.HTTP_304_NOT_MODIFIED)
+
+        product = Product.objects.get(slug='product-0')
+        product.price = 999
+        product.save()
+        response = self.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_list_not_modified_skip_serializer(self):
+        # collection state is cached with the responses
+        for url in (reverse('product-list'), reverse('product-category-list', kwargs={'slug': 'shirts'}),
+                    reverse('category-list')):
+            etag = self.get(url)['ETag']
+            with self.assertNumQueries(0):
+                response = self.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED, url)
+
+    def test_list_etag_follow_filters_and_removal(self):
+        url = reverse('product-list')
+        etag = self.get(url)['ETag']
+        self.assertNotEqual(self.get(url + '?min_price=101')['ETag'], etag)
+
+        # the removed product isn't the newest one, only the count changes
+        self.products[0].delete()
+        run_commit_hooks()
+        response = self.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(json.loads(response.content.decode('utf-8'))), 2)
+
+    def test_list_if_modified_since(self):
+        url = reverse('product-category-list', kwargs={'slug': 'shirts'})
+        last_modified = self.get(url)['Last-Modified']
+        response = self.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # a deleted row leave no updated behind, its category stats are bumped instead
+        self.products[1].delete()
+        run_commit_hooks()
+        response = self.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+@override_settings(PRODUCT_CHANGES_SAFETY_LAG=0)
+class ProductChangesTest(TestCase):
+
+    def setUp(self):
+        self.category = Category.objects.create(title="shirts", slug="shirts")
+        self.products = [
+            Product.objects.create(title="product %d" % i, size="M", color="Black", price=100 + i, category=self.category)
+            for i in range(5)
+        ]
+
+    def get_changes(self, **params):
+        response = self.client.get(reverse('product-changes'), dict(params, format='json'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return json.loads(response.content.decode('utf-8'))
+
+    def sync(self, since=None, page_size=2):
+        """
+        follow next links like a mirror would, return (ops, high water mark)
+        """
+        ops = []
+        params = {'page_size': page_size}
+        if since:
+            params['since'] = since
+        while True:
+            data = self.get_changes(**params)
+            ops += [(row['op'], row['id']) for row in data['results']]
+            if not data['next']:
+                return ops, data['high_water_mark']
+            params['since'] = data['high_water_mark']
+
+    def test_full_then_delta_sync(self):
+        ops, mark = self.sync()
+        self.assertEqual(ops, [('upsert', p.pk) for p in self.products])
+
+        ops, mark = self.sync(mark)
+        self.assertEqual(ops, [])
+
+        self.products[1].price = 500
+        self.products[1].save()
+        self.products[2].active = False
+        self.products[2].save()
+        removed_pk = self.products[3].pk
+        self.products[3].delete()
+        Product.objects.create(title="new", size="M", color="Red", price=1, category=self.category)
+        new_pk = Product.objects.get(slug="new").pk
+
+        ops, mark = self.sync(mark)
+        self.assertEqual(ops, [
+            ('upsert', self.products[1].pk),
+            ('delete', self.products[2].pk),
+            ('delete', removed_pk),
+            ('upsert', new_pk),
+        ])
+        self.assertEqual(self.sync(mark)[0], [])
+
+    def test_since_timestamp(self):
+        data = self.get_changes(since=self.products[2].updated.isoformat())
+        self.assertEqual([row['id'] for row in data['results']], [p.pk for p in self.products[3:]])
+        self.assertEqual(data['results'][0]['product']['slug'], 'product-3')
+
+    def test_same_timestamp_is_not_skipped_between_pages(self):
+        Product.objects.get_queryset().update(updated=self.products[0].updated)
+        ops, mark = self.sync(page_size=1)
+        self.assertEqual(sorted(pk for op, pk in ops), sorted(p.pk for p in self.products))
+
+    def test_tombstone_of_bulk_deactivation(self):
+        rows = [(0, {'title': "product 0", 'size': "M", 'color': "Black", 'price': 100,
+                     'category': self.category, 'active': False})]
+        mark = self.get_changes()['high_water_mark']
+        bulk.write_products(rows, upsert=True)
+        data = self.get_changes(since=mark)
+        self.assertEqual([(row['op'], row['reason']) for row in data['results']], [('delete', 'deactivated')])
+
+    def test_late_commit_is_not_skipped(self):
+        now = timezone.now()
+        Product.objects.get_queryset().update(updated=now - datetime.timedelta(seconds=60))
+        # committed first, stamped one second ago
+        Product.objects.get_queryset().filter(pk=self.products[4].pk).update(
+            updated=now - datetime.timedelta(seconds=1)
+        )
+        with self.settings(PRODUCT_CHANGES_SAFETY_LAG=5):
+            rows, mark, has_more = changes.get_changes(changes.BEGINNING, 100, now=now)
+            self.assertEqual([obj.pk for kind, obj in rows], [p.pk for p in self.products[:4]])
+            # stamped before products[4], committed after the first sync
+            Product.objects.get_queryset().filter(pk=self.products[0].pk).update(
+                updated=now - datetime.timedelta(seconds=3)
+            )
+            rows, mark, has_more = changes.get_changes(mark, 100, now=now + datetime.timedelta(seconds=10))
+        self.assertEqual([obj.pk for kind, obj in rows], [self.products[0].pk, self.products[4].pk])
+
+    def test_since_date(self):
+        Product.objects.get_queryset().filter(pk__in=[p.pk for p in self.products[:3]]).update(
+            updated=datetime.datetime(2016, 1, 1, 23, 59, tzinfo=timezone.utc)
+        )
+        Product.objects.get_queryset().filter(pk=self.products[3].pk).update(
+            updated=datetime.datetime(2016, 1, 2, tzinfo=timezone.utc)
+        )
+        data = self.get_changes(since='2016-01-02')
+        self.assertEqual([row['id'] for row in data['results']], [p.pk for p in self.products[3:]])
+
+    def test_invalid_since(self):
+        for since in ['garbage', '2016-13-01']:
+            response = self.client.get(reverse('product-changes'), {'since': since, 'format': 'json'})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('2016-07-13', json.loads(response.content.decode('utf-8'))['detail'])
+
+
+class ProductSearchTest(TestCase):
+    """
+    the index is updated by jobs, tests run the worker where a deployment has run_workers
+    """
+
+    def setUp(self):
+        caches['default'].clear()
+        self.shirts = Category.objects.create(title="Shirts", slug="shirts", description="cotton shirts for work")
+        self.shoes = Category.objects.create(title="Shoes", slug="shoes", description="leather shoes")
+        create_product("Black linen shirt", self.shirts, 150000)
+        create_product("White shirt", self.shirts, 100000)
+        create_product("Black running shoes", self.shoes, 300000)
+        create_product("Brown boots", self.shoes, 400000)
+        self.work()
+
+    def work(self):
+        Worker(name='test').run(once=True)
+
+    def search(self, **params):
+        response = self.client.get(reverse('product-search'), dict(params, format='json'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return json.loads(response.content.decode('utf-8'))
+
+    def slugs(self, **params):
+        return [row['slug'] for row in self.search(**params)['results']]
+
+    def test_rank_by_relevance(self):
+        # both terms beat one term, category text count too
+        self.assertEqual(self.slugs(q="white shirt"), ['white-shirt', 'black-linen-shirt'])
+        self.assertEqual(self.slugs(q="leather"), ['brown-boots', 'black-running-shoes'])
+        self.assertEqual(self.slugs(q="nothing"), [])
+
+    def test_postings_are_inner_joined(self):
+        # so the database can start from the postings of the query terms
+        sql = str(search.rank("black shirt").query)
+        self.assertIn('INNER JOIN "%s"' % SearchPosting._meta.db_table, sql)
+        self.assertNotIn('LEFT OUTER JOIN', sql)
+
+    def test_combine_with_filters_and_paginate(self):
+        self.assertEqual(self.slugs(q="black", max_price=200000), ['black-linen-shirt'])
+        data = self.search(q="black shirt", limit=1)
+        self.assertEqual(data['count'], 3)
+        self.assertEqual([row['slug'] for row in data['results']], ['black-linen-shirt'])
+        self.assertIsNotNone(data['next'])
+        self.assertIn('score', data['results'][0])
+
+    def test_index_follow_writes_once_the_worker_run(self):
+        product = Product.objects.get(slug='brown-boots')
+        product.title = "Brown shirt"
+        product.save()
+        self.assertNotIn('brown-boots', self.slugs(q="shirt"))
+        self.work()
+        self.assertIn('brown-boots', self.slugs(q="shirt"))
+
+        # leaving the catalog doesn't wait for the worker
+        product.active = False
+        product.save()
+        self.assertNotIn('brown-boots', self.slugs(q="shirt"))
+        Product.objects.get(slug='white-shirt').delete()
+        self.assertFalse(SearchPosting.objects.filter(product__slug='white-shirt').exists())
+
+        self.shoes.description = "sneakers"
+        self.shoes.save()
+        self.assertEqual(self.slugs(q="sneakers"), [])
+        self.work()
+        self.assertEqual(self.slugs(q="leather"), [])
+        self.assertEqual(self.slugs(q="sneakers"), ['black-running-shoes'])
+
+    def test_bulk_write_and_rebuild(self):
+        bulk.write_products([(0, {'title': "Striped shirt", 'size': "M", 'color': "Blue",
+                                  'price': 1000, 'category': self.shirts})])
+        self.work()
+        self.assertIn('striped-shirt', self.slugs(q="striped"))
+
+        SearchPosting.objects.clear()
+        self.assertEqual(self.slugs(q="striped"), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.slugs(q="striped"), ['striped-shirt'])
+
+    def test_missing_query(self):
+        response = self.client.get(reverse('product-search'), {'q': ' ', 'format': 'json'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ProductJobsTest(TestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        self.shirts = Category.objects.create(title="Shirts", slug="shirts")
+        self.shoes = Category.objects.create(title="Shoes", slug="shoes")
+
+    def stats(self, category):
+        category = Category.objects.get(pk=category.pk)
+        return (category.active_product_count, category.min_price, category.max_price)
+
+    def work(self):
+        Worker(name='test').run(once=True)
+
+    def search(self, q):
+        response = self.client.get(reverse('product-search'), {'q': q, 'format': 'json'})
+        return [row['slug'] for row in json.loads(response.content.decode('utf-8'))['results']]
+
+    @override_settings(JOBS_EAGER=False)
+    def test_stats_bounds_refreshed_without_worker(self):
+        products = [create_product("shirt %d" % i, self.shirts, 100 * (i + 1)) for i in range(10)]
+        for product in products[-5:]:
+            product.price -= 1000
+            product.save()
+        self.assertEqual(self.stats(self.shirts), (10, -400, 500))
+        products[0].delete()
+        products[1].category = self.shoes
+        products[1].save()
+        self.assertEqual(self.stats(self.shirts), (8, -400, 500))
+        self.assertEqual(self.stats(self.shoes), (1, 200, 200))
+        products[5].delete()
+        self.assertEqual(self.stats(self.shirts), (7, -300, 500))
+        self.assertFalse(Job.objects.filter(name=task_name(tasks.refresh_category_stats)).exists())
+
+    def test_search_index_follow_writes_through_worker(self):
+        boots = create_product("Brown boots", self.shoes, 1000)
+        bulk.write_products([(0, {'title': "Striped shirt", 'size': "M", 'color': "Blue",
+                                  'price': 1000, 'category': self.shirts})])
+        self.assertEqual(self.search("boots striped"), [])
+        self.work()
+        self.assertEqual(sorted(self.search("boots striped")), ['brown-boots', 'striped-shirt'])
+
+        self.shoes.title = "Footwear"
+        self.shoes.save()
+        boots.title = "Brown leather boots"
+        boots.save()
+        self.work()
+        self.assertEqual(self.search("footwear leather"), ['brown-boots'])
+        self.assertFalse(Job.objects.exclude(status=Job.DONE).exists())
+
+
+@override_settings(PRODUCT_PRICE_HISTOGRAM_EDGES=(100, 200, 500))
+class PriceHistogramTest(TestCase):
+
+    def setUp(self):
+        clear_response_caches()
+        lookups.lookup_cache.clear()
+        self.shirts = Category.objects.create(title="shirts", slug="shirts")
+        self.shoes = Category.objects.create(title="shoes", slug="shoes")
+        for title, price, category in [("a", 50, self.shirts), ("b", 150, self.shirts),
+                                        ("c", 180, self.shirts), ("d", 400, self.shoes)]:
+            create_product(title, category, price)
+
+    def buckets(self):
+        return sorted(
+            (category_id, int(lower), count)
+            for category_id, lower, count in CategoryPriceBucket.objects.values_list('category', 'lower', 'count')
+            if count
+        )
+
+    def assertBucketsMatchRows(self):
+        maintained = self.buckets()
+        CategoryPriceBucket.objects.rebuild()
+        self.assertEqual(maintained, self.buckets())
+
+    def get(self, url, **params):
+        response = self.client.get(url, dict(params, format='json'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return json.loads(response.content.decode('utf-8'))
+
+    def test_maintained_on_writes(self):
+        self.assertEqual(self.buckets(), [
+            (self.shirts.pk, 0, 1), (self.shirts.pk, 100, 2), (self.shoes.pk, 200, 1),
+        ])
+        product = Product.objects.get(slug='b')
+        product.price = 900
+        product.save()
+        moved = Product.objects.get(slug='c')
+        moved.category = self.shoes
+        moved.save()
+        hidden = Product.objects.get(slug='a')
+        hidden.active = False
+        hidden.save()
+        Product.objects.get(slug='d').delete()
+        create_product("e", self.shoes, 100, active=False)
+        self.assertEqual(self.buckets(), [(self.shirts.pk, 500, 1), (self.shoes.pk, 100, 1)])
+        self.assertBucketsMatchRows()
+
+    def test_maintained_by_bulk_writes(self):
+        rows = [(0, {'title': "f", 'size': "M", 'color': "Red", 'price': 600, 'category': self.shoes}),
+                (1, {'title': "b", 'size': "M", 'color': "Red", 'price': 10, 'category': self.shoes})]
+        bulk.write_products(rows, upsert=True)
+        self.assertEqual(self.buckets(), [
+            (self.shirts.pk, 0, 1), (self.shirts.pk, 100, 1),
+            (self.shoes.pk, 0, 1), (self.shoes.pk, 200, 1), (self.shoes.pk, 500, 1),
+        ])
+        self.assertBucketsMatchRows()
+
+    def test_rebuild_after_changing_edges(self):
+        with self.settings(PRODUCT_PRICE_HISTOGRAM_EDGES=(175,)):
+            call_command('rebuild_category_stats', stdout=StringIO())
+            self.assertEqual(self.buckets(), [(self.shirts.pk, 0, 2), (self.shirts.pk, 175, 1), (self.shoes.pk, 175, 1)])
+
+    def test_category_detail(self):
+        url = reverse('category-detail', kwargs={'slug': 'shirts'})
+        self.assertEqual(self.get(url)['price_histogram'], [
+            {'min': 0, 'max': 100, 'count': 1},
+            {'min': 100, 'max': 200, 'count': 2},
+            {'min': 200, 'max': 500, 'count': 0},
+            {'min': 500, 'max': None, 'count': 0},
+        ])
+        with self.assertNumQueries(0):
+            self.get(url)
+        # the cached category row is dropped by product writes
+        create_product("e", self.shirts, 600)
+        data = self.get(url)
+        self.assertEqual([row['count'] for row in data['price_histogram']], [1, 2, 0, 1])
+        self.assertEqual(data['active_product_count'], 4)
+        self.assertNotIn('price_histogram', self.get(reverse('category-list'))[0])
+
+    def test_list_count_estimate_and_price_bounds(self):
+        url = reverse('product-list')
+        data = self.get(url, page_size=1)
+        self.assertEqual((data['count_estimate'], data['price']), (4, {'min': '50', 'max': '400'}))
+        # whole ranges are exact
+        self.assertEqual(self.get(url, page_size=1, min_price=100, max_price=199)['count_estimate'], 2)
+        self.assertEqual(self.get(url, page_size=1, min_price=200)['count_estimate'], 1)
+        # bounds of the slider don't move with the price filter
+        self.assertEqual(self.get(url, page_size=1, min_price=200)['price'], {'min': '50', 'max': '400'})
+        self.assertIsNone(self.get(url, page_size=1, color='black')['count_estimate'])
+
+        data = self.get(reverse('product-category-list', kwargs={'slug': 'shirts'}), page_size=1)
+        self.assertEqual((data['count_estimate'], data['price']), (3, {'min': '50', 'max': '180'}))
+        # unpaginated list stays a plain array
+        self.assertIsInstance(self.get(url), list)
+
+    def test_estimate_count_interpolate_partial_ranges(self):
+        ranges = histogram.get_ranges({0: 10, 100: 20})
+        self.assertEqual(histogram.estimate_count(ranges, 50, 149), 30)
+        # half of [50, 99] and half of [100, 149]
+        self.assertEqual(histogram.estimate_count(ranges, 50, 149, min_price=75, max_price=124), 15)
+        self.assertEqual(histogram.estimate_count(ranges, 50, 149, min_price=150), 0)
+        self.assertEqual(histogram.estimate_count(ranges, None, None), 0)
+
+
+class ProductFacetsTest(TestCase):
+
+    def setUp(self):
+        clear_response_caches()
+        self.shirts = Category.objects.create(title="shirts", slug="shirts")
+        self.shoes = Category.objects.create(title="shoes", slug="shoes")
+        for title, size, color, price, category in [
+            ("a", "M", "Black", 40000, self.shirts),
+            ("b", "M", "black", 150000, self.shirts),
+            ("c", "L", "White", 150000, self.shirts),
+            ("d", "42", "Black", 2000000, self.shoes),
+        ]:
+            Product.objects.create(title=title, size=size, color=color, price=price, category=category)
+        Product.objects.create(title="hidden", size="S", color="Red", price=1, category=self.shoes, active=False)
+
+    def facets(self, url=None, **params):
+        response = self.client.get(url or reverse('product-facets'), dict(params, format='json'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return json.loads(response.content.decode('utf-8'))
+
+    def test_counts_in_one_query(self):
+        with self.assertNumQueries(1):
+            data = self.facets()
+        self.assertEqual(data['count'], 4)
+        self.assertEqual(data['size'], [{'value': 'M', 'count': 2}, {'value': '42', 'count': 1},
+                                        {'value': 'L', 'count': 1}])
+        self.assertEqual(data['color'], [{'value': 'black', 'count': 3}, {'value': 'white', 'count': 1}])
+        self.assertEqual([b['count'] for b in data['price']], [1, 0, 2, 0, 0, 1])
+        self.assertEqual(data['price'][0], {'min': 0, 'max': 50000, 'count': 1})
+        self.assertEqual(data['price'][-1], {'min': 1000000, 'max': None, 'count': 1})
+
+    def test_filters_and_category(self):
+        data = self.facets(size="M", max_price=100000)
+        self.assertEqual(data['count'], 1)
+        url = reverse('product-category-facets', kwargs={'slug': 'shirts'})
+        self.assertEqual(self.facets(url)['count'], 3)
+
+    def test_cached_until_product_write(self):
+        self.facets(color="black")
+        with self.assertNumQueries(0):
+            self.facets(color="black", format='json', page_size=10)
+        Product.objects.create(title="e", size="S", color="Black", price=10, category=self.shoes)
+        run_commit_hooks()
+        self.assertEqual(self.facets(color="black")['count'], 4)
+
+
+class CategorySnapshotTest(TestCase):
+
+    def setUp(self):
+        clear_response_caches()
+        self.shirts = Category.objects.create(title="shirts", slug="shirts")
+        self.shoes = Category.objects.create(title="shoes", slug="shoes")
+        for title, size, color, price in [
+            ("a", "M", "Black", 40000), ("b", "M", "Navy, black", 150000),
+            ("c", "L", "White", 150000), ("d", "XL", "Red", 300000),
+        ]:
+            Product.objects.create(title=title, size=size, color=color, price=price, category=self.shirts)
+        Product.objects.create(title="hidden", size="M", color="Black", price=1, category=self.shirts, active=False)
+        run_commit_hooks()
+
+    def get(self, slug='shirts', **params):
+        response = self.client.get(reverse('product-category-list', kwargs={'slug': slug}), dict(params, format='json'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return json.loads(response.content.decode('utf-8'))
+
+    def slugs(self, **params):
+        return [row['slug'] for row in self.get(**params)]
+
+    def test_same_output_as_database(self):
+        for params in [{}, {'size': 'M'}, {'color': 'BLACK'}, {'min_price': '100000', 'max_price': '150000'},
+                       {'color': 'bl', 'size': 'M'}, {'min_price': 'abc'}]:
+            from_snapshot = self.get(**params)
+            with self.settings(PRODUCT_CATEGORY_SNAPSHOTS=False):
+                self.assertEqual(from_snapshot, self.get(**params), params)
+
+    def test_served_without_query(self):
+        self.get()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.slugs(max_price='100000'), ['a'])
+        # pagination still goes to the database, after the conditional get aggregates
+        # and the price histogram summary
+        with self.assertNumQueries(4):
+            self.get(page_size=2)
+
+    def test_patched_on_product_write(self):
+        self.get()
+        product = Product.objects.get(slug='a')
+        product.price = 500000
+        product.save()
+        Product.objects.create(title="e", size="S", color="Green", price=1000, category=self.shirts)
+        Product.objects.get(slug='c').delete()
+        deactivated = Product.objects.get(slug='d')
+        deactivated.active = False
+        deactivated.save()
+        moved = Product.objects.get(slug='b')
+        moved.category = self.shoes
+        moved.save()
+        run_commit_hooks()
+
+        with self.assertNumQueries(0):
+            data = self.get()
+        self.assertEqual([row['slug'] for row in data], ['a', 'e'])
+        self.assertEqual(data[0]['price'], '500000')
+        self.assertEqual(self.slugs(slug='shoes'), ['b'])
+
+    def test_stale_build_is_not_served(self):
+        slug = 'shirts'
+        snapshot = snapshots.build(slug)
+        # a write landing while another process patch the snapshot only bump the version
+        cache.get_generations_cache().add(snapshots.lock_key(slug), 1, 10)
+        Product.objects.create(title="e", size="S", color="Green", price=1000, category=self.shirts)
+        run_commit_hooks()
+        cache.get_generations_cache().delete(snapshots.lock_key(slug))
+        self.assertNotEqual(snapshots.get_version(slug), snapshot['version'])
+        self.assertIn('e', self.slugs())
+
+    def test_rebuilt_without_atomic_add(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        file_based = dict(settings.CACHES, generations={
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory,
+        })
+        with self.settings(CACHES=file_based):
+            snapshot = snapshots.build('shirts')
+            Product.objects.create(title="e", size="S", color="Green", price=1000, category=self.shirts)
+            run_commit_hooks()
+            stored = cache.get_cache().get(snapshots.snapshot_key('shirts'))
+            self.assertNotIn('e', [row.slug for row in stored['rows']])
+            self.assertNotEqual(snapshots.get_version('shirts'), snapshot['version'])
+            self.assertIn('e', self.slugs())
+
+    def test_patched_once_the_write_commit(self):
+        self.get()
+        Product.objects.create(title="e", size="S", color="Green", price=1000, category=self.shirts)
+        self.assertNotIn('e', [row.slug for row in cache.get_cache().get(snapshots.snapshot_key('shirts'))['rows']])
+        run_commit_hooks()
+        self.assertIn('e', self.slugs())
+
+        try:
+            with transaction.atomic():
+                Product.objects.create(title="rolled back", size="S", color="Green", price=1, category=self.shirts)
+                raise ValueError
+        except ValueError:
+            pass
+        run_commit_hooks()
+        with self.assertNumQueries(0):
+            self.assertNotIn('rolled-back', self.slugs())
+
+    def test_bulk_write_and_category_slug_change(self):
+        self.get()
+        bulk.write_products([(0, {'title': "f", 'size': "M", 'color': "Red", 'price': 1, 'category': self.shirts})])
+        run_commit_hooks()
+        self.assertIn('f', self.slugs())
+
+        self.shirts.slug = 'tops'
+        self.shirts.save()
+        run_commit_hooks()
+        self.assertEqual(self.get(slug='shirts'), [])
+        self.assertIn('f', self.slugs(slug='tops'))
+
+
+class CatalogSnapshotTest(TestCase):
+
+    def setUp(self):
+        clear_response_caches()
+        self.shirts = Category.objects.create(title="shirts", slug="shirts", description="cotton")
+        self.shoes = Category.objects.create(title="shoes", slug="shoes", active=False)
+        Category.objects.create(title="empty", slug="empty")
+        for title, size, color, price, category in [
+            ("a", "M", "Black", 40000, self.shirts), ("b", "M", "Navy, black", 150000, self.shoes),
+            ("c", "L", "White", 150000, self.shirts), ("d", "XL", "Red", 300000, self.shirts),
+            ("e", "M", "black", 150000, self.shirts), ("f", "S", "Blue", 90000, self.shoes),
+        ]:
+            Product.objects.create(title=title, size=size, color=color, price=price, category=category)
+        Product.objects.create(title="hidden", size="M", color="Black", price=1, category=self.shirts, active=False)
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+        self.addCleanup(os.remove, self.path)
+        call_command('build_catalog_snapshot', output=self.path, stdout=StringIO())
+        self.settings_override = self.settings(CATALOG_SNAPSHOT_PATH=self.path, CATALOG_SNAPSHOT_MAX_AGE=None)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def get(self, url, **params):
+        # pagination links already carry their parameters
+        response = self.client.get(url, params if '?' in url else dict({'format': 'json'}, **params))
+        return response, json.loads(response.content.decode('utf-8'))
+
+    def from_database(self, url, **params):
+        with self.settings(CATALOG_SNAPSHOT_PATH=None):
+            response, data = self.get(url, **params)
+            self.assertNotIn(catalog.SNAPSHOT_HEADER, response)
+            return data
+
+    def assertSameAsDatabase(self, url, **params):
+        response, data = self.get(url, **params)
+        self.assertEqual(response[catalog.SNAPSHOT_HEADER], format_datetime(catalog.get_snapshot().built))
+        expected = self.from_database(url, **params)
+        if isinstance(data, list):
+            # unpaginated database lists have no defined order
+            data, expected = [sorted(rows, key=lambda row: row.get('slug')) for rows in (data, expected)]
+        self.assertEqual(data, expected, (url, params))
+
+    def test_same_output_as_database(self):
+        for url in [reverse('category-list'), reverse('category-detail', kwargs={'slug': 'shirts'}),
+                    reverse('product-detail', kwargs={'slug': 'c'})]:
+            self.assertSameAsDatabase(url)
+        for url in [reverse('product-list'), reverse('product-category-list', kwargs={'slug': 'shirts'}),
+                    reverse('product-category-list', kwargs={'slug': 'missing'})]:
+            for params in [{}, {'size': 'M'}, {'color': 'BLACK'}, {'min_price': '90000', 'max_price': '150000'},
+                           {'color': 'bl', 'size': 'M', 'max_price': '150000'}, {'min_price': 'abc'},
+                           {'format': 'fastjson'}]:
+                self.assertSameAsDatabase(url, **params)
+
+    def test_keyset_pages_same_as_database(self):
+        for url in [reverse('product-list'), reverse('product-category-list', kwargs={'slug': 'shirts'})]:
+            for params in [{}, {'ordering': '-price'}, {'ordering': 'price', 'size': 'M'},
+                           {'ordering': '-created', 'min_price': '90000'}]:
+                response, page = self.get(url, page_size=2, **params)
+                expected = self.from_database(url, page_size=2, **params)
+                while True:
+                    self.assertIn(catalog.SNAPSHOT_HEADER, response)
+                    self.assertEqual(
+                        (page['results'], page['next'], page['previous'], page['price']),
+                        (expected['results'], expected['next'], expected['previous'], expected['price']),
+                    )
+                    if not page['next']:
+                        break
+                    next_url = page['next']
+                    response, page = self.get(next_url)
+                    expected = self.from_database(next_url)
+                if page['previous']:
+                    previous_url = page['previous']
+                    response, page = self.get(previous_url)
+                    self.assertEqual(page['results'], self.from_database(previous_url)['results'])
+
+    def test_exact_count_on_price_filters(self):
+        url = reverse('product-category-list', kwargs={'slug': 'shirts'})
+        response, page = self.get(url, page_size=1, min_price='100000', max_price='150000')
+        self.assertEqual((page['count_estimate'], page['price']), (2, {'min': '40000', 'max': '300000'}))
+        response, page = self.get(url, page_size=1, size='M')
+        self.assertIsNone(page['count_estimate'])
+
+    def test_snapshot_swap_and_fallbacks(self):
+        detail = reverse('product-detail', kwargs={'slug': 'g'})
+        Product.objects.create(title="g", size="M", color="Green", price=1000, category=self.shirts)
+        Product.objects.filter(slug='a').update(price=1)
+
+        response, data = self.get(reverse('product-list'), min_price='1', max_price='1')
+        self.assertEqual(data, [])
+        # missing from the snapshot, read from the database
+        response, data = self.get(detail)
+        self.assertEqual((response.status_code, data['slug']), (status.HTTP_200_OK, 'g'))
+        self.assertNotIn(catalog.SNAPSHOT_HEADER, response)
+
+        previous = catalog.get_snapshot()
+        catalog.build(self.path)
+        self.assertIsNot(catalog.get_snapshot(), previous)
+        self.assertFalse(os.path.exists('%s.%d.tmp' % (self.path, os.getpid())))
+        response, data = self.get(reverse('product-list'), min_price='1', max_price='1000')
+        self.assertEqual([row['slug'] for row in data], ['a', 'g'])
+        self.assertEqual(response[catalog.AGE_HEADER], '0')
+        # the previous mapping stay readable
+        self.assertEqual(previous.product(previous.find('a')).price, 40000)
+
+        with self.settings(CATALOG_SNAPSHOT_MAX_AGE=-1):
+            response, data = self.get(reverse('product-list'))
+            self.assertNotIn(catalog.SNAPSHOT_HEADER, response)
+        response, data = self.get(reverse('product-list'), search='ignored')
+        self.assertNotIn(catalog.SNAPSHOT_HEADER, response)
+
+    def test_conditional_get(self):
+        url = reverse('product-detail', kwargs={'slug': 'c'})
+        response, data = self.get(url)
+        with self.settings(CATALOG_SNAPSHOT_PATH=None):
+            self.assertEqual(self.client.get(url, {'format': 'json'})['ETag'], response['ETag'])
+        response = self.client.get(url, {'format': 'json'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertIn(catalog.SNAPSHOT_HEADER, response)
+
+        url = reverse('category-list')
+        response, data = self.get(url)
+        response = self.client.get(url, {'format': 'json'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+
+class LookupCacheTest(TestCase):
+
+    def setUp(self):
+        clear_response_caches()
+        lookups.lookup_cache.clear()
+        self.user = User.objects.create_user(username="nasa", email="mail@mail.com", password="topsecret")
+        self.category = Category.objects.create(title="shirts", slug="shirts")
+        self.product = Product.objects.create(title="Black shirt", size="M", color="Black", price=1000,
+                                              category=self.category)
+        handle, self.log_path = tempfile.mkstemp()
+        os.close(handle)
+        self.addCleanup(os.remove, self.log_path)
+
+    def get(self, url):
+        return self.client.get(url, HTTP_ACCEPT='application/json')
+
+    def test_detail_served_from_cache(self):
+        for url in (reverse('product-detail', kwargs={'slug': 'black-shirt'}),
+                    reverse('category-detail', kwargs={'slug': 'shirts'})):
+            self.assertEqual(self.get(url).status_code, status.HTTP_200_OK)
+            hits = lookups.lookup_cache.stats.get()['row_hits']
+            with self.assertNumQueries(0):
+                self.assertEqual(self.get(url).status_code, status.HTTP_200_OK)
+            self.assertEqual(lookups.lookup_cache.stats.get()['row_hits'], hits + 1)
+
+    def test_writes_invalidate(self):
+        url = reverse('product-detail', kwargs={'slug': 'black-shirt'})
+        self.get(url)
+        self.product.price = 2000
+        self.product.save()
+        self.assertEqual(json.loads(self.get(url).content.decode('utf-8'))['price'], '2000')
+
+        self.client.login(username="nasa", password="topsecret")
+        response = self.client.patch(url, json.dumps({'slug': 'dark-shirt'}), content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+        product = Product.objects.get(slug='dark-shirt')
+        product.active = False
+        product.save()
+        self.assertEqual(self.get(reverse('product-detail', kwargs={'slug': 'dark-shirt'})).status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+    def test_other_process_invalidation(self):
+        with self.settings(LOOKUP_CACHE_INVALIDATION_LOG=self.log_path, LOOKUP_CACHE_INVALIDATION_LOG_MAX_BYTES=60):
+            other = lookups.LookupCache()
+            other.sync()
+            slugs, rows = other.get_caches('products.product')
+            slugs.set('black-shirt', self.product.pk)
+            rows.set(self.product.pk, self.product)
+
+            lookups.lookup_cache.log.publish(['products.product %d black-shirt' % self.product.pk])
+            other.sync()
+            self.assertIsNone(slugs.get('black-shirt'))
+            self.assertIsNone(rows.get(self.product.pk))
+
+            # once the log is replaced, the other process drop everything
+            slugs.set('black-shirt', self.product.pk)
+            lookups.lookup_cache.log.publish(['products.category 1 %s' % ('x' * 60)])
+            lookups.lookup_cache.log.publish(['products.category 2 shoes'])
+            other.sync()
+            self.assertIsNone(slugs.get('black-shirt'))
+
+    def test_lru_eviction(self):
+        lru = lookups.LRUCache(2)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+        self.assertEqual((lru.get('a'), lru.get('b'), lru.get('c')), (1, None, 3))
+
+    def test_cache_stats_report_lookups(self):
+        out = StringIO()
+        call_command('cache_stats', stdout=out)
+        self.assertIn("slug lookup cache", out.getvalue())
+
+
+class RequestMetricsTest(TestCase):
+
+    def setUp(self):
+        clear_response_caches()
+        metrics.clear()
+        self.category = Category.objects.create(title="shirts", slug="shirts")
+        Product.objects.create(title="Black shirt", size="M", color="Black", price=1000, category=self.category)
+
+    def get(self, url, data=None):
+        return self.client.get(url, data or {}, HTTP_ACCEPT='application/json')
+
+    def test_metrics_per_view(self):
+        self.get(reverse('product-list'), {'color': 'black', 'page_size': 10})
+        self.get(reverse('product-detail', kwargs={'slug': 'black-shirt'}))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        body = response.content.decode('utf-8')
+        self.assertIn('salestock_requests_total{view="product-list",method="GET",filters="color",status="200"} 1', body)
+        self.assertIn('salestock_request_duration_seconds_count{view="product-detail",method="GET",filters=""} 1', body)
+        self.assertIn('salestock_response_bytes_bucket{view="product-detail",method="GET",filters="",le="+Inf"} 1', body)
+        # the scrape itself is left out
+        self.assertNotIn('view="metrics"', body)
+
+    def test_queries_and_serializer_time(self):
+        url = reverse('product-list')
+        with CaptureQueriesContext(connection) as queries:
+            self.get(url)
+        labels = (('view', 'product-list'), ('method', 'GET'), ('filters', ''))
+        counts, total = metrics.request_queries.series[labels]
+        self.assertEqual(total, len(queries))
+        self.assertGreater(metrics.request_query_duration.series[labels][1], 0)
+        self.assertGreater(metrics.request_serializer_duration.series[labels][1], 0)
+
+    def test_slow_request_logged(self):
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        # replace the console handler, keep the test output clean
+        self.addCleanup(setattr, metrics.logger, 'handlers', metrics.logger.handlers)
+        metrics.logger.handlers = [handler]
+
+        with self.settings(REQUEST_METRICS_SLOW_SECONDS=None):
+            self.get(reverse('product-list'))
+        self.assertEqual(records, [])
+        clear_response_caches()
+        with self.settings(REQUEST_METRICS_SLOW_SECONDS=0):
+            self.get(reverse('product-list'))
+        self.assertEqual(len(records), 1)
+        message = records[0].getMessage()
+        self.assertIn('(product-list)', message)
+        self.assertIn('SELECT', message)
+
+    def test_metrics_allowed_ips(self):
+        with self.settings(REQUEST_METRICS_ALLOWED_IPS=['10.0.0.1']):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, status.HTTP_403_FORBIDDEN)
+            self.assertEqual(
+                self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.1').status_code, status.HTTP_200_OK
+            )
+
+
+class FastJSONTest(TestCase):
+
+    def setUp(self):
+        clear_response_caches()
+        self.category = Category.objects.create(title="shirts", slug="shirts")
+        Product.objects.create(title="Black shirt", size="M", color="Black", price=1000, category=self.category)
+        Product.objects.create(title=u"Caf\xe9 shirt", slug="cafe-shirt", size="L", color="Red", price=2500,
+                               category=self.category)
+        Product.objects.create(title="Grey shirt", size="M", color="Grey", price=500, category=self.category)
+
+    def get(self, url, data):
+        response = self.client.get(url, data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+
+    def test_same_json_as_default_renderer(self):
+        for url, data in [
+            (reverse('product-list'), {}),
+            (reverse('product-list'), {'size': 'M'}),
+            (reverse('product-list'), {'page_size': 2}),
+            (reverse('product-category-list', kwargs={'slug': 'shirts'}), {}),
+            (reverse('product-detail', kwargs={'slug': 'black-shirt'}), {}),
+            (reverse('category-list'), {}),
+        ]:
+            # links keep the format of the request
+            expected = self.get(url, dict(data, format='json')).content.decode('utf-8')
+            expected = json.loads(expected.replace('format=json', 'format=fastjson'))
+            response = self.get(url, dict(data, format='fastjson'))
+            self.assertEqual(response['Content-Type'], 'application/json')
+            self.assertEqual(json.loads(response.content.decode('ascii')), expected)
+
+    def test_list_rendered_from_rows(self):
+        content = self.get(reverse('product-list'), {'format': 'fastjson'}).content
+        self.assertIn(b'"title":"Caf\\u00e9 shirt"', content)
+        self.assertIn(b'"price":"2500"', content)
+        self.assertIn(b'"active":true', content)
+        self.assertIn(b'"detail_url":"http://testserver/products/black-shirt/?format=fastjson"', content)
+
+    def test_renderer_encode_decimal_and_datetime(self):
+        moment = datetime.datetime(2016, 7, 13, 6, 44, 0, 123456, tzinfo=timezone.utc)
+        renderer = FastJSONRenderer()
+        self.assertEqual(
+            json.loads(renderer.render({'price': Decimal('12.50'), 'at': moment}).decode('ascii')),
+            {'price': '12.50', 'at': '2016-07-13T06:44:00.123Z'}
+        )
+        self.assertEqual(
+            renderer.render(Rows(('a', 'b'), [(Decimal('3'), moment), (True, None)])),
+            b'[{"a":"3","b":"2016-07-13T06:44:00.123Z"},{"a":true,"b":null}]'
+        )
+
+    def test_parser_keep_decimals(self):
+        parser = FastJSONParser()
+        self.assertEqual(parser.parse(BytesIO(b'{"price": 19.99, "n": 2}')), {'price': Decimal('19.99'), 'n': 2})
+        with self.assertRaises(ParseError):
+            parser.parse(BytesIO(b'{"price": '))
+        # product writes only, every other view keep the default parsers
+        self.assertIsInstance(ProductViewSet().get_parsers()[0], FastJSONParser)
+        self.assertIsInstance(CategoryViewSet().get_parsers()[0], JSONParser)
+
+
+@skipIf(evented is None, "gevent isn't installed")
+@override_settings(DEBUG_PROPAGATE_EXCEPTIONS=True)
+class EventedServerTest(TestCase):
+
+    def setUp(self):
+        self.category = Category.objects.create(title="shirts", slug="shirts")
+        Product.objects.create(title="black shirt", size="M", color="Black", category=self.category, price=1000)
+        self.application = evented.CatalogApplication(self.handler)
+        self.addCleanup(self.application.pool.kill)
+        self.connection = connections['default']
+        self.addCleanup(setattr, self.connection, 'allow_thread_sharing', False)
+
+    def handler(self, environ, start_response):
+        # the in-memory test database can't be opened twice, pool threads use
+        # the test connection like LiveServerTestCase does
+        self.connection.allow_thread_sharing = True
+        connections['default'] = self.connection
+        return evented.wsgi_handler(environ, start_response)
+
+    def call(self, method, path):
+        environ = getattr(RequestFactory(), method)(path, HTTP_ACCEPT='application/json').environ
+        started = []
+        body = b''.join(self.application(environ, lambda status, headers: started.extend([status, dict(headers)])))
+        return started[0], started[1], body
+
+    def test_catalog_reads_run_in_the_pool(self):
+        status, headers, body = self.call('get', '/products/black-shirt/')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(json.loads(body.decode('utf-8'))['title'], "black shirt")
+        status, headers, body = self.call('head', '/categories/')
+        self.assertEqual((status, body), ('200 OK', b''))
+        self.assertIn('ETag', headers)
+
+    def test_everything_else_stays_on_wsgi(self):
+        self.assertEqual(self.call('post', '/products/')[0], '405 Method Not Allowed')
+        self.assertEqual(self.call('get', '/products/export/')[0], '404 Not Found')
+        self.assertEqual(self.call('get', '/nowhere/')[0], '404 Not Found')
+        self.application.pending = self.application.max_pending
+        self.assertEqual(self.call('get', '/categories/')[0], '503 Service Unavailable')
+
+
+@override_settings(DATABASE_REPLICAS=['replica_0'], DATABASE_REPLICA_LAG=2)
+class ReplicaRouterTest(TestCase):
+
+    def setUp(self):
+        clear_response_caches()
+        self.factory = RequestFactory()
+        self.middleware = routers.ReplicaMiddleware()
+        self.router = routers.ReplicaRouter()
+
+    def route(self, method, path, **extra):
+        """
+        run the middleware around a request without calling the view,
+        return (alias of reads, response)
+        """
+        request = getattr(self.factory, method)(path, **extra)
+        self.middleware.process_request(request)
+        match = resolve(path)
+        self.middleware.process_view(request, match.func, match.args, match.kwargs)
+        alias = self.router.db_for_read(Product)
+        response = self.middleware.process_response(request, HttpResponse())
+        self.assertIsNone(self.router.db_for_read(Product))
+        return alias, response
+
+    def test_reads_on_viewsets_go_to_replica(self):
+        self.assertEqual(self.route('get', '/products/')[0], 'replica_0')
+        self.assertEqual(self.route('get', '/products/black-shirt/')[0], 'replica_0')
+        self.assertEqual(self.route('head', '/categories/')[0], 'replica_0')
+        self.assertIsNone(self.route('get', '/products/category/shirts/')[0])
+        self.assertIsNone(self.route('delete', '/products/black-shirt/')[0])
+        self.assertEqual(self.router.db_for_write(Product), 'default')
+        self.assertFalse(self.router.allow_migrate('replica_0', 'products'))
+        self.assertIsNone(self.router.allow_migrate('default', 'products'))
+
+    def test_primary_after_write(self):
+        alias, response = self.route('post', '/products/')
+        cookie = response.cookies[routers.STICKY_COOKIE]
+        self.assertEqual(cookie['max-age'], 2)
+        # writer and every other client read the primary until the replica caught up
+        self.assertIsNone(self.route('get', '/products/')[0])
+        clear_response_caches()
+        self.factory.cookies[routers.STICKY_COOKIE] = cookie.value
+        self.assertIsNone(self.route('get', '/products/')[0])
+        self.factory.cookies[routers.STICKY_COOKIE] = '%.3f' % (time.time() - 1)
+        self.assertEqual(self.route('get', '/products/')[0], 'replica_0')
+
+    def test_check_refuse_per_process_cache_with_replicas(self):
+        locmem = dict(settings.CACHES, generations={'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'})
+        with self.settings(CACHES=locmem, DEBUG=True, DATABASE_REPLICAS=['replica_0']):
+            self.assertEqual([error.id for error in checks.check_response_cache(None)], ['products.E002'])
+        with self.settings(CACHES=locmem, DEBUG=True, DATABASE_REPLICAS=[]):
+            self.assertEqual(checks.check_response_cache(None), [])
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_without_replicas(self):
+        alias, response = self.route('post', '/products/')
+        self.assertNotIn(routers.STICKY_COOKIE, response.cookies)
+        self.assertIsNone(self.route('get', '/products/')[0])
@@ -15,13 +15,33 @@ product_detail = views.ProductViewSet.as_view({
     'delete': 'destroy'
 })
 
+product_bulk = views.ProductViewSet.as_view({
+    'post': 'bulk'
+})
+
+product_changes = views.ProductViewSet.as_view({
+    'get': 'changes'
+})
+
+product_search = views.ProductViewSet.as_view({
+    'get': 'search'
+})
+
 product_list_by_category  = views.ProductCategoryList.as_view()
+product_export = views.ProductExportView.as_view()
+product_facets = views.ProductFacetsView.as_view()
 
 
 urlpatterns = [
     url(r'^$', product_list, name="product-list"),
+    url(r'^bulk/$', product_bulk, name="product-bulk"),
+    url(r'^export/$', product_export, name="product-export"),
+    url(r'^changes/$', product_changes, name="product-changes"),
+    url(r'^search/$', product_search, name="product-search"),
+    url(r'^facets/$', product_facets, name="product-facets"),
     url(r'^(?P<slug>[-\w]+)/$', product_detail, name="product-detail"),
     url(r'^category/(?P<slug>[-\w]+)/$', product_list_by_category, name='product-category-list'),
+    url(r'^category/(?P<slug>[-\w]+)/facets/$', product_facets, name='product-category-facets'),
 
 ]
 
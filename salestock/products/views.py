@@ -1,19 +1,71 @@
-from .models import Category, Product
-from .serializers import CategorySerializer, ProductSerializer
+from collections import OrderedDict, namedtuple
+from django.conf import settings
+from django.http import Http404, StreamingHttpResponse
+from django.views.generic import View
+from .conditional import ConditionalGetMixin
+from .cache import ResponseCacheMixin, SCOPE_CATEGORIES, SCOPE_PRODUCTS, category_scope, get_or_compute
+from .models import Category, Product, color_ngrams, search_terms, COLOR_NGRAM_SIZE
+from .pagination import KeysetPagination, SearchPagination
+from .histogram import PriceSummaryMixin
+from .serializers import CategorySerializer, CategoryDetailSerializer, ProductSerializer, ProductBulkSerializer, FlatProductSerializer
+from . import bulk, changes, export, facets, search
+from .catalog import CategorySnapshotMixin, ProductSnapshotMixin
+from .lookups import CachedLookupMixin
+from .renderers import FastJSONParser, FastRowsListMixin, Rows
+from .snapshots import SnapshotListMixin
 import django_filters
 from rest_framework import generics, viewsets, filters
+from rest_framework.parsers import FormParser, MultiPartParser
+from rest_framework.exceptions import ParseError
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(CategorySnapshotMixin, ConditionalGetMixin, ResponseCacheMixin, CachedLookupMixin,
+                      viewsets.ModelViewSet):
     """
-    Viewset for categories
+    Viewset for categories,
+    reads are answered from the catalog snapshot when there is one, see products.catalog
     """
     lookup_field = 'slug'
+    use_read_replica = True
+    cache_scopes = (SCOPE_CATEGORIES,)
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
 
+    def get_serializer_class(self):
+        if self.action == 'retrieve':
+            return CategoryDetailSerializer
+        return super(CategoryViewSet, self).get_serializer_class()
+
+    def get_queryset(self):
+        queryset = super(CategoryViewSet, self).get_queryset()
+        if self.action == 'retrieve':
+            return queryset.prefetch_related('price_buckets')
+        return queryset
+
+
+class ColorFilter(django_filters.CharFilter):
+    """
+    same result as color__icontains, but narrow the candidates first through
+    ProductColorNgram index, so only matching rows are checked instead of
+    scanning every product with LIKE '%color%'
+    """
+    max_ngrams = 4
+
+    def filter(self, qs, value):
+        if value in ([], (), {}, None, ''):
+            return qs
+        needle = Product.normalize_color(value)
+        if len(needle) < COLOR_NGRAM_SIZE or not getattr(settings, 'PRODUCT_COLOR_NGRAM_INDEX', True):
+            return qs.filter(color__icontains=value)
+        # every n-gram is a separate indexed join, few of them is selective enough
+        for gram in sorted(color_ngrams(needle))[:self.max_ngrams]:
+            qs = qs.filter(color_ngrams__gram=gram)
+        return qs.filter(color_normalized__contains=needle)
+
 
 class ProductFilter(filters.FilterSet):
     """
@@ -21,22 +73,63 @@ class ProductFilter(filters.FilterSet):
     """
     min_price = django_filters.NumberFilter(name='price', lookup_type='gte')
     max_price = django_filters.NumberFilter(name='price', lookup_type='lte')
-    color = django_filters.CharFilter(name='color', lookup_type='icontains')
+    color = ColorFilter(name='color', lookup_type='icontains')
 
     class Meta:
         model = Product
         fields = ('color', 'size', 'min_price', 'max_price')
 
 
-class ProductViewSet(viewsets.ModelViewSet):
+# what SlugIdentityField need to build detail_url of a values_list row
+ProductRef = namedtuple('ProductRef', 'pk slug')
+
+
+class ProductViewSet(ProductSnapshotMixin, ConditionalGetMixin, ResponseCacheMixin, CachedLookupMixin,
+                     FastRowsListMixin, PriceSummaryMixin, viewsets.ModelViewSet):
     """
-    Return REST action for products
+    Return REST action for products,
+    list and retrieve are answered from the catalog snapshot when there is one, see products.catalog
     """
     lookup_field = 'slug'
+    use_read_replica = True
+    cache_scopes = (SCOPE_PRODUCTS,)
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     filter_backends = (filters.DjangoFilterBackend,)
     filter_class = ProductFilter
+    pagination_class = KeysetPagination
+    # product writes and bulk keep prices exact, other views use the stock JSONParser
+    parser_classes = (FastJSONParser, FormParser, MultiPartParser)
+
+    def get_serializer_class(self):
+        # browsable api ask serializer for the POST form with the same action
+        if self.action == 'list' and self.request.method == 'GET':
+            return FlatProductSerializer
+        return super(ProductViewSet, self).get_serializer_class()
+
+    def get_queryset(self):
+        queryset = super(ProductViewSet, self).get_queryset()
+        if self.action == 'list' and self.request.method == 'GET':
+            return queryset.for_listing()
+        return queryset.with_relations()
+
+    def get_parent_queryset(self):
+        # removing an active product bump its category, see CategoryManager
+        return Category.objects.all()
+
+    def get_collection_state_scopes(self):
+        # category writes bump only the categories scope
+        return self.get_cache_scopes() + (SCOPE_CATEGORIES,)
+
+    # same keys as FlatProductSerializer, detail_url aside
+    row_fields = ('title', 'slug', 'category', 'size', 'color', 'price', 'active')
+
+    def get_rows(self, queryset):
+        detail_url = FlatProductSerializer(context=self.get_serializer_context()).detail_url_field
+        return Rows(self.row_fields + ('detail_url',), [
+            row[1:] + (detail_url.to_representation(ProductRef(row[0], row[2])),)
+            for row in queryset.values_list('pk', *self.row_fields)
+        ])
 
     """
     Auto populate the creator field with current user that create the product
@@ -50,18 +143,229 @@ class ProductViewSet(viewsets.ModelViewSet):
     def perform_update(self, serializer):
         serializer.save(last_modified_by=self.request.user)
 
+    bulk_batch_size = 500
+
+    def bulk(self, request, *args, **kwargs):
+        """
+        create many products in one request, body is a json array or
+        ndjson stream (Content-Type: application/x-ndjson).
+        with ?upsert=1 rows with existing slug are updated instead of rejected.
+        every batch is written in its own transaction, invalid rows are
+        reported by row number without aborting the other rows
+        url:
+            http://localhost/products/bulk/
+        """
+        upsert = request.query_params.get('upsert') in ('1', 'true')
+        created = updated = 0
+        errors = []
+        for offset, chunk in bulk.iter_chunks(self.get_bulk_rows(request), self.bulk_batch_size):
+            serializer = ProductBulkSerializer(
+                data=chunk,
+                many=True,
+                context=dict(self.get_serializer_context(), categories=self.get_bulk_categories(chunk))
+            )
+            serializer.is_valid(raise_exception=True)
+            errors += [(offset + index, detail) for index, detail in serializer.row_errors]
+            rows = [(offset + index, data) for index, data in serializer.validated_data]
+            batch_created, batch_updated, batch_errors = bulk.write_products(rows, request.user, upsert)
+            created += batch_created
+            updated += batch_updated
+            errors += batch_errors
+
+        return Response({
+            'created': created,
+            'updated': updated,
+            'errors': [{'row': row, 'errors': detail} for row, detail in sorted(errors)],
+        })
+
+    def search(self, request, *args, **kwargs):
+        """
+        full text search over product title and category title and description,
+        ranked by relevance (BM25). accept every product list filter, paginated
+        with ?limit= and ?offset=
+        url:
+            http://localhost/products/search/?q=black+shirt&max_price=200000
+        """
+        query = request.query_params.get('q', '')
+        if not search_terms(query):
+            raise ParseError('Missing search query ?q=.')
+
+        ranked = search.rank(query, self.filter_queryset(Product.objects.all()))
+        paginator = SearchPagination()
+        page = paginator.paginate_queryset(ranked, request, view=self)
+        products = Product.objects.get_queryset().for_listing().in_bulk([row['id'] for row in page])
+        serializer = FlatProductSerializer(context=self.get_serializer_context())
+        results = []
+        for row in page:
+            if row['id'] not in products:
+                # deleted since it was ranked
+                continue
+            data = serializer.to_representation(products[row['id']])
+            data['score'] = round(row['score'], 4)
+            results.append(data)
+        return paginator.get_paginated_response(results)
+
+    changes_page_size = 500
+    changes_max_page_size = 5000
+
+    def changes(self, request, *args, **kwargs):
+        """
+        delta sync, products created, updated or removed after ?since=
+        (ISO 8601 timestamp or date, or the high_water_mark of the previous response).
+        follow `next` while it's set, then store high_water_mark for the next sync
+        url:
+            http://localhost/products/changes/?since=2016-07-13T06:44:00Z
+        """
+        try:
+            mark = changes.decode_mark(request.query_params.get('since'))
+        except ValueError:
+            raise ParseError(
+                'Invalid since, expected an ISO 8601 timestamp (2016-07-13T06:44:00Z), '
+                'a date (2016-07-13) or the high_water_mark of a previous response.'
+            )
+        try:
+            limit = min(int(request.query_params['page_size']), self.changes_max_page_size)
+        except (KeyError, ValueError):
+            limit = self.changes_page_size
+        if limit <= 0:
+            limit = self.changes_page_size
+
+        rows, mark, has_more = changes.get_changes(mark, limit)
+        serializer = FlatProductSerializer(context=self.get_serializer_context())
+        results = []
+        for kind, obj in rows:
+            if kind == changes.UPSERT:
+                results.append(OrderedDict((
+                    ('op', 'upsert'), ('id', obj.pk), ('timestamp', obj.updated),
+                    ('product', serializer.to_representation(obj)),
+                )))
+            else:
+                results.append(OrderedDict((
+                    ('op', 'delete'), ('id', obj.product_id), ('timestamp', obj.removed),
+                    ('slug', obj.slug), ('reason', obj.reason),
+                )))
+
+        high_water_mark = changes.encode_mark(mark)
+        next_url = None
+        if has_more:
+            next_url = replace_query_param(request.build_absolute_uri(), 'since', high_water_mark)
+        return Response(OrderedDict((
+            ('high_water_mark', high_water_mark),
+            ('next', next_url),
+            ('results', results),
+        )))
 
+    def get_bulk_rows(self, request):
+        if request.content_type.startswith('application/x-ndjson'):
+            return bulk.iter_ndjson(request.stream)
+        if not isinstance(request.data, list):
+            raise ParseError('Expected a list of products.')
+        return request.data
 
-class ProductCategoryList(generics.ListAPIView):
+    def get_bulk_categories(self, rows):
+        category_ids = set()
+        for row in rows:
+            try:
+                category_ids.add(int(row.get('category')))
+            except (AttributeError, TypeError, ValueError):
+                pass
+        return Category.objects.in_bulk(list(category_ids))
+
+
+
+class ProductCategoryList(ProductSnapshotMixin, ConditionalGetMixin, ResponseCacheMixin, SnapshotListMixin,
+                          PriceSummaryMixin, generics.ListAPIView):
     """
-    return the product filtered from url kwargs:
+    return the product filtered from url kwargs,
+    GET are answered from the catalog snapshot when there is one (see products.catalog),
+    otherwise unpaginated GET are answered from the category snapshot, see products.snapshots:
     url:
         http://localhost/products/category/<slug>
     """
     serializer_class = ProductSerializer
     filter_backends = (filters.DjangoFilterBackend,)
     filter_class = ProductFilter
+    pagination_class = KeysetPagination
+    snapshot_by_category = True
+
+    def get_cache_scopes(self):
+        return (category_scope(self.kwargs['slug']),)
+
+    def get_serializer_class(self):
+        if self.request.method == 'GET':
+            return FlatProductSerializer
+        return super(ProductCategoryList, self).get_serializer_class()
+
+    def get_parent_queryset(self):
+        return Category.objects.filter(slug=self.kwargs['slug'])
+
+    def get_collection_state(self, queryset):
+        snapshot, rows = self.get_snapshot_rows()
+        if snapshot is None:
+            return super(ProductCategoryList, self).get_collection_state(queryset)
+        return snapshot['updated'], len(rows)
 
     def get_queryset(self):
         category_slug = self.kwargs['slug']
-        return Product.objects.filter_by_category(category_slug)
+        queryset = Product.objects.filter_by_category(category_slug)
+        if self.request.method == 'GET':
+            return queryset.for_listing()
+        return queryset.with_relations()
+
+
+class ProductFacetsView(generics.GenericAPIView):
+    """
+    products count per size, color and price range for the current filter
+    selection, computed in one query and cached until a product write
+    url:
+        http://localhost/products/facets/?max_price=200000
+        http://localhost/products/category/<slug>/facets/
+    """
+    filter_backends = (filters.DjangoFilterBackend,)
+    filter_class = ProductFilter
+
+    def get_queryset(self):
+        if 'slug' in self.kwargs:
+            return Product.objects.filter_by_category(self.kwargs['slug'])
+        return Product.objects.all()
+
+    def get_cache_scopes(self):
+        if 'slug' in self.kwargs:
+            return (category_scope(self.kwargs['slug']),)
+        return (SCOPE_PRODUCTS,)
+
+    def get(self, request, *args, **kwargs):
+        # only filter parameters change the counts
+        names = ProductFilter.base_filters.keys()
+        signature = 'facets:%s?%r' % (
+            self.kwargs.get('slug', ''),
+            sorted((k, v) for k, v in request.query_params.lists() if k in names)
+        )
+        data = get_or_compute(
+            self.get_cache_scopes(), signature,
+            lambda: facets.compute_facets(self.filter_queryset(self.get_queryset()))
+        )
+        return Response(data)
+
+
+class ProductExportView(View):
+    """
+    stream the whole active catalog, filtered with ProductFilter parameters,
+    as ndjson (default) or csv without building the list in memory.
+    plain django view, so ?format= isn't taken by rest framework content negotiation
+    url:
+        http://localhost/products/export/?format=csv&min_price=100000
+        http://localhost/products/export.csv
+    """
+    def get(self, request, *args, **kwargs):
+        export_format = kwargs.get('format') or request.GET.get('format', 'ndjson')
+        if export_format not in export.EXPORT_FORMATS:
+            raise Http404("Unknown export format")
+
+        queryset = ProductFilter(request.GET, queryset=Product.objects.all()).qs
+        response = StreamingHttpResponse(
+            export.iter_export(queryset, export_format),
+            content_type=export.EXPORT_FORMATS[export_format]
+        )
+        response['Content-Disposition'] = 'attachment; filename="products.%s"' % export_format
+        return response
@@ -0,0 +1,107 @@
+"""
+evented server for the read-only catalog endpoints, served next to
+salestock.wsgi which keep serving everything:
+    python -m salestock.evented --bind 127.0.0.1:8001
+
+connections are handled by the gevent loop, only the django request itself
+(database and rendering) run in a bounded pool of EVENTED_THREADS real threads.
+a slow client then holds a greenlet instead of a whole worker while its
+response is sent. GET and HEAD on the EVENTED_VIEWS url names are served,
+other requests get 404 or 405 and belong to the WSGI side.
+nothing is monkey patched, django and the database drivers run unchanged in
+the pool threads.
+"""
+import argparse
+import os
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "salestock.settings")
+
+from django.core.wsgi import get_wsgi_application  # noqa: E402
+
+wsgi_handler = get_wsgi_application()
+
+from django.conf import settings  # noqa: E402
+from django.core.urlresolvers import Resolver404, resolve  # noqa: E402
+from gevent.pywsgi import WSGIServer  # noqa: E402
+from gevent.threadpool import ThreadPool  # noqa: E402
+
+
+def plain_response(status, text, headers=()):
+    return status, [('Content-Type', 'text/plain; charset=utf-8')] + list(headers), text.encode('utf-8')
+
+
+class CatalogApplication(object):
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.pool = ThreadPool(getattr(settings, 'EVENTED_THREADS', 8))
+        self.views = set(getattr(settings, 'EVENTED_VIEWS', ()))
+        self.max_pending = getattr(settings, 'EVENTED_MAX_PENDING', 1000)
+        # only touched from greenlets of the loop thread
+        self.pending = 0
+
+    def __call__(self, environ, start_response):
+        status, headers, body = self.respond(environ)
+        start_response(status, headers)
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            return []
+        # the server write it from the loop, a slow reader only park its greenlet
+        return [body]
+
+    def respond(self, environ):
+        """
+        return (status, headers, body), the request is only handed to a
+        thread when it's a read on a catalog endpoint
+        """
+        if environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+            return plain_response('405 Method Not Allowed', "read-only entry point", [('Allow', 'GET, HEAD')])
+        try:
+            match = resolve(environ.get('PATH_INFO') or '/')
+        except Resolver404:
+            match = None
+        if match is None or match.url_name not in self.views:
+            return plain_response('404 Not Found', "not found")
+        if self.pending >= self.max_pending:
+            return plain_response('503 Service Unavailable', "too many pending requests", [('Retry-After', '1')])
+
+        self.pending += 1
+        try:
+            return self.pool.apply(self.call_handler, (environ,))
+        finally:
+            self.pending -= 1
+
+    def call_handler(self, environ):
+        """
+        run the django request in a pool thread, the whole body is built here
+        so the loop only has bytes to send
+        """
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = status
+            started['headers'] = headers
+
+        response = self.handler(environ, start_response)
+        try:
+            body = b''.join(response)
+        finally:
+            if hasattr(response, 'close'):
+                response.close()
+        return started['status'], [(str(name), str(value)) for name, value in started['headers']], body
+
+
+application = CatalogApplication(wsgi_handler)
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arguments.add_argument('--bind', default='127.0.0.1:8001', help="host:port to listen on")
+    arguments.add_argument('--quiet', action='store_true', help="no access log")
+    args = arguments.parse_args()
+    host, port = args.bind.rsplit(':', 1)
+    server = WSGIServer((host, int(port)), application, log=None if args.quiet else 'default')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/1.9/ref/settings/
 """
 
 import os
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -47,12 +48,15 @@ THIRDPARTY_APPS = [
 
 PROJECT_APPS = [
     'cms',
+    'jobs',
     'products',
 ]
 
 INSTALLED_APPS = DJANGO_APPS + THIRDPARTY_APPS + PROJECT_APPS
 
 MIDDLEWARE_CLASSES = [
+    'products.metrics.MetricsMiddleware',
+    'products.routers.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -87,13 +91,108 @@ WSGI_APPLICATION = 'salestock.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/1.9/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+# DATABASE_PROFILE environment variable pick the backend:
+#   sqlite (default) local file, DATABASE_REPLICA_NAMES=a.sqlite3,b.sqlite3 add
+#   read replicas (copies of the primary file) to try the replica routing locally
+#   postgres, configured by DATABASE_NAME, DATABASE_USER, DATABASE_PASSWORD,
+#   DATABASE_HOST, DATABASE_PORT and DATABASE_REPLICA_HOSTS=host1,host2
+DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE', 'sqlite')
+
+if DATABASE_PROFILE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DATABASE_NAME', 'salestock'),
+            'USER': os.environ.get('DATABASE_USER', 'salestock'),
+            'PASSWORD': os.environ.get('DATABASE_PASSWORD', ''),
+            # point HOST/PORT to pgbouncer (transaction pooling) to share
+            # connections between processes
+            'HOST': os.environ.get('DATABASE_HOST', 'localhost'),
+            'PORT': os.environ.get('DATABASE_PORT', '5432'),
+            # seconds a connection is kept open between requests
+            'CONN_MAX_AGE': int(os.environ.get('DATABASE_CONN_MAX_AGE', 600)),
+        }
+    }
+    replicas = [dict(DATABASES['default'], HOST=host)
+                for host in os.environ.get('DATABASE_REPLICA_HOSTS', '').split(',') if host]
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        }
     }
+    replicas = [dict(DATABASES['default'], NAME=name)
+                for name in os.environ.get('DATABASE_REPLICA_NAMES', '').split(',') if name]
+
+for index, replica in enumerate(replicas):
+    # tests run every replica against the test database
+    DATABASES['replica_%d' % index] = dict(replica, TEST={'MIRROR': 'default'})
+
+# GET on views with use_read_replica go to one of these, see products.routers
+DATABASE_REPLICAS = sorted(alias for alias in DATABASES if alias.startswith('replica_'))
+DATABASE_ROUTERS = ['products.routers.ReplicaRouter']
+# seconds reads stay on the primary after a write: for the writing client
+# (read your writes) and for everyone (caches are never filled from a lagging
+# replica), set it above the replication lag. any write reset it for every
+# client, replicas only help when writes are further apart
+DATABASE_REPLICA_LAG = 2
+
+
+# Cache
+# https://docs.djangoproject.com/en/1.9/topics/cache/
+# response cache hold rendered responses, computed collection data and category
+# snapshots, any of them can be culled. generations cache hold the small keys
+# that must survive: scope generations, snapshot versions and locks, hit/miss
+# stats and the replica last write marker, every process must share it.
+# local memory is only the default for DEBUG without read replicas, a file based
+# cache otherwise, which has no atomic add or incr: snapshots are rebuilt
+# instead of patched and stats are approximate. memcached or redis is required
+# with more than one process, ex:
+#   GENERATIONS_CACHE_BACKEND=django.core.cache.backends.memcached.MemcachedCache
+#   GENERATIONS_CACHE_LOCATION=127.0.0.1:11211
+#   RESPONSE_CACHE_BACKEND=django.core.cache.backends.memcached.MemcachedCache
+#   RESPONSE_CACHE_LOCATION=127.0.0.1:11212
+# give generations their own instance (memcached evict, redis without eviction)
+# so large responses never push them out.
+# `python manage.py check` fail when generations use a per process backend without DEBUG
+
+if DEBUG and not DATABASE_REPLICAS:
+    CACHE_DEFAULT_BACKEND = 'django.core.cache.backends.locmem.LocMemCache'
+    CACHE_DEFAULT_LOCATION = 'salestock-%s'
+else:
+    CACHE_DEFAULT_BACKEND = 'django.core.cache.backends.filebased.FileBasedCache'
+    CACHE_DEFAULT_LOCATION = os.path.join(tempfile.gettempdir(), 'salestock-%s')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'responses': {
+        'BACKEND': os.environ.get('RESPONSE_CACHE_BACKEND', CACHE_DEFAULT_BACKEND),
+        'LOCATION': os.environ.get('RESPONSE_CACHE_LOCATION', CACHE_DEFAULT_LOCATION % 'responses'),
+    },
+    'generations': {
+        'BACKEND': os.environ.get('GENERATIONS_CACHE_BACKEND', CACHE_DEFAULT_BACKEND),
+        'LOCATION': os.environ.get('GENERATIONS_CACHE_LOCATION', CACHE_DEFAULT_LOCATION % 'generations'),
+    },
 }
 
+# default backends drop a random third of their entries past MAX_ENTRIES (300
+# unless set): responses above the distinct listing urls times formats plus one
+# snapshot per category, generations far above twice the categories so they are
+# never culled. memcached and redis OPTIONS mean something else, set them apart
+if 'RESPONSE_CACHE_BACKEND' not in os.environ:
+    CACHES['responses']['OPTIONS'] = {'MAX_ENTRIES': int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 10000))}
+if 'GENERATIONS_CACHE_BACKEND' not in os.environ:
+    CACHES['generations']['OPTIONS'] = {'MAX_ENTRIES': 100000}
+
+RESPONSE_CACHE_ALIAS = 'responses'
+RESPONSE_CACHE_GENERATIONS_ALIAS = 'generations'
+
+# seconds, 0 disable response cache
+RESPONSE_CACHE_TIMEOUT = 300
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.9/ref/settings/#auth-password-validators
@@ -137,5 +236,109 @@ STATIC_URL = '/static/'
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
-    )
-}
\ No newline at end of file
+    ),
+    # ?format=fastjson, see products.renderers
+    'DEFAULT_RENDERER_CLASSES': (
+        'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+        'products.renderers.FastJSONRenderer',
+    ),
+}
+
+
+# Products
+
+# maintain n-gram lookup table for substring search on product color,
+# run `python manage.py rebuild_color_index` after switching it on
+PRODUCT_COLOR_NGRAM_INDEX = True
+
+# maintain the inverted index behind /products/search/,
+# run `python manage.py rebuild_search_index` after switching it on
+PRODUCT_SEARCH_INDEX = True
+# seconds the document count and average length used for ranking are cached
+PRODUCT_SEARCH_STATS_TIMEOUT = 60
+
+# upper bounds of the price ranges counted by /products/facets/,
+# the last range has no upper bound
+PRODUCT_PRICE_BUCKETS = (50000, 100000, 200000, 500000, 1000000)
+
+# edges of the per category price histograms behind the count estimate and
+# price bounds of paginated product lists, and category detail price_histogram.
+# run `python manage.py rebuild_category_stats` after changing them
+PRODUCT_PRICE_HISTOGRAM_EDGES = (25000, 50000, 100000, 150000, 200000, 300000, 500000, 1000000)
+
+# serve /products/category/<slug>/ from a per category snapshot kept in the
+# response cache, patched on every product write
+PRODUCT_CATEGORY_SNAPSHOTS = True
+PRODUCT_CATEGORY_SNAPSHOT_TIMEOUT = 3600
+
+# seconds /products/changes/ stay behind now, rows are stamped before their
+# transaction commit, set it above the longest product write transaction
+PRODUCT_CHANGES_SAFETY_LAG = 5
+
+# read-only catalog snapshot written by `python manage.py build_catalog_snapshot`,
+# GET on product and category lists and details are answered from it when the
+# file exist. None disable it. snapshots older than CATALOG_SNAPSHOT_MAX_AGE
+# seconds are ignored (None for no limit), reads go to the database again
+CATALOG_SNAPSHOT_PATH = os.environ.get('CATALOG_SNAPSHOT_PATH') or None
+CATALOG_SNAPSHOT_MAX_AGE = None
+
+# per process LRU caches for product and category detail lookups by slug,
+# processes of a host share invalidations through an append only log file
+LOOKUP_CACHE = True
+LOOKUP_CACHE_SIZE = 1000
+LOOKUP_CACHE_INVALIDATION_LOG = os.environ.get(
+    'LOOKUP_CACHE_INVALIDATION_LOG',
+    os.path.join(tempfile.gettempdir(), 'salestock-lookup-invalidations.log')
+)
+
+# per view request histograms on /metrics, from products.metrics.MetricsMiddleware.
+# /metrics answer these addresses only, every address when empty
+REQUEST_METRICS = True
+REQUEST_METRICS_ALLOWED_IPS = [
+    ip for ip in os.environ.get('REQUEST_METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',') if ip
+]
+# seconds, requests slower than this are logged with their SQL, None disable the log
+REQUEST_METRICS_SLOW_SECONDS = 1.0
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'products.metrics': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+        },
+        'jobs.worker': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+        },
+    },
+}
+
+# Jobs
+
+# search indexing and category stats refresh after product writes are queued
+# for `python manage.py run_workers`, JOBS_EAGER run them inside the request
+# instead (no worker needed, slower writes)
+JOBS_EAGER = os.environ.get('JOBS_EAGER', '') == '1'
+# jobs of one task claimed and run together
+JOBS_BATCH_SIZE = 100
+# seconds between polls of an empty queue
+JOBS_POLL_INTERVAL = 1.0
+# seconds after which a running job is considered lost and queued again
+JOBS_TIMEOUT = 300
+# seconds done jobs are kept for /jobs/
+JOBS_KEEP_DONE = 86400
+
+# salestock.evented serve GET and HEAD on these url names, the rest stays on WSGI
+EVENTED_VIEWS = ['product-list', 'product-detail', 'product-category-list', 'category-list', 'category-detail']
+# threads running django requests for the evented server loop
+EVENTED_THREADS = 8
+# requests waiting for a thread beyond this are answered 503
+EVENTED_MAX_PENDING = 1000
@@ -0,0 +1,11 @@
+"""
+settings for `python manage.py test --settings=salestock.test_settings`, every
+cache in local memory whatever the environment (read replicas, shared cache
+variables), tests never read or clear a cache other processes use.
+"""
+from .settings import *  # noqa
+
+CACHES = {
+    alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'salestock-test-%s' % alias}
+    for alias in CACHES
+}
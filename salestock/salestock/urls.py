@@ -16,7 +16,9 @@ Including another URLconf
 
 from django.conf.urls import url, include
 from django.contrib import admin
+from jobs.views import JobStatusView
 from products import views
+from products.metrics import MetricsView
 from rest_framework.urlpatterns import format_suffix_patterns
 
 category_list = views.CategoryViewSet.as_view({
@@ -34,6 +36,8 @@ category_detail = views.CategoryViewSet.as_view({
 
 urlpatterns = [
     url(r'^admin/', admin.site.urls),
+    url(r'^metrics$', MetricsView.as_view(), name='metrics'),
+    url(r'^jobs/$', JobStatusView.as_view(), name='job-status'),
     url(r'^api-auth/', include('rest_framework.urls', namespace='rest_framework')),
     url(r'^products/', include('products.urls')),
     url(r'^categories/$', category_list, name="category-list"),